@@ -0,0 +1,83 @@
+'''
+Benchmarks of the input pipeline (without the neural network). They use the
+data set and the parameters defined in 'utils.py'. Example:
+    python benchmark.py SF loader --workers 1 2 4 8 16 24
+    python benchmark.py SF extract -n 1000
+'''
+
+import time, argparse
+import utils, data_gen
+from DataQuery.DataWrapper import H5_Pool
+
+# Number of frames/sec read by the parallel loader according to the number of
+# worker processes. The first pass (serial) also warms up the page cache.
+def bench_parallel_loader(data, workers = [1, 2, 4, 8, 16, 24], nb_samples = 500):
+    config = dict(utils.config[data])
+    config['input_mode'] = 'PARALLEL'
+    data_generator = data_gen.Data_Gen(data, config, training=True, max_pic_size=[3000, 3000])
+    data_generator.gen_batch_dataset(take_random_files=True)
+    data_generator.stream_index = data_generator.stream_index[:nb_samples]
+
+    start = time.time()
+    n = sum(1 for _ in data_generator.stream_generator())
+    elapsed = time.time() - start
+    print('Serial: {:.1f} frames/sec ({} frames in {:.2f}s)'.format(n/elapsed, n, elapsed))
+    for nb_workers in workers:
+        data_generator.nb_workers = nb_workers
+        start = time.time()
+        n = sum(1 for _ in data_generator.parallel_generator())
+        elapsed = time.time() - start
+        print('{} workers: {:.1f} frames/sec ({} frames in {:.2f}s)'.format(nb_workers, n/elapsed, n, elapsed))
+
+# Frames/sec of 'Data_Gen._extract_frame', with a new array for each frame or
+# with a buffer reused (channel indices resolved once per video). Also prints
+# how many times the buffer had to grow.
+def bench_extract_frame(data, nb_samples = 500):
+    config = dict(utils.config[data])
+    config['input_mode'] = 'STREAMING'
+    data_generator = data_gen.Data_Gen(data, config, training=True, max_pic_size=[3000, 3000])
+    data_generator.gen_batch_dataset()
+    frames = []
+    for (file_path, vid_key, frame_keys, _, _) in data_generator.stream_index:
+        frames += [(file_path, vid_key, frame_key) for frame_key in frame_keys]
+    frames = frames[:nb_samples]
+    segs = data_generator.segs
+
+    def run(reuse_buffer):
+        buffer = None
+        nb_allocs = 0
+        last_vid = None
+        for (file_path, vid_key, frame_key) in frames:
+            with H5_Pool.open(file_path) as db:
+                frame = db[vid_key][frame_key]
+                if(not reuse_buffer):
+                    data_gen.Data_Gen._extract_frame(frame['channels'], frame.attrs['SEGS'], segs)
+                    continue
+                if((file_path, vid_key) != last_vid):
+                    channel_index = data_gen.Data_Gen._channel_indices(frame.attrs['SEGS'], segs)
+                    last_vid = (file_path, vid_key)
+                previous = buffer
+                buffer, out = data_gen.Data_Gen._frame_buffer(buffer, frame['channels'].shape[0:2] + (len(segs),))
+                nb_allocs += int(buffer is not previous)
+                data_gen.Data_Gen._extract_frame(frame['channels'], None, segs, False, out, channel_index)
+        return nb_allocs if reuse_buffer else len(frames)
+
+    for reuse_buffer in [False, True]:
+        run(reuse_buffer) # warms up the page cache and the HDF5 handles
+        start = time.time()
+        nb_allocs = run(reuse_buffer)
+        elapsed = time.time() - start
+        print('{}: {:.1f} frames/sec, {} frame allocations ({} frames)'.format(
+                'Buffer reused' if reuse_buffer else 'New array', len(frames)/elapsed, nb_allocs, len(frames)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_type", type=str, help="Set the working data set.", choices=["SF", "SF_encoded"])
+    parser.add_argument("bench", type=str, help="Set the benchmark to run.", choices=["loader", "extract"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8, 16, 24], help="Set the numbers of worker processes tested.")
+    parser.add_argument("-n", "--nb_samples", type=int, default=500, help="Set the number of samples read in each run.")
+    args = parser.parse_args()
+    if(args.bench == 'loader'):
+        bench_parallel_loader(args.data_type, args.workers, args.nb_samples)
+    elif(args.bench == 'extract'):
+        bench_extract_frame(args.data_type, args.nb_samples)
@@ -0,0 +1,94 @@
+'''
+Samples clips (consecutive frames) of the videos kept in memory, so that 1
+video gives several samples for the LRCN and LSTM models. A clip is only a
+triplet of indexes (video, first frame, distance to the event): its frames are
+a view of the video, never copied. The clips of a video are defined by:
+    window:    nb of frames / clip
+    stride:    nb of frames between the beginnings of 2 clips
+    lead_time: nb of frames between the end of the last clip and the end of
+               the video (the event occurs in the last frame)
+    label:     'VIDEO'   every clip has the label of its video
+               'HORIZON' a clip has the label of its video if it ends at most
+                         'horizon' frames before the event, 'quiet_label'
+                         (no flare) otherwise
+The videos are taken in a random order and their clips are mixed by a shuffle
+buffer of 'shuffle_buffer' clips (0: the clips are given in order).
+'''
+
+import numpy as np
+from feature_array import Feature_Array
+
+class Clip_Sampler:
+
+    window = None
+    stride = None
+    lead_time = None
+    label_policy = None # 'VIDEO' or 'HORIZON'
+    horizon = None
+    quiet_label = None
+    shuffle_buffer = None
+    random_state = None
+
+    def __init__(self, window, stride = 1, lead_time = 0, label_policy = 'VIDEO', horizon = 0,
+                 quiet_label = 0, shuffle_buffer = 0, random_state = None):
+        assert window > 0 and stride > 0 and lead_time >= 0
+        assert label_policy in {'VIDEO', 'HORIZON'}
+        self.window = int(window)
+        self.stride = int(stride)
+        self.lead_time = int(lead_time)
+        self.label_policy = label_policy
+        self.horizon = horizon
+        self.quiet_label = quiet_label
+        self.shuffle_buffer = shuffle_buffer
+        self.random_state = random_state if random_state is not None else np.random
+
+    # Nb of frames of each video
+    @staticmethod
+    def _lengths(features):
+        if(isinstance(features, Feature_Array)):
+            return features.shapes[:len(features), 0]
+        return [len(video) for video in features]
+
+    # Returns the clips (video, first frame, nb of frames between the end of the
+    # clip and the event) of videos of 'lengths' frames. The k-th clip of a
+    # video ends 'lead_time' + k*'stride' frames before the event.
+    def clips(self, lengths):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        nb_clips = np.maximum(0, (lengths - self.lead_time - self.window)//self.stride + 1)
+        videos = np.repeat(np.arange(len(lengths)), nb_clips)
+        k = np.arange(np.sum(nb_clips)) - np.repeat(np.cumsum(nb_clips) - nb_clips, nb_clips)
+        gaps = self.lead_time + k*self.stride
+        return np.stack([videos, lengths[videos] - gaps - self.window, gaps], axis=1)
+
+    def num_clips(self, features):
+        return len(self.clips(self._lengths(features)))
+
+    # Order of 'n' elements going through a shuffle buffer of bounded size
+    def _shuffled(self, n):
+        order = []
+        buffer = []
+        for k in range(n):
+            if(len(buffer) < self.shuffle_buffer):
+                buffer += [k]
+            else:
+                i = self.random_state.randint(len(buffer))
+                order += [buffer[i]]
+                buffer[i] = k
+        self.random_state.shuffle(buffer)
+        return np.array(order + buffer, dtype=np.int64)
+
+    # Used as input for the TensorFlow pipeline instead of the whole videos.
+    # The clips of a video have the metadata of the video.
+    def generate(self, features, labels, metadata = None, use_metadata = False):
+        clips = self.clips(self._lengths(features))
+        if(self.shuffle_buffer > 0 and len(clips) > 0):
+            rank = np.argsort(self.random_state.permutation(len(features)))
+            clips = clips[np.argsort(rank[clips[:, 0]], kind='stable')]
+            clips = clips[self._shuffled(len(clips))]
+        for (v, start, gap) in clips:
+            clip = features[v][start:start+self.window]
+            label = labels[v] if self.label_policy == 'VIDEO' or gap <= self.horizon else self.quiet_label
+            if(use_metadata):
+                yield (clip, label, metadata[v])
+            else:
+                yield (clip, label)
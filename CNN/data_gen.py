@@ -5,11 +5,26 @@ the computer memory. The data memory size (in MB) is given and should not be exc
 It also builds the input pipeline for the whole TensorFlow computation.
 '''
 
-import os, re, pickle, traceback, math, drms
-import skimage.transform as sk
+import os, re, traceback, math, drms, sys, threading, queue, time, json, hashlib
+import multiprocessing as mp
 import tensorflow as tf
 import numpy as np
 import h5py as h5
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DataQuery.DataWrapper import H5_Pool
+from feature_cache import Feature_Cache
+from file_scheduler import File_Scheduler
+from file_manifest import File_Manifest
+from resize_engine import Resize_Engine
+from feature_writer import Feature_Writer, Encoded_Video
+from sample_table import Sample_Table
+from feature_array import Feature_Array
+from memory_monitor import Memory_Monitor
+from clip_sampler import Clip_Sampler
+from normalization_stats import Normalization_Stats
+import sample_table
+import frame_features
+import timeseries
     
 class Data_Gen:
     
@@ -18,9 +33,11 @@ class Data_Gen:
     nb_total_files = None
     num_files_analyzed = None
     output_features_dir = None 
-    output_features = None
-    output_labels = None    
+    output_compression = None # compression of the features written in 'output_features_dir'
+    output_flush_memsize = None # xMB of features written between 2 flushes
+    output_flush_interval = None # max nb of seconds between 2 flushes
     max_pic_size = None
+    dtype = None # type of the features in memory and in the pipeline (float32 or float16)
     size_of_files = None
     memory_size = None
     num_threads = None
@@ -36,21 +53,60 @@ class Data_Gen:
     resize_method = None
     dataset = None
     data_iterator = None
-    seq_length = None
     features = None
     labels = None
     metadata = None
-    seq_length_iterator = None
+    sample_table = None # lookup table of the metadata (ids) of the current batch
     training_mode = None
     pb_kind = None
     flare_level = None
+    input_mode = None # 'CHUNKED' (files loaded in RAM), 'STREAMING' or 'PARALLEL'
+    read_ahead = None # nb of samples read in advance in 'STREAMING' mode
+    stream_index = None
+    nb_workers = None # nb of processes reading the samples in 'PARALLEL' mode
+    slot_memsize = None # size of each shared memory slot in 'PARALLEL' mode (in MB)
+    random_state = None
+    double_buffering = None # if True, the next memory batch is loaded in background
+    prefetch_thread = None
+    prefetched_batch = None
+    prefetch_error = None
+    data_wait_time = None # time spent waiting for the last memory batch (in s)
+    total_data_wait_time = None
+    scheduler = None # packing of the files in memory batches for the current epoch
+    scheduled_paths = None
+    scheduled_sizes = None
+    batch_usage = None # part of the memory budget used by the last batch (in %)
+    memory_monitor = None # bytes decoded and RSS of the batch being loaded
+    batch_memory = None # {'decoded', 'peak_rss', 'mean_rss'} of the last batch (in MB)
+    spilled_files = None # files not loaded in the last batch because of the RSS ceiling
+    manifest = None # HDF5 files of the data set (with their size and mtime)
+    sample_reader = None # reads the samples of 'stream_index' (see 'Sample_Reader')
+    source_files = None # HDF5 files found in 'main_path'
+    materialized_dir = None # directory of the shards written by 'materialize.py'
+    materialized = None # index of the shards used instead of the HDF5 files (if any)
+    resize_engine = None # resizes the frames of a video (see '_resize_video')
+    padding_mode = None # 'ZERO' or 'EDGE' padding of the frames in '_resize_video'
+    nb_buckets = None # nb of bucket sizes / axis used to batch pictures of various sizes
+    bucket_boundaries = None # [heights, widths] of the buckets
+    seq_length_buckets = None # boundaries of the sequence lengths batched together (LSTM)
+    nb_crops = None # nb of crops sampled in each picture ('RANDOM_CROP')
+    crop_size = None # (h, w) of the crops
+    crop_bias = None # the crops are centered on pixels drawn with a probability ~ |Br|^crop_bias
+    normalization = None # 'PER_IMAGE' (standardization of each picture) or 'PRECOMPUTED'
+    normalization_stats = None # statistics of the training set ('PRECOMPUTED')
+    normalization_affine = None # (scale, offset, low, high) / channel applied to the pictures
+    normalization_key = None # version of the statistics (hash of the training files)
+    clip_sampler = None # clips sampled in the videos (LRCN, LSTM), None: 1 sample = 1 video
     
     def __init__(self, data_name, config, training=True, max_pic_size=None, verbose = False):
         assert data_name in {'SF', 'SF_encoded', 'MNIST', 'CIFAR-10', 'IMG_NET'}
  
-        self.features = []
-        self.labels = []
-        self.metadata = []
+        self.dtype = np.dtype(config.get('dtype', 'float32'))
+        assert self.dtype in {np.dtype(np.float32), np.dtype(np.float16)}
+        self.features = Feature_Array(self.dtype)
+        self.labels = np.array([])
+        self.metadata = sample_table.to_array([])
+        self.sample_table = Sample_Table()
         self.memory_size =  config['batch_memsize']
         self.data_dims = config['data_dims']
         self.database_name = data_name
@@ -63,9 +119,27 @@ class Data_Gen:
         self.prefetch_buffer_size = config['prefetch_buffer_size']
         self.max_pic_size = max_pic_size
         self.subsampling = 1
+        self.input_mode = config.get('input_mode', 'CHUNKED')
+        self.read_ahead = config.get('read_ahead', 64)
+        self.stream_index = []
+        self.nb_workers = config.get('nb_workers', self.num_threads)
+        self.slot_memsize = config.get('slot_memsize', 32)
+        self.random_state = np.random.RandomState(config.get('seed'))
+        self.double_buffering = config.get('double_buffering', False)
+        self.data_wait_time = 0
+        self.total_data_wait_time = 0
+        self.nb_crops = config.get('nb_crops', 4)
+        self.crop_size = config.get('crop_size', [256, 256])
+        self.crop_bias = config.get('crop_bias', 0)
+        self.memory_monitor = Memory_Monitor(config.get('rss_ceiling'))
+        self.spilled_files = []
+        assert self.input_mode in {'CHUNKED', 'STREAMING', 'PARALLEL'}
+        H5_Pool.configure(config.get('h5_max_open_files'),
+                          config.get('h5_rdcc_nbytes'),
+                          config.get('h5_rdcc_nslots'))
         
         if(data_name in {'SF', 'SF_encoded'}):
-            assert config['resize_method'] in {'NONE', 'LIN_RESIZING', 'QUAD_RESIZING', 'ZERO_PADDING'}
+            assert config['resize_method'] in {'NONE', 'LIN_RESIZING', 'QUAD_RESIZING', 'ZERO_PADDING', 'RANDOM_CROP'}
             assert os.path.isdir(config['input_features_dir'])
             assert os.path.isdir(config['output_features_dir'])
             self.segs = config['segs']
@@ -75,8 +149,31 @@ class Data_Gen:
             self.resize_method = config['resize_method']
             self.rescaling_factor = config['rescaling_factor']
             self.time_step = config['time_step']
-            self.output_features = {}
-            self.output_labels = {}
+            self.materialized_dir = config.get('materialized_dir')
+            self.padding_mode = config.get('padding_mode', 'ZERO')
+            self.nb_buckets = config.get('nb_buckets', 0)
+            self.bucket_boundaries = config.get('bucket_boundaries')
+            self.seq_length_buckets = config.get('seq_length_buckets')
+            self.normalization = config.get('normalization', 'PER_IMAGE')
+            assert self.normalization in {'PER_IMAGE', 'PRECOMPUTED'}
+            if(config.get('clip_window') is not None and self.model_name in {'LRCN', 'LSTM'}):
+                if(self.input_mode != 'CHUNKED'):
+                    print('Warning: clips can only be sampled in \'CHUNKED\' mode. 1 sample = 1 video')
+                else:
+                    label_policy = config.get('clip_label', 'VIDEO')
+                    self.clip_sampler = Clip_Sampler(config['clip_window'], 
+                                                     config.get('clip_stride', 1),
+                                                     config.get('clip_lead_time', 0),
+                                                     label_policy,
+                                                     config.get('clip_horizon', 0),
+                                                     self._label('A1.0') if label_policy == 'HORIZON' else None,
+                                                     config.get('clip_shuffle_buffer', 256) if training else 0,
+                                                     self.random_state)
+            assert self.padding_mode in {'ZERO', 'EDGE'}
+            self.resize_engine = Resize_Engine(self.num_threads)
+            self.output_compression = config.get('output_compression', 'gzip')
+            self.output_flush_memsize = config.get('output_flush_memsize', 64)
+            self.output_flush_interval = config.get('output_flush_interval', 60)
             if(training):
                 self.subsampling = config['subsampling']
 
@@ -92,9 +189,21 @@ class Data_Gen:
             print('\t/labels[dataset]\n')
         
         
+        # Lists the HDF5 files (only the directories modified are scanned again)
+        manifest_path = None
+        if(data_name in {'SF', 'SF_encoded'}):
+            manifest_path = config.get('file_manifest') or os.path.join(self.input_features_dir, 'file_manifest.json')
+        self.manifest = File_Manifest(manifest_path)
+        
         # First checks
         self.init_paths_to_file(verbose)
         
+        # Statistics of the training set used to normalize the pictures
+        if(self.normalization == 'PRECOMPUTED'):
+            self.normalization_stats = self._load_normalization_stats(config)
+            self.normalization_affine = tuple(np.float32(v) for v in 
+                                              self.normalization_stats.affine(config.get('normalization_clip', [0.5, 99.5])))
+        
         if(self.max_pic_size is None and data_name == 'SF'):
             print('Computing the maximum of picture size...')
             self.max_pic_size = self.get_max_size()
@@ -102,39 +211,95 @@ class Data_Gen:
             print('Warning: maximum size unknown ({}), could lead to error'.format(self.max_pic_size))
         else:
             print('Maximum size found : {}'.format(self.max_pic_size))
+        
+        # Uses the frames already preprocessed if they match the configuration
+        if(self.materialized_dir is not None and self.input_mode == 'CHUNKED' and 
+           self.model_name in {'VGG_16', 'VGG_16_encoder_decoder'} and self.resize_method not in {'NONE', 'RANDOM_CROP'}):
+            self.materialized = self._load_materialization()
+            if(self.materialized is not None):
+                print('Materialized data found in {}'.format(self.materialized['path']))
+                self.init_paths_to_file(verbose)
+        
+        # Fits the buckets of picture sizes to the sizes found in the data set
+        if(self.use_bucketing() and self.bucket_boundaries is None):
+            self.bucket_boundaries = self._fit_bucket_boundaries(self._frame_shapes(), self.nb_buckets)
     
     # Returns a list of all the files inside the directory 
     # (can be recursive search with recursive_search=True)
     @staticmethod
-    def file_scanning(path, recursive_search=False, list_files = []):
+    def file_scanning(path, recursive_search=False, list_files = None):
+        if(list_files is None):
+            list_files = []
         if(os.path.isdir(path)):
-            for file in os.listdir(path):
-                file_path = os.path.join(path, file)
-                if(recursive_search):
-                    Data_Gen.file_scanning(file_path, recursive_search, list_files)
-                elif(os.path.isfile(file_path)):
-                    list_files += [file_path]
+            with os.scandir(path) as it:
+                for entry in it:
+                    if(entry.is_dir()):
+                        if(recursive_search):
+                            Data_Gen.file_scanning(entry.path, recursive_search, list_files)
+                    elif(entry.is_file()):
+                        list_files += [entry.path]
         elif(os.path.isfile(path)):
             list_files += [path]
         return list_files
     
     def init_paths_to_file(self, verbose = False):
+        self.stop_prefetching()
+        self.scheduler = None
         self.paths_to_file = []
         self.size_of_files = []
         self.nb_total_files = 0
         self.num_files_analyzed = 0
         nb_files_ignored = 0
-        for path in Data_Gen.file_scanning(self.main_path, True):
-            size = os.path.getsize(path)/(1024*1024)
-            if(size <= self.memory_size):
+        self.source_files = self.manifest.scan(self.main_path, recursive_search=True)
+        if(self.materialized is not None):
+            # The shards replace the HDF5 files
+            sample_size = self.dtype.itemsize*np.prod(self.materialized['sample_shape'])/(1024*1024)
+            for shard in self.materialized['shards']:
+                self.paths_to_file += [os.path.join(self.materialized['path'], shard['file'])]
+                self.size_of_files += [(shard['end']-shard['begin'])*sample_size]
+                self.nb_total_files += 1
+            return
+        for path in self.source_files:
+            size = self._estimated_size(path)
+            # In streaming mode, the files are never loaded entirely in memory
+            if(size <= self.batch_memory_size() or self.input_mode != 'CHUNKED'):
                 self.paths_to_file += [path]
-                self.size_of_files += [size/float(self.subsampling)]
+                self.size_of_files += [size]
                 self.nb_total_files += 1
             else:
                 if(verbose):
-                    print('Warning: file {} [{}MB] will not fit in memory (> {}MB). Ignored'.format(os.path.basename(path), size, self.memory_size))
+                    print('Warning: file {} [{}MB] will not fit in memory (> {}MB). Ignored'.format(os.path.basename(path), size, self.batch_memory_size()))
                 nb_files_ignored += 1
-        print('Number of files ignored (>{}MB): {}'.format(self.memory_size, nb_files_ignored))
+        print('Number of files ignored (>{}MB): {}'.format(self.batch_memory_size(), nb_files_ignored))
+    
+    # Every parameter that changes the number of bytes decoded from a file
+    def _expansion_key(self):
+        config = [self.database_name, self.model_name, self.segs, self.subsampling,
+                  self.resize_method, self.rescaling_factor, self.data_dims, self.dtype.name]
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+    
+    # Size of a file once decoded in memory (in MB). It is the size on disk x 
+    # the expansion ratio learned the last time the file was loaded (with the
+    # same configuration), or the size on disk / subsampling if unknown (x 1/2
+    # in float16).
+    def _estimated_size(self, path):
+        info = self.manifest.file_info(path)
+        size = (info['size'] if info is not None else os.path.getsize(path))/(1024*1024)
+        ratio = None
+        if(info is not None and self.database_name in {'SF', 'SF_encoded'}):
+            ratio = info.get('expansion_ratio', {}).get(self._expansion_key())
+        if(ratio is None):
+            return size/float(self.subsampling)*self.dtype.itemsize/4.0
+        return size*ratio
+    
+    # Saves the expansion ratio (bytes decoded / bytes on disk) of a file
+    def _learn_expansion_ratio(self, path, nb_bytes):
+        info = self.manifest.file_info(path)
+        if(info is None or info['size'] == 0 or self.database_name not in {'SF', 'SF_encoded'}):
+            return
+        ratios = dict(info.get('expansion_ratio', {}))
+        ratios[self._expansion_key()] = round(nb_bytes/float(info['size']), 4)
+        self.manifest.set_file_info(path, 'expansion_ratio', ratios, save=False)
     
      # Returns the maximum size of pictures found in all files
     def get_max_size(self):
@@ -142,7 +307,7 @@ class Data_Gen:
         for file_path in self.paths_to_file:
             if(os.path.isfile(file_path)):
                 try:
-                    with h5.File(file_path, 'r') as db:
+                    with H5_Pool.open(file_path) as db:
                         if(self.database_name == 'SF'):
                             for vid_key in db.keys():
                                 for frame_key in db[vid_key]:
@@ -161,65 +326,138 @@ class Data_Gen:
                 print('Warning: {} is not a file. Ignored'.format(file_path))
         return max_size
     
-     # Takes a video and a list of scalars as input and returns the corresponding
+    # Takes a video and a list of scalars as input and returns the corresponding
     # time series. If 'time_event_last_frame', then the eruption occurs in the last
-    # frame so the result needs to be reversed.
+    # frame so the result needs to be reversed. The scalars registered in 
+    # 'frame_features' are read from the frame attributes if they were stored 
+    # (see 'store_frame_features'), otherwise they are all computed on the frame
+    # read once. A frame that cannot be read is removed from all the time series.
     @staticmethod
     def _extract_timeseries_from_video(vid, scalars, channels, time_event_last_frame = True):
         res = [[] for k in range(len(scalars))]
         sample_time = []
         tf = drms.to_datetime(vid.attrs['end_time'])
-        last_frame = None
+        features = [scalar for scalar in scalars if frame_features.is_feature(scalar)]
+        prev_key = None
+        last_frame = None # previous frame (if read)
         for frame_key in sorted(list(vid.keys()), key=lambda frame_key : float(frame_key[5:])):
             if('channels' in vid[frame_key].keys() and
                len(vid[frame_key]['channels'].shape) == 3):
-                ti = drms.to_datetime(vid[frame_key].attrs['T_REC'])
+                attrs = vid[frame_key].attrs
+                values = {}
+                this_frame = None
+                try:
+                    missing = [f for f in features if frame_features.attr_name(f, channels) not in attrs]
+                    for f in features:
+                        if(f not in missing):
+                            values[f] = attrs[frame_features.attr_name(f, channels)]
+                    if(len(missing) > 0):
+                        segs = Data_Gen._channel_names(attrs['SEGS'], channels)
+                        this_frame = Data_Gen._extract_frame(vid[frame_key]['channels'], attrs['SEGS'], channels)
+                        if('l1_err' in missing and last_frame is None and prev_key is not None):
+                            last_frame = Data_Gen._extract_frame(vid[prev_key]['channels'], vid[prev_key].attrs['SEGS'], channels)
+                        values.update(frame_features.compute(missing, this_frame, segs, last_frame))
+                except:
+                    print('Frame {} not extracted.'.format(frame_key))
+                    print(traceback.format_exc())
+                    continue
+                ti = drms.to_datetime(attrs['T_REC'])
                 sample_time += [(tf - ti).total_seconds()/60]
-                i = 0
-                for scalar in scalars:
-                    if(scalar == 'l1_err' or scalar == 'TV'):
-                        l1_err = 0
-                        TV = 0
-                        try:
-                            this_frame = Data_Gen._extract_frame(vid[frame_key]['channels'], vid[frame_key].attrs['SEGS'], channels)
-                            if(last_frame is None):
-                                last_frame = this_frame
-                            for c in range(last_frame.shape[2]):
-                                if(channels is None or vid[frame_key].attrs['SEGS'][c].decode() in channels):
-                                        if(scalar == 'l1_err'):
-                                            l1_err += np.sum(np.abs(sk.resize(this_frame[:,:,c], last_frame.shape[:2], preserve_range=True)-last_frame[:,:,c]))
-                                        else:
-                                            # only valid total variation
-                                            TV += np.sum(np.sqrt(np.square(np.diff(this_frame[:,:,c], axis=0)[:, 1:])) + 
-                                                                 np.square(np.diff(this_frame[:,:,c], axis=1)[1:, :]))
-                            if(channels is None):
-                                nb_channels = last_frame.shape[2]
-                            else:
-                                nb_channels = len(channels)
-                            normalization = np.product(last_frame.shape[0:2])*nb_channels
-                            if(scalar == 'TV'):
-                                res[i] += [TV/normalization]
-                            else:
-                                res[i] += [l1_err/normalization]
-                        except:
-                            sample_time = sample_time[:-1]
-                            print('Frame {} not extracted.'.format(frame_key))
-                            print(traceback.format_exc())
-                    else:
-                        res[i] += [vid[frame_key].attrs[scalar]]
-                    i += 1
+                for i, scalar in enumerate(scalars):
+                    res[i] += [values[scalar] if scalar in values else attrs[scalar]]
+                prev_key = frame_key
                 last_frame = this_frame
 
+        res = np.array(res, dtype=np.float64).reshape(len(scalars), len(sample_time))
         if(time_event_last_frame):
-            return np.flip(np.array(res), axis=1), np.flip(np.array(sample_time), axis=0)
-        return np.array(res), np.array(sample_time)
-        
+            return np.flip(res, axis=1), np.flip(np.array(sample_time), axis=0)
+        return res, np.array(sample_time)
+    
+    # Computes the 'features' (see 'frame_features') of every frame of a file
+    # and writes them in the frame attributes (1 read of each frame). Returns 
+    # the nb of frames updated.
+    @staticmethod
+    def _store_file_features(task):
+        (file_path, features, channels, overwrite) = task
+        nb_frames = 0
+        with h5.File(file_path, 'r+') as db:
+            for vid_key in db.keys():
+                last_frame = None
+                for frame_key in sorted(list(db[vid_key].keys()), key=lambda frame_key : float(frame_key[5:])):
+                    frame = db[vid_key][frame_key]
+                    if('channels' not in frame.keys() or len(frame['channels'].shape) != 3):
+                        continue
+                    try:
+                        this_frame = Data_Gen._extract_frame(frame['channels'], frame.attrs['SEGS'], channels)
+                        names = [f for f in features if overwrite or frame_features.attr_name(f, channels) not in frame.attrs]
+                        if(len(names) > 0):
+                            segs = Data_Gen._channel_names(frame.attrs['SEGS'], channels)
+                            for (name, value) in frame_features.compute(names, this_frame, segs, last_frame).items():
+                                frame.attrs[frame_features.attr_name(name, channels)] = value
+                            nb_frames += 1
+                        last_frame = this_frame
+                    except:
+                        print('Features of frame {}/{} not computed.'.format(vid_key, frame_key))
+                        print(traceback.format_exc())
+                        last_frame = None
+        return nb_frames
+    
+    # Writes the 'features' of all the frames in the files (in parallel, 1 file /
+    # process), so that 'extract_timeseries' reads them instead of the pixels.
+    @staticmethod
+    def store_frame_features(paths_to_file, features, channels = None, overwrite = False, nb_workers = None):
+        for name in features:
+            if(not frame_features.is_feature(name)):
+                raise RuntimeError('Unknown frame feature: {}'.format(name))
+        if(type(paths_to_file) is not list and os.path.isdir(paths_to_file)):
+            paths_to_file = File_Manifest().scan(paths_to_file, recursive_search=True)
+        # The files opened in read-only mode cannot be opened again to be written
+        # (neither in this process nor in the processes forked)
+        for file_path in paths_to_file:
+            H5_Pool.release(file_path)
+        tasks = [(file_path, list(features), channels, overwrite) for file_path in paths_to_file]
+        nb_workers = min(nb_workers or os.cpu_count() or 1, max(1, len(tasks)))
+        if(nb_workers > 1):
+            with mp.get_context('fork').Pool(nb_workers) as pool:
+                nb_frames = pool.map(Data_Gen._store_file_features, tasks, chunksize=1)
+        else:
+            nb_frames = [Data_Gen._store_file_features(task) for task in tasks]
+        print('Features {} stored in {} frames of {} files.'.format(list(features), sum(nb_frames), len(tasks)))
+        return sum(nb_frames)
+    
+    # Computes the raw time series of 1 video (in a worker process). 
+    # Returns (video key, time series, sample time).
+    @staticmethod
+    def _timeseries_worker(task):
+        (file_path, vid_key, scalars, channels) = task
+        try:
+            with H5_Pool.open(file_path) as db:
+                (vid_time_series, vid_sample_time) = Data_Gen._extract_timeseries_from_video(db[vid_key], scalars, channels)
+        except:
+            print('Impossible to extract time series from video {} in {}'.format(vid_key, file_path))
+            print(traceback.format_exc())
+            raise
+        return vid_key, vid_time_series, vid_sample_time
+    
+    # Path of the time series of a file cached in 'cache_dir'. The name depends
+    # on the file (path, size, modification time), the scalars and the channels.
+    @staticmethod
+    def _timeseries_cache_path(cache_dir, file_path, scalars, channels):
+        stat = os.stat(file_path)
+        key = json.dumps([os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, 
+                          list(scalars), None if channels is None else list(channels)])
+        return os.path.join(cache_dir, 'timeseries_{}.npz'.format(hashlib.sha1(key.encode()).hexdigest()[:16]))
+    
     # Extracts some scalars from video that evolve according to the time (ex: SIZE of a frame).
-    # The scalar must be in the frame attributes of a video (exception for 'TV' and 'l1_err': they are
-    # computed directly in '_extract_timeseries_from_video'). These time series are concatenated
+    # The scalar must be in the frame attributes of a video (exception for the features of 
+    # 'frame_features', ex: 'TV' and 'l1_err': they are computed from the frames if they were
+    # not stored with 'store_frame_features'). These time series are concatenated
     # in one list for every video. 'tstart' and 'tend' are used to know when the time series
     # begin and end (from an event, time reversed). If values are missing (<5% by default), 
     # they are interpolated.
+    # The videos are analyzed by 'nb_workers' processes. If 'cache_dir' is given, the 
+    # raw time series of each file are saved in it, so that only the resampling is done 
+    # again with other 'time_step', 'tstart', 'tend' or 'loss'.
     
     # NOTE: all frames MUST have 'T_REC' and 'SEGS' in their attribute. All videos MUST have 'end_time'
     # in their attribute.
@@ -230,40 +468,170 @@ class Data_Gen:
                            time_step=60, 
                            tstart=0, 
                            tend=60*24, 
-                           loss=0.05):
+                           loss=0.05,
+                           nb_workers=None,
+                           cache_dir=None):
         nb_frames = int((tend - tstart)/time_step) + 1
-        nb_scalars = len(scalars)
         sample_time = np.linspace(tstart, tend, nb_frames)
-        res = []
         print('{} frames are considered from {}min before a solar eruption to {}min.'.format(nb_frames, tstart, tend))
         if(type(paths_to_file) is not list and os.path.isdir(paths_to_file)):
             print('Path to a directory. All the files and directories inside are scanned')
-            paths_to_file = Data_Gen.file_scanning(paths_to_file, recursive_search=True)
+            paths_to_file = File_Manifest().scan(paths_to_file, recursive_search=True)
         print('INFO: a linear interpolation is used to reconstruct the time series.')
+        if(cache_dir is not None):
+            os.makedirs(cache_dir, exist_ok=True)
+        
+        # Raw time series of each video: from the cache or computed in parallel
+        raw = {} # file path -> list of (video key, time series, sample time)
+        tasks = []
+        nb_cached_files = 0
         for file_path in paths_to_file:
             try:
-                with h5.File(file_path, 'r') as db:
-                    print('Analyzing file {}'.format(os.path.basename(file_path)))
-                    for vid_key in db.keys():
-                        vid_time_series, vid_sample_time = Data_Gen._extract_timeseries_from_video(db[vid_key], scalars, channels)
-                        if(len(vid_sample_time) > 0):
-                            i_start = np.argmin(abs(vid_sample_time - tstart))
-                            i_end = np.argmin(abs(vid_sample_time - tend))
-                            #if(np.any(np.isnan(vid_time_series))):
-                            #    print('Video {} ignored because the time series associated contains \'NaN\'.'.format(vid_key))
-                            if(abs(vid_sample_time[i_start] - tstart) <= time_step):
-                                nb_frames_in_vid = i_end - i_start + 1
-                                if(1 - nb_frames_in_vid/nb_frames <= loss):
-                                    res_vid = np.zeros((nb_scalars, nb_frames), dtype=np.float32)
-                                    for k in range(nb_scalars):
-                                        res_vid[k,:] = np.interp(sample_time, vid_sample_time, vid_time_series[k,:])
-                                    res += [res_vid]                            
+                if(cache_dir is not None):
+                    cache_path = Data_Gen._timeseries_cache_path(cache_dir, file_path, scalars, channels)
+                    if(os.path.isfile(cache_path)):
+                        with np.load(cache_path) as cache:
+                            raw[file_path] = [(vid_key, cache['series_{}'.format(k)], cache['time_{}'.format(k)]) 
+                                              for (k, vid_key) in enumerate(cache['videos'])]
+                        nb_cached_files += 1
+                        continue
+                with H5_Pool.open(file_path) as db:
+                    tasks += [(file_path, vid_key, list(scalars), channels) for vid_key in db.keys()]
+                raw[file_path] = []
             except:
                 print('Impossible to extract time series from file {}'.format(file_path))
                 print(traceback.format_exc())
                 raise
-
-        return np.array(res, dtype=np.float32), sample_time
+        nb_workers = nb_workers or os.cpu_count() or 1
+        print('{} files in cache, {} videos analyzed by {} processes.'.format(nb_cached_files, len(tasks), nb_workers))
+        if(nb_workers > 1 and len(tasks) > 1):
+            with mp.get_context('fork').Pool(min(nb_workers, len(tasks))) as pool:
+                results = pool.map(Data_Gen._timeseries_worker, tasks, chunksize=max(1, len(tasks)//(4*nb_workers)))
+        else:
+            results = [Data_Gen._timeseries_worker(task) for task in tasks]
+        for (task, result) in zip(tasks, results):
+            raw[task[0]] += [result]
+        if(cache_dir is not None):
+            for file_path in set(t[0] for t in tasks):
+                cache_path = Data_Gen._timeseries_cache_path(cache_dir, file_path, scalars, channels)
+                arrays = {'videos': np.array([r[0] for r in raw[file_path]], dtype=str)}
+                for (k, (vid_key, vid_time_series, vid_sample_time)) in enumerate(raw[file_path]):
+                    arrays['series_{}'.format(k)] = vid_time_series
+                    arrays['time_{}'.format(k)] = vid_sample_time
+                np.savez(cache_path+'.tmp.npz', **arrays)
+                os.replace(cache_path+'.tmp.npz', cache_path)
+        
+        # Videos kept: they begin at 'tstart' and not too many frames are missing
+        series_list = []
+        times_list = []
+        for file_path in paths_to_file:
+            for (vid_key, vid_time_series, vid_sample_time) in raw[file_path]:
+                if(len(vid_sample_time) > 0):
+                    i_start = np.argmin(abs(vid_sample_time - tstart))
+                    i_end = np.argmin(abs(vid_sample_time - tend))
+                    if(abs(vid_sample_time[i_start] - tstart) <= time_step):
+                        nb_frames_in_vid = i_end - i_start + 1
+                        if(1 - nb_frames_in_vid/nb_frames <= loss):
+                            series_list += [vid_time_series]
+                            times_list += [vid_sample_time]
+        res = timeseries.resample(series_list, times_list, sample_time)
+        if(len(series_list) == 0):
+            res = res.reshape(0, len(scalars), nb_frames)
+        return res, sample_time
+    
+    # Computes the statistics of the frames of 1 file (in a worker process)
+    @staticmethod
+    def _normalization_worker(task):
+        (file_path, segs, value_range, per_harp) = task
+        stats = Normalization_Stats(segs, value_range=value_range, per_harp=per_harp)
+        buffer = None
+        with H5_Pool.open(file_path) as db:
+            for vid_key in db.keys():
+                channel_index = None
+                for frame_key in db[vid_key].keys():
+                    frame = db[vid_key][frame_key]
+                    if('channels' not in frame.keys() or len(frame['channels'].shape) != 3):
+                        continue
+                    try:
+                        if(channel_index is None):
+                            channel_index = Data_Gen._channel_indices(frame.attrs['SEGS'], segs)
+                        buffer, out = Data_Gen._frame_buffer(buffer, frame['channels'].shape[0:2] + (len(segs),))
+                        stats.add(Data_Gen._extract_frame(frame['channels'], None, segs, False, out, channel_index), 
+                                  frame.attrs.get('HARPNUM'))
+                    except:
+                        print('Frame {}/{} of {} ignored.'.format(vid_key, frame_key, file_path))
+                        print(traceback.format_exc())
+        return stats
+    
+    # Path of the statistics of a file cached in 'cache_dir'
+    @staticmethod
+    def _normalization_cache_path(cache_dir, file_path, segs, value_range, per_harp):
+        stat = os.stat(file_path)
+        key = json.dumps([os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, list(segs), value_range, per_harp])
+        return os.path.join(cache_dir, 'normalization_{}.json'.format(hashlib.sha1(key.encode()).hexdigest()[:16]))
+    
+    # Computes the statistics / channel 'segs' of all the frames of the files 
+    # (see 'Normalization_Stats'). The files are analyzed by 'nb_workers' 
+    # processes and their statistics merged. If 'cache_dir' is given, the 
+    # statistics of each file are saved in it, so that only the new files are
+    # analyzed the next time.
+    @staticmethod
+    def compute_normalization_stats(paths_to_file, segs, value_range = 1e4, per_harp = False, nb_workers = None, cache_dir = None):
+        if(type(paths_to_file) is not list and os.path.isdir(paths_to_file)):
+            paths_to_file = File_Manifest().scan(paths_to_file, recursive_search=True)
+        if(cache_dir is not None):
+            os.makedirs(cache_dir, exist_ok=True)
+        stats = Normalization_Stats(segs, value_range=value_range, per_harp=per_harp)
+        tasks = []
+        for file_path in paths_to_file:
+            if(cache_dir is not None):
+                cache_path = Data_Gen._normalization_cache_path(cache_dir, file_path, segs, value_range, per_harp)
+                if(os.path.isfile(cache_path)):
+                    with open(cache_path, 'r') as f:
+                        stats.merge(Normalization_Stats.from_json(f.read()))
+                    continue
+            tasks += [(file_path, list(segs), value_range, per_harp)]
+        nb_workers = min(nb_workers or os.cpu_count() or 1, max(1, len(tasks)))
+        print('{} files in cache, {} files analyzed by {} processes.'.format(len(paths_to_file)-len(tasks), len(tasks), nb_workers))
+        if(nb_workers > 1):
+            with mp.get_context('fork').Pool(nb_workers) as pool:
+                results = pool.map(Data_Gen._normalization_worker, tasks, chunksize=1)
+        else:
+            results = [Data_Gen._normalization_worker(task) for task in tasks]
+        for (task, file_stats) in zip(tasks, results):
+            if(cache_dir is not None):
+                cache_path = Data_Gen._normalization_cache_path(cache_dir, task[0], segs, value_range, per_harp)
+                with open(cache_path+'.tmp', 'w') as f:
+                    f.write(file_stats.to_json())
+                os.replace(cache_path+'.tmp', cache_path)
+            stats.merge(file_stats)
+        (mean, std) = stats.moments()
+        print('Normalization statistics of {} values / channel: mean {}, std {}'.format(int(stats.count[0]) if len(segs) > 0 else 0, mean, std))
+        return stats
+    
+    # Statistics of the training set (used for the training and the test). They
+    # are saved in 'normalization_stats' (JSON) and computed again only if the
+    # training files or the parameters change.
+    def _load_normalization_stats(self, config):
+        path = config.get('normalization_stats') or os.path.join(self.input_features_dir, 'normalization_stats.json')
+        value_range = config.get('normalization_range', 1e4)
+        per_harp = config.get('normalization_per_harp', False)
+        training_files = self.source_files if self.training_mode else self.manifest.scan(config['training_paths'], recursive_search=True)
+        files = [Data_Gen._file_state(file_path) for file_path in training_files]
+        self.normalization_key = hashlib.sha1(json.dumps([self.segs, value_range, per_harp, files]).encode()).hexdigest()[:16]
+        if(os.path.isfile(path)):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if(saved.get('key') == self.normalization_key):
+                print('Normalization statistics loaded from {}'.format(path))
+                return Normalization_Stats.from_json(saved['stats'])
+        print('Computing the normalization statistics of {} training files...'.format(len(training_files)))
+        stats = Data_Gen.compute_normalization_stats(training_files, self.segs, value_range, per_harp, self.nb_workers,
+                                                     os.path.join(self.input_features_dir, 'normalization_stats'))
+        with open(path+'.tmp', 'w') as f:
+            json.dump({'key': self.normalization_key, 'stats': stats.to_json()}, f)
+        os.replace(path+'.tmp', path)
+        return stats
     
     # Assigns a label (int number) associated to a flare class.
     # This label depends of the number of classes for a classification pb.
@@ -280,9 +648,8 @@ class Data_Gen:
             print('Illegal problem for assigning a label: {}'.format(self.pb_kind))
             raise
     
-    # Resizes every frame in a video according to the data_dims param (if None: 
-    # size of the first frame, dim H x W x C) (with the resizing method 'self.resize_method'). 
-    # Returs a numpy array of size n x H x W x C if n = nb of frames
+    # Resizes all the frames of a video to the same shape (n, H, W, C) 
+    # according to 'resize_method' (see 'Resize_Engine')
     def _resize_video(self, video):
         n = len(video)
         if(n == 0):
@@ -292,37 +659,21 @@ class Data_Gen:
         # Set the output shape expected
         if(None in self.data_dims[1:]):
             if(self.resize_method == 'ZERO_PADDING'):
-                (H, W, C) = np.max([pic.shape for pic in video], axis=0)
+                (H, W) = (max([pic.shape[0] for pic in video]), max([pic.shape[1] for pic in video]))
             else:
-                (H, W, C) = video[0].shape
+                (H, W) = video[0].shape[0:2]
         else:
-            (H, W, C) = self.data_dims[1:4]
-            
-        output_shape = (int(np.round(H*self.rescaling_factor)), int(np.round(W*self.rescaling_factor)), C)
-        resized_vid = np.zeros((n,) + output_shape , dtype=np.float32)
-        # Set the order of the interpolation if resize_method in {'NONE', 'LIN', 'QUAD'}
-        if(self.resize_method == 'NONE'):
-            o = 1
-        elif(self.resize_method == 'LIN_RESIZING'):
-            o = 1 
-        elif(self.resize_method == 'QUAD_RESIZING'):           
-            o = 2
+            (H, W) = self.data_dims[1:3]
+        output_shape = (int(np.round(H*self.rescaling_factor)), int(np.round(W*self.rescaling_factor)))
+        if(self.resize_method in {'NONE', 'LIN_RESIZING', 'RANDOM_CROP'}):
+            method = 'LIN_RESIZING'
+        elif(self.resize_method == 'QUAD_RESIZING'):
+            method = 'QUAD_RESIZING'
         elif(self.resize_method == 'ZERO_PADDING'):
-            o = -1
+            method = 'ZERO_PADDING' if self.padding_mode == 'ZERO' else 'EDGE_PADDING'
         else:
             raise RuntimeError('Unknown resized method: {}'.format(self.resize_method))
-            
-        for k in range(n):
-            if(o == -1):
-                # We are centering the picture and adding constant edge values around
-                (Hi, Wi) = video[k].shape[:2]
-                eps_w = int(np.round((W-Wi)/2)) # marge width
-                eps_h = int(np.round((H-Hi)/2)) # marge height 
-                resized_vid[k, :, :, :] = np.pad(video[k], ((eps_h, H-Hi-eps_h), (eps_w, W-Wi-eps_w), (0, 0)), 'edge')
-            else:
-                resized_vid[k, :, :, :] = sk.resize(video[k], output_shape, order = o, preserve_range=True)
-        
-        return resized_vid
+        return self.resize_engine.resize_video(video, output_shape, method)
     
     
     # It orders a list of strings, assuming it has one of the following format:
@@ -341,128 +692,295 @@ class Data_Gen:
         
     
     # check 'NaN' in a frame that can have one or multiple channels. Returns
-    # a clean frame. INPUT: np array with shape (h, w, c)
+    # a clean frame: 'frame' itself or a view of it when columns are removed
+    # (a copy only if the channels are cropped differently).
+    # INPUT: np array with shape (h, w, c)
     @staticmethod
     def _check_nan(frame, verbose = False):
         shape = frame.shape
-        new_frame = None
         if(len(shape) != 3):
-            print('Shape of frame must be (h, w, c) (got {})'.format(shape))
-            raise        
-        for c in range(shape[2]):
-            pic = frame[:,:,c]
-            if(np.any(np.isnan(pic))):
-                if(verbose):
-                    print('Warning: NaN found in a frame. Trying to erase them...')
-                where_is_nan = np.argwhere(np.isnan(pic))
-                nan_up_left_corner = (min(where_is_nan[:,0]), min(where_is_nan[:,1]))
-                nan_down_right_corner = (max(where_is_nan[:,0]), max(where_is_nan[:,1]))
-                # Select only the biggest rectangle that does not contain 'NaN'
-                pic_shape = pic.shape
-                right_split_pic_width = nan_up_left_corner[1]
-                left_split_pic_width = pic_shape[1] - nan_down_right_corner[1]
-                if(right_split_pic_width > left_split_pic_width):
-                    # conserve only the right picture's part
-                    pic = pic[:, 0:nan_up_left_corner[1]]
-                else:
-                    # otherwise, conserve the other part
-                    pic = pic[:, nan_down_right_corner[1]+1:]
-                pic_reshape = pic.shape
-                if(np.any(np.isnan(pic))):
-                    print('Impossible to erase NaN.')
-                else:
-                    if(verbose):
-                        print('NaN erased. Reshape operation: {} --> {}'.format(pic_shape, pic_reshape))
-            if(new_frame is None):
-                new_frame = np.zeros(pic.shape+(shape[2],), dtype=np.float32)
-            try:
-                new_frame[:,:,c] = pic
-            except:
-                print('All channels are no coherents')
-                print('Previous channel:')
-                #plt.imshow(frame[:,:,c-1])
-                #plt.show()
-                print('New channel:')
-                #plt.imshow(frame[:,:,c])
-                #plt.show()
-                print(traceback.format_exc())
-                raise
+            raise RuntimeError('Shape of frame must be (h, w, c) (got {})'.format(shape))
+        # Cheap test without temporary frame: the sum of a channel is 'NaN' 
+        # if it contains 'NaN' (or +inf and -inf)
+        nan_channels = np.flatnonzero(np.isnan(frame.sum(axis=(0, 1))))
+        if(len(nan_channels) == 0):
+            return frame
+        # Columns kept in each channel
+        cols = [(0, shape[1])]*shape[2]
+        for c in nan_channels:
+            nan_cols = np.flatnonzero(np.isnan(frame[:,:,c]).any(axis=0))
+            if(len(nan_cols) == 0):
+                continue
+            if(verbose):
+                print('Warning: NaN found in a frame. Trying to erase them...')
+            # Select only the biggest rectangle that does not contain 'NaN'
+            right_split_pic_width = nan_cols[0]
+            left_split_pic_width = shape[1] - nan_cols[-1]
+            if(right_split_pic_width > left_split_pic_width):
+                # conserve only the right picture's part
+                cols[c] = (0, nan_cols[0])
+            else:
+                # otherwise, conserve the other part
+                cols[c] = (nan_cols[-1]+1, shape[1])
+            if(np.isnan(frame[:, cols[c][0]:cols[c][1], c].sum())):
+                print('Impossible to erase NaN.')
+            elif(verbose):
+                print('NaN erased. Reshape operation: {} --> {}'.format(shape[0:2], (shape[0], cols[c][1]-cols[c][0])))
+        if(len(set(cols)) == 1):
+            return frame[:, cols[0][0]:cols[0][1], :]
+        if(len(set([end - begin for (begin, end) in cols])) > 1):
+            raise RuntimeError('All channels are no coherents (columns kept: {})'.format(cols))
+        new_frame = np.empty((shape[0], cols[0][1]-cols[0][0], shape[2]), dtype=frame.dtype)
+        for c, (begin, end) in enumerate(cols):
+            new_frame[:,:,c] = frame[:, begin:end, c]
         return new_frame
     
+    # Returns the indices of the channels 'frame_final_segs' in a frame whose
+    # channels are 'frame_segs' (in the frame order). Computed once per video.
     @staticmethod
-    def _extract_frame(frame, frame_segs, frame_final_segs = None, verbose = False):
-        if(any([type(seg) == bytes or type(seg) == np.bytes_ for seg in frame_segs])):
-            frame_segs = [seg.decode() for seg in frame_segs]
+    def _channel_indices(frame_segs, frame_final_segs):
+        frame_segs = [seg.decode() if type(seg) in {bytes, np.bytes_} else seg for seg in frame_segs]
+        return np.array([k for k, seg in enumerate(frame_segs) if seg in frame_final_segs], dtype=np.intp)
+    
+    # Names of the channels of a frame read by '_extract_frame': the channels
+    # 'frame_final_segs' found in the frame (in the frame order), then the
+    # missing ones (set to 0).
+    @staticmethod
+    def _channel_names(frame_segs, frame_final_segs = None):
+        frame_segs = [seg.decode() if type(seg) in {bytes, np.bytes_} else seg for seg in frame_segs]
         if(frame_final_segs is None):
-            n = frame.shape[2]
-            nb_channels = n
+            return frame_segs
+        found = [seg for seg in frame_segs if seg in frame_final_segs]
+        return found + [seg for seg in frame_final_segs if seg not in found]
+    
+    # Returns (buffer, view): 'view' is a C-contiguous array of shape 'shape' at
+    # the beginning of the flat 'buffer', reallocated (with a margin) only if 
+    # it is too small.
+    @staticmethod
+    def _frame_buffer(buffer, shape, dtype = np.float32):
+        size = int(np.prod(shape))
+        if(buffer is None):
+            buffer = np.empty(size, dtype=dtype)
+        elif(buffer.size < size):
+            buffer = np.empty(max(size, buffer.size + buffer.size//2), dtype=dtype)
+        return buffer, buffer[:size].reshape(shape)
+    
+    # Reads the channels 'frame_final_segs' (all by default) of an HDF5 frame
+    # directly in 'out' (allocated if None) and removes the 'NaN'. The result 
+    # can be a view of 'out'. The missing channels are set to 0.
+    @staticmethod
+    def _extract_frame(frame, frame_segs, frame_final_segs = None, verbose = False, out = None, channel_index = None):
+        if(frame_final_segs is None):
+            nb_channels = frame.shape[2]
+            selection = np.s_[:, :, :]
         else:
-            n = len(frame_segs)
             nb_channels = len(frame_final_segs)
+            if(channel_index is None):
+                channel_index = Data_Gen._channel_indices(frame_segs, frame_final_segs)
+            if(len(channel_index) > 0 and np.all(np.diff(channel_index) == 1)):
+                selection = np.s_[:, :, int(channel_index[0]):int(channel_index[-1])+1]
+            else:
+                selection = np.s_[:, :, list(channel_index)]
+        n = nb_channels if channel_index is None else len(channel_index)
         shape_frame = frame.shape[0:2] + (nb_channels,)
-        frame_tensor = np.zeros(shape_frame, dtype=np.float32)
-        channel_counter = 0
-        # Considers only certain segments
-        for k in range(n):
-            if(frame_final_segs is None or 
-               (frame_final_segs is not None and 
-               frame_segs[k] in frame_final_segs)):
-                frame_tensor[:,:,channel_counter] = frame[:,:,k]
-                channel_counter += 1
+        if(out is None):
+            out = np.empty(shape_frame, dtype=np.float32)
+        elif(out.shape != shape_frame):
+            raise RuntimeError('Buffer of shape {} used for a frame of shape {}'.format(out.shape, shape_frame))
+        if(out.size > 0 and n > 0):
+            frame.read_direct(out, source_sel=selection, dest_sel=np.s_[:, :, 0:n])
+        out[:, :, n:] = 0
         # Checks 'NaN' (be careful ,the size might change)
-        frame_tensor = Data_Gen._check_nan(frame_tensor, verbose)
-        return frame_tensor
+        return Data_Gen._check_nan(out, verbose)
         
+    # Every parameter that changes the data extracted from a file. It versions
+    # the features saved on disk.
+    def _preprocessing_config(self, resize_pic_in_same_vid = False):
+        return {'database_name': self.database_name,
+                'model_name': self.model_name,
+                'pb_kind': self.pb_kind,
+                'nb_classes': self.nb_classes,
+                'flare_level': self.flare_level,
+                'segs': self.segs,
+                'subsampling': self.subsampling,
+                'resize_method': self.resize_method,
+                'rescaling_factor': self.rescaling_factor,
+                'data_dims': self.data_dims,
+                'dtype': self.dtype.name,
+                'video_samples': self.video_samples(),
+                'resize_pic_in_same_vid': resize_pic_in_same_vid}
+    
+    # [path, size, mtime] of a file, read on disk (the manifest can be out of
+    # date) to version the data computed from it
+    @staticmethod
+    def _file_state(path):
+        try:
+            stat = os.stat(path)
+            return [path, stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            return [path]
+    
+    # Every parameter that changes the frames materialized by 'materialize.py',
+    # including the state of the HDF5 files. It versions the shards.
+    def _materialization_config(self):
+        files = [Data_Gen._file_state(path) for path in self.source_files]
+        return {'version': 1,
+                'database_name': self.database_name,
+                'pb_kind': self.pb_kind,
+                'nb_classes': self.nb_classes,
+                'flare_level': self.flare_level,
+                'segs': self.segs,
+                'subsampling': self.subsampling,
+                'resize_method': self.resize_method,
+                'data_dims': self.data_dims,
+                'max_pic_size': self.max_pic_size if self.resize_method == 'ZERO_PADDING' else None,
+                'normalization': self.normalization_key,
+                'files': files}
+    
+    # Directory of the shards matching the current configuration
+    def materialized_path(self):
+        if(self.materialized_dir is None):
+            raise RuntimeError('No directory set for the materialized data (\'materialized_dir\')')
+        key = hashlib.sha1(json.dumps(self._materialization_config(), sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(self.materialized_dir, key)
+    
+    # Returns the index of the shards matching the current configuration or None.
+    def _load_materialization(self):
+        path = self.materialized_path()
+        # The index is written last: if it exists, the shards are complete
+        if(not os.path.isfile(os.path.join(path, 'index.json'))):
+            return None
+        with open(os.path.join(path, 'index.json'), 'r') as f:
+            index = json.load(f)
+        index['path'] = path
+        index['labels'] = np.load(os.path.join(path, 'labels.npy'))
+        index['metadata'] = np.load(os.path.join(path, 'metadata.npy'))
+        if('table' not in index or index['metadata'].dtype != np.int32):
+            print('Warning: materialized data in {} without sample ids. Ignored'.format(path))
+            return None
+        index['table'] = Sample_Table.from_json(index['table'])
+        return index
+    
+    # Reads shards of preprocessed frames (1 sequential read per shard).
+    # OUTPUT: same as '_extract_data' (the ids refer to the table of the materialization)
+    def _read_shards(self, shards, vid_infos = False):
+        features = Feature_Array(self.dtype)
+        labels = []
+        metadata = []
+        self.memory_monitor.start()
+        self.spilled_files = []
+        shards_info = {os.path.join(self.materialized['path'], shard['file']): shard for shard in self.materialized['shards']}
+        for (k, path) in enumerate(shards):
+            (begin, end) = (shards_info[path]['begin'], shards_info[path]['end'])
+            data = np.load(path)[:end-begin]
+            features.extend(data)
+            labels += self.materialized['labels'][begin:end].tolist()
+            if(vid_infos):
+                metadata += list(self.materialized['metadata'][begin:end])
+            self.memory_monitor.add(data.size*self.dtype.itemsize)
+            print('Data extracted from {}.'.format(os.path.basename(path)))
+            # Backpressure: the shards left are read in the next batches
+            if(self.memory_monitor.exceeded() and k+1 < len(shards)):
+                self.spilled_files = shards[k+1:]
+                break
+        self.memory_monitor.report()
+        return features, np.array(labels), sample_table.to_array(metadata), self.materialized['table']
+    
+    # True if 1 sample = 1 video: each frame is flattened with its size (h, w)
+    # appended. The LSTM takes whole videos only when clips are sampled in them.
+    def video_samples(self):
+        return self.model_name == 'LRCN' or (self.model_name == 'LSTM' and self.clip_sampler is not None)
+    
+    # Bucketing is used to batch the pictures of various sizes together
+    def use_bucketing(self):
+        return (self.database_name == 'SF' and self.resize_method == 'NONE' and 
+                self.model_name in {'VGG_16', 'VGG_16_encoder_decoder'} and
+                ((self.nb_buckets is not None and self.nb_buckets > 0) or self.bucket_boundaries is not None))
+    
+    # Returns the sizes (h, w) of all the frames in the data set. Only the 
+    # metadata are read, and they are saved in the manifest.
+    def _frame_shapes(self):
+        shapes = []
+        for file_path in self.source_files:
+            info = self.manifest.file_info(file_path)
+            if(info is None or 'frame_shapes' not in info):
+                file_shapes = []
+                try:
+                    with H5_Pool.open(file_path) as db:
+                        for vid_key in db.keys():
+                            for frame_key in db[vid_key].keys():
+                                if('channels' in db[vid_key][frame_key].keys()):
+                                    file_shapes += [list(db[vid_key][frame_key]['channels'].shape[0:2])]
+                except:
+                    print('Impossible to get the size of pictures in {}'.format(file_path))
+                    print(traceback.format_exc())
+                    continue
+                self.manifest.set_file_info(file_path, 'frame_shapes', file_shapes, save=False)
+            else:
+                file_shapes = info['frame_shapes']
+            shapes += file_shapes
+        self.manifest.save()
+        return np.array(shapes, dtype=np.int64).reshape(-1, 2)
+    
+    # Bucket boundaries on each axis = quantiles of the heights and widths, so
+    # that the buckets are equally filled. The last boundary is the maximum.
+    @staticmethod
+    def _fit_bucket_boundaries(shapes, nb_buckets):
+        if(len(shapes) == 0):
+            print('Warning: no picture found to fit the buckets.')
+            return None
+        q = np.linspace(0, 1, nb_buckets+1)[1:]
+        boundaries = [sorted(set(np.ceil(np.quantile(shapes[:, k], q)).astype(int).tolist())) for k in range(2)]
+        # Padding waste: part of the batched pixels that are not valid
+        bucket_area = np.array([boundaries[0][i]*boundaries[1][j] for (i, j) in 
+                                zip(np.searchsorted(boundaries[0], shapes[:, 0]), np.searchsorted(boundaries[1], shapes[:, 1]))])
+        waste = 1 - np.sum(shapes[:, 0]*shapes[:, 1])/float(np.sum(bucket_area))
+        print('Buckets (heights: {}, widths: {}) fitted on {} pictures. Padding: {:.1f}%'.format(boundaries[0], boundaries[1], len(shapes), 100*waste))
+        return boundaries
+    
     # Extract the data from the list of files according to the parameters set.
     # OUTPUT : 2 lists that contains pictures of possibly various sizes and 
     # the labels associated. NOTE: if vid_infos is true, another list containing
-    # video information relatively to the picture is added. Each meta data is 
-    # formatted as : '{label}|{name_file}|{name_vid}|{frame_nb}|{size_h}|{size_w}'
+    # video information relatively to the picture is added: an array (n x 6) of
+    # sample ids (file, video, frame nb, size_h, size_w, class) resolved with the
+    # Sample_Table returned (built for this batch).
     def _extract_data(self, files_to_extract, 
                       saving = False, 
                       retrieve = False, 
                       vid_infos = False, 
                       resize_pic_in_same_vid = False,
                       verbose = False):
-        features = []
+        features = Feature_Array(self.dtype)
         labels = []
         metadata = []
-        memory_used = 0
-        for file_path in files_to_extract:
+        table = Sample_Table()
+        self.memory_monitor.start()
+        self.spilled_files = []
+        for (k, file_path) in enumerate(files_to_extract):
+            nb_bytes = features.nbytes
+            decoded = False
             if(os.path.isfile(file_path)):
                 try:
-                    with h5.File(file_path, 'r') as db:
+                    with H5_Pool.open(file_path) as db:
                         if(verbose):
                             print('Beginning to extract data from {}'.format(os.path.basename(file_path)))
                         if(self.database_name == 'SF' or self.database_name == 'SF_encoded'):
                             curr_features = None
                             curr_labels = None
                             curr_meta = None
+                            file_table = None # ids of the metadata of this file
+                            cache = None
                             if((retrieve or saving) and self.input_features_dir is not None):
-                                features_name =  re.sub('.hdf5', '', os.path.basename(file_path)) + '_features.bin'
-                                labels_name = re.sub('.hdf5', '', os.path.basename(file_path)) + '_labels.bin'
-                                features_path = os.path.join(self.input_features_dir, features_name)
-                                labels_path = os.path.join(self.input_features_dir, labels_name)
-                                if(vid_infos):
-                                    metadata_name = re.sub('.hdf5', '', os.path.basename(file_path)) + '_meta.bin'
-                                    metadata_path = os.path.join(self.input_features_dir, metadata_name)
+                                cache = Feature_Cache(self.input_features_dir)
+                                preprocessing = self._preprocessing_config(resize_pic_in_same_vid)
                             # First, check if we can retrieve features
-                            if(retrieve and os.path.isfile(features_path) 
-                                and os.path.isfile(labels_path)):
+                            if(retrieve and cache is not None):
                                 try:
-                                    with open(features_path, 'rb') as f:
-                                        curr_features = pickle.load(f)
-                                    with open(labels_path, 'rb') as l:
-                                        curr_labels = pickle.load(l)
-                                    if(vid_infos):
-                                      with open(metadata_path, 'rb') as m:
-                                        curr_meta = pickle.load(m)
-                                    memory_used += os.path.getsize(curr_features)
-                                    memory_used += os.path.getsize(curr_labels)
-                                    if(verbose):
-                                        print('Data retrieved from {}, {}'.format(features_name, labels_name))
-                                    if(vid_infos and verbose):
-                                        print('Meta data retrieved from {}'.format(metadata_name))
+                                    cached = cache.load(file_path, preprocessing)
+                                    if(cached is not None):
+                                        (curr_features, curr_labels, curr_meta, file_table, _) = cached
+                                        if(verbose):
+                                            print('Data retrieved from {}'.format(self.input_features_dir))
                                 except:
                                     print('Error while retrieving features.')
                                     print(traceback.format_exc())
@@ -470,106 +988,118 @@ class Data_Gen:
                             if(curr_features is None or curr_labels is None):
                                 # Takes each video in each file and down samples the nb of frames
                                 # and erase 'NaN'
-                                curr_features = []
+                                curr_features = Feature_Array(self.dtype)
                                 curr_labels = []
                                 curr_meta= []
+                                file_table = Sample_Table()
+                                buffer = None
                                 for vid_key in db.keys():
                                     frame_counter = 0
+                                    channel_index = None
                                     video = [] 
                                     label = self._label(db[vid_key].attrs['event_class'])
-                                    meta = '{}|{}|{}'.format(db[vid_key].attrs['event_class'], os.path.basename(file_path), vid_key)
+                                    if(self.database_name == 'SF_encoded'):
+                                        encoded = Encoded_Video(db[vid_key])
+                                        frame_keys = encoded.keys()
+                                    else:
+                                        frame_keys = self._ordered_frames(list(db[vid_key].keys()))
+                                    prefix = Sample_Table.frame_prefix(frame_keys[0]) if len(frame_keys) > 0 else 'frame'
+                                    vid_ids = file_table.video_ids(os.path.basename(file_path), vid_key, db[vid_key].attrs['event_class'], prefix)
                                         
-                                    for frame_key in self._ordered_frames(list(db[vid_key].keys())):
+                                    for frame_key in frame_keys:
                                         # subsample the video
                                         if(frame_counter % self.subsampling == 0):
-                                            if('channels' in db[vid_key][frame_key].keys()):
+                                            if(self.database_name == 'SF_encoded' or 'channels' in db[vid_key][frame_key].keys()):
                                                 if(self.database_name == 'SF'):
-                                                    frame_tensor = Data_Gen._extract_frame(db[vid_key][frame_key]['channels'], db[vid_key][frame_key].attrs['SEGS'], self.segs, verbose)
+                                                    # Reads the frame in a buffer reused for every frame
+                                                    frame = db[vid_key][frame_key]
+                                                    if(channel_index is None):
+                                                        channel_index = Data_Gen._channel_indices(frame.attrs['SEGS'], self.segs)
+                                                    buffer, out = Data_Gen._frame_buffer(buffer, frame['channels'].shape[0:2] + (len(self.segs),))
+                                                    frame_tensor = Data_Gen._extract_frame(frame['channels'], None, self.segs, verbose, out, channel_index)
+                                                    # The frames kept in 'video' must not share the buffer
+                                                    if(not self.video_samples() and resize_pic_in_same_vid):
+                                                        frame_tensor = np.array(frame_tensor)
                                                 else:
-                                                    frame_tensor = np.array(db[vid_key][frame_key]['channels'])
+                                                    frame_tensor = encoded.read(frame_key)
                                                 if(frame_tensor is None):
                                                     if(len(self.segs) == 0):
                                                         print('Warning: no segments to extract.')
-                                                        self.features.clear()
-                                                        self.labels.clear()
-                                                        self.metadata.clear()
-                                                        return
+                                                        return Feature_Array(self.dtype), np.array([]), sample_table.to_array([]), table
                                                     else:
                                                         raise RuntimeError('None frame in file {}, video {}'.format(file_path, vid_key))
-                                                if(self.model_name == 'LRCN'):
-                                                    size = db[vid_key][frame_key].attrs['size']
+                                                if(self.video_samples()):
+                                                    if(self.database_name == 'SF_encoded'):
+                                                        size = encoded.size(frame_key)
+                                                    else:
+                                                        size = db[vid_key][frame_key].attrs['size']
                                                     video += [np.append(frame_tensor.flatten(), size)]
                                                 else:
                                                     if(not resize_pic_in_same_vid):
-                                                        curr_features += [frame_tensor]
+                                                        curr_features.append(frame_tensor)
                                                     else:
                                                         video += [frame_tensor]
                                                     curr_labels += [label]
-                                                    curr_meta += ['{}|{}|{}|{}'.format(meta, frame_key, frame_tensor.shape[0], frame_tensor.shape[1])]
-                                                
-                                                memory_used += frame_tensor.nbytes
+                                                    curr_meta += [Sample_Table.sample_id(vid_ids, frame_key, frame_tensor.shape[0], frame_tensor.shape[1])]
                                     # 1 sample = 1 video
-                                    if(self.model_name == 'LRCN' and len(video) > 0):
+                                    if(self.video_samples() and len(video) > 0):
                                         #curr_features += [self._resize_video(video)]
-                                        curr_features += [np.array(video, dtype=np.float32)]
+                                        curr_features.append(np.array(video, dtype=self.dtype))
                                         curr_labels += [label]
-                                        curr_meta += [meta]
+                                        curr_meta += [Sample_Table.sample_id(vid_ids)]
                                     # expands the video
                                     elif(resize_pic_in_same_vid and len(video) > 0):
-                                        curr_features += self._resize_video(video).tolist()
+                                        curr_features.extend(self._resize_video(video))
                                     
                                 print('Data extracted from {}.'.format(os.path.basename(file_path)))
-                                if(saving):
+                                if(saving and cache is not None):
                                     try:
-                                        with open(features_path, 'wb') as f:
-                                            pickle.dump(curr_features, f)
-                                        with open(labels_path, 'wb') as l:
-                                            pickle.dump(curr_labels, l)
+                                        cache.save(file_path, preprocessing, curr_features, curr_labels, curr_meta, file_table, self.dtype)
                                         print('Features saved in {}'.format(self.input_features_dir))
                                     except:
                                         print('Impossible to save the data extracted.')
                                         print(traceback.format_exc())
                                         raise
-                            features += curr_features
+                            features.extend(curr_features)
                             labels += curr_labels
                             if(vid_infos):
-                                metadata += curr_meta
+                                metadata += list(table.merge(file_table, sample_table.to_array(curr_meta)))
                                 
                         else:
                             if(self.database_name in {'MNIST', 'CIFAR-10', 'IMG_NET'}):
                                 if(vid_infos):
                                     print('Warning: no meta data available for data base {}'.format(self.database_name))
-                                curr_features = np.array(db['features']).tolist()
-                                curr_labels = np.array(db['labels']).tolist()
-                                memory_used += np.array(db['features']).nbytes + np.array(db['labels']).nbytes
+                                curr_features = Feature_Array.from_dense(db['features'][()], self.dtype)
+                                curr_labels = db['labels'][()].tolist()
                             
                             elif(self.database_name == 'SF_LSTM'):
                                 print('Not implemented yet !')
                                 raise
                             
                             if(len(curr_features) == len(curr_labels)):
-                                features += curr_features
+                                features.extend(curr_features)
                                 labels +=  curr_labels
                             else:
                                 print('Features and labels have different lengths in file {}. Ignored'.format(file_path))
+                        decoded = True
                 except:
                     print('Impossible to extract features from {}'.format(file_path))
                     print(traceback.format_exc())
             else:
                 print('File {} does not exist. Ignored'.format(file_path))
-        # Clears properly the arrays
-        self.features.clear()
-        self.labels.clear()
-        self.metadata.clear()
-        
-        # Stores the data in memory 
-        self.features = features
-        self.labels = labels
-        if(vid_infos):
-            self.metadata= metadata
-        if(memory_used > 0):
-            print('Memory used: {}MB'.format(memory_used/(1024*1024)))
-        return (len(self.features) == 0)
+                continue
+            # Bytes really decoded from this file
+            nb_bytes = features.nbytes - nb_bytes
+            self.memory_monitor.add(nb_bytes)
+            if(decoded):
+                self._learn_expansion_ratio(file_path, nb_bytes)
+            # Backpressure: the files left are loaded in the next batches
+            if(self.memory_monitor.exceeded() and k+1 < len(files_to_extract)):
+                self.spilled_files = files_to_extract[k+1:]
+                break
+        self.manifest.save()
+        self.memory_monitor.report()
+        return features, np.array(labels), sample_table.to_array(metadata), table
     
     def gen_batch_dataset(self, 
                    save_extracted_data = False, 
@@ -580,28 +1110,93 @@ class Data_Gen:
                    rm_paths_to_file = True,
                    verbose = False):
         
-        batch_mem = 0
-        if(take_random_files):
-            files_index = np.random.permutation(len(self.size_of_files))
+        if(self.input_mode != 'CHUNKED'):
+            return self._gen_stream_index(take_random_files, verbose)
+        
+        args = (save_extracted_data, retrieve_data, take_random_files, get_metadata, 
+                resize_pic_in_same_vid, rm_paths_to_file, verbose)
+        if(not self.double_buffering):
+            (features, labels, metadata, table) = self._load_next_batch(*args)
+            self.batch_memory = self.memory_monitor.stats()
         else:
-            # Heuristic to know which files we will consider
-            files_index = np.argsort(self.size_of_files)
-        
-        # Stores the file paths according to their size (by taking random files or 
-        # by using a heuristic inspired from the knapspack pb).
-        files_in_batch= []
-        counter = 0
-        for k in files_index:
-            if self.size_of_files[k] + batch_mem <= self.memory_size:
-                files_in_batch += [self.paths_to_file[k]]
-                batch_mem += self.size_of_files[k]
-                counter += 1
+            # Waits for the batch loaded in background (if any) and starts
+            # to load the next one
+            start = time.time()
+            if(self.prefetch_thread is None):
+                (features, labels, metadata, table) = self._load_next_batch(*args)
             else:
-                break
-        self.num_files_analyzed += counter
+                self.prefetch_thread.join()
+                self.prefetch_thread = None
+                if(self.prefetch_error is not None):
+                    error, self.prefetch_error = self.prefetch_error, None
+                    raise error
+                (features, labels, metadata, table) = self.prefetched_batch
+                self.prefetched_batch = None
+            self.batch_memory = self.memory_monitor.stats()
+            self.data_wait_time = time.time() - start
+            self.total_data_wait_time += self.data_wait_time
+            if(len(features) > 0 and len(self.paths_to_file) > 0):
+                self.prefetch_thread = threading.Thread(target=self._prefetch_next_batch, args=args, daemon=True)
+                self.prefetch_thread.start()
+        
+        # Clears properly the arrays and stores the data in memory
+        self.features.clear()
+        self.labels = np.array([])
+        self.metadata = sample_table.to_array([])
+        self.features = features
+        self.labels = labels
+        if(get_metadata):
+            self.metadata = metadata
+            self.sample_table = table
+        if(len(self.features) > 0):
+            print('{} elements extracted.\n'.format(len(self.features)))
+        return (len(self.features) == 0)
+    
+    # Target of the background thread in double buffering mode
+    def _prefetch_next_batch(self, *args):
+        try:
+            self.prefetched_batch = self._load_next_batch(*args)
+        except Exception as e:
+            self.prefetched_batch = None
+            self.prefetch_error = e
+    
+    # Waits for the batch being loaded in background, if any, and drops it
+    def stop_prefetching(self):
+        if(self.prefetch_thread is not None):
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
+        self.prefetched_batch = None
+        self.prefetch_error = None
+    
+    # Selects the next files that fit in memory and extracts them
+    def _load_next_batch(self, 
+                         save_extracted_data = False, 
+                         retrieve_data = False,
+                         take_random_files = False,
+                         get_metadata = False,
+                         resize_pic_in_same_vid = False,
+                         rm_paths_to_file = True,
+                         verbose = False):
+        # Packs the remaining files in memory batches (random packing for the 
+        # training, first-fit decreasing otherwise). The plan is kept until 
+        # the end of the epoch.
+        if(self.scheduler is None):
+            policy = 'RANDOM_BEST_FIT' if take_random_files else 'FIRST_FIT_DECREASING'
+            self.scheduler = File_Scheduler(self.size_of_files, self.batch_memory_size(), policy, self.random_state)
+            self.scheduled_paths = list(self.paths_to_file)
+            self.scheduled_sizes = list(self.size_of_files)
+            if(len(self.scheduler.oversized) > 0):
+                self._drop_oversized([self.scheduled_paths[k] for k in self.scheduler.oversized])
+        (files_index, batch_mem, usage) = self.scheduler.next_batch(pop=rm_paths_to_file)
+        files_in_batch = [self.scheduled_paths[k] for k in files_index]
+        self.batch_usage = usage
+        if(len(files_in_batch) > 0):
+            print('Batch of {} files: {:.1f}MB ({:.1f}% of {:.1f}MB)'.format(len(files_in_batch), batch_mem, usage, self.batch_memory_size()))
         if(rm_paths_to_file):
-            self.size_of_files = [s for k, s in enumerate(self.size_of_files) if k not in files_index[:counter]]
-            self.paths_to_file = [s for k, s in enumerate(self.paths_to_file) if k not in files_index[:counter]]
+            self.num_files_analyzed += len(files_in_batch)
+            in_batch = set(files_in_batch)
+            self.size_of_files = [s for s, path in zip(self.size_of_files, self.paths_to_file) if path not in in_batch]
+            self.paths_to_file = [path for path in self.paths_to_file if path not in in_batch]
         
         if(verbose):
             print('Files to be loaded in memory : ')
@@ -609,15 +1204,173 @@ class Data_Gen:
                 print('\t - {} => {}MB'.format(os.path.basename(f), math.ceil(os.path.getsize(f)/(1024.0*1024))))
         
         # Loads the data in memory
-        end_of_data = self._extract_data(files_in_batch, 
-                                         save_extracted_data, 
-                                         retrieve_data, 
-                                         vid_infos = get_metadata, 
-                                         resize_pic_in_same_vid = resize_pic_in_same_vid,
-                                         verbose=verbose)
-        if(len(self.features) > 0):
-            print('{} elements extracted.\n'.format(len(self.features)))
-        return(end_of_data)
+        if(self.materialized is not None):
+            batch = self._read_shards(files_in_batch, get_metadata)
+        else:
+            batch = self._extract_data(files_in_batch, 
+                                       save_extracted_data, 
+                                       retrieve_data, 
+                                       vid_infos = get_metadata, 
+                                       resize_pic_in_same_vid = resize_pic_in_same_vid,
+                                       verbose=verbose)
+        if(len(self.spilled_files) > 0):
+            self._spill(self.spilled_files, rm_paths_to_file)
+        return batch
+    
+    # The files bigger than the memory of a batch (ex: a file spilled whose 
+    # size was estimated again with its expansion ratio) are never loaded: 
+    # they are counted as analyzed and removed from the files left.
+    def _drop_oversized(self, files):
+        print('Warning: {} files bigger than the batch memory ({:.1f}MB) ignored: {}'.format(
+              len(files), self.batch_memory_size(), [os.path.basename(path) for path in files]))
+        oversized = set(files)
+        self.size_of_files = [s for s, path in zip(self.size_of_files, self.paths_to_file) if path not in oversized]
+        self.paths_to_file = [path for path in self.paths_to_file if path not in oversized]
+        self.num_files_analyzed += len(files)
+    
+    # The files not loaded because the RSS ceiling was reached go back to the
+    # files left, and the batches left are planned again with their sizes.
+    def _spill(self, files, rm_paths_to_file = True):
+        print('Warning: RSS ceiling reached ({}MB). {} files moved to the next batches'.format(self.memory_monitor.rss_ceiling, len(files)))
+        if(not rm_paths_to_file):
+            return
+        sizes = dict(zip(self.scheduled_paths, self.scheduled_sizes))
+        for path in files:
+            self.paths_to_file += [path]
+            self.size_of_files += [sizes[path] if self.materialized is not None else self._estimated_size(path)]
+        self.num_files_analyzed -= len(files)
+        self.scheduler = None
+    
+    # Memory available for 1 batch (in MB). In double buffering mode, 2 batches
+    # are in memory at the same time.
+    def batch_memory_size(self):
+        if(self.double_buffering):
+            return self.memory_size/2.0
+        return self.memory_size
+    
+    # In streaming mode, all the files left are indexed at once (only the
+    # metadata are read). The samples are then read one at a time by
+    # 'stream_generator'.
+    def _gen_stream_index(self, take_random_files = False, verbose = False):
+        files = list(self.paths_to_file)
+        self.num_files_analyzed += len(files)
+        self.paths_to_file = []
+        self.size_of_files = []
+        self.features.clear()
+        self.labels = np.array([])
+        self.metadata = sample_table.to_array([])
+        self.sample_table = Sample_Table()
+        self.stream_index = self._build_stream_index(files, verbose)
+        if(take_random_files):
+            self.stream_index = [self.stream_index[k] for k in self.random_state.permutation(len(self.stream_index))]
+        if(len(self.stream_index) > 0):
+            print('{} elements indexed in {} files.\n'.format(len(self.stream_index), len(files)))
+        return (len(self.stream_index) == 0)
+    
+    # Builds the list of samples found in 'files' without reading any pixel.
+    # Each entry is (file_path, vid_key, frame_keys, label, video ids): 1 entry
+    # is 1 frame, except for LRCN where 1 entry is 1 video. For the other data
+    # bases, 1 entry is 1 row of '/features' (vid_key is the row index).
+    def _build_stream_index(self, files, verbose = False):
+        index = []
+        for file_path in files:
+            try:
+                with H5_Pool.open(file_path) as db:
+                    if(self.database_name in {'SF', 'SF_encoded'}):
+                        for vid_key in db.keys():
+                            label = self._label(db[vid_key].attrs['event_class'])
+                            if(self.database_name == 'SF_encoded'):
+                                frames = [frame_key for k, frame_key in enumerate(Encoded_Video(db[vid_key]).keys()) if k % self.subsampling == 0]
+                            else:
+                                frames = [frame_key for k, frame_key in enumerate(self._ordered_frames(list(db[vid_key].keys())))
+                                          if k % self.subsampling == 0 and 'channels' in db[vid_key][frame_key].keys()]
+                            prefix = Sample_Table.frame_prefix(frames[0]) if len(frames) > 0 else 'frame'
+                            meta = self.sample_table.video_ids(os.path.basename(file_path), vid_key, db[vid_key].attrs['event_class'], prefix)
+                            if(self.model_name == 'LRCN'):
+                                if(len(frames) > 0):
+                                    index += [(file_path, vid_key, frames, label, meta)]
+                            else:
+                                index += [(file_path, vid_key, [frame_key], label, meta) for frame_key in frames]
+                    else:
+                        labels = np.array(db['labels']).tolist()
+                        index += [(file_path, k, None, labels[k], None) for k in range(len(labels))]
+                if(verbose):
+                    print('File {} indexed.'.format(os.path.basename(file_path)))
+            except:
+                print('Impossible to index {}'.format(file_path))
+                print(traceback.format_exc())
+        return index
+    
+    # Reads the sample described by an entry of the stream index (see 
+    # 'Sample_Reader.read')
+    def _read_stream_sample(self, entry, verbose = False, reuse_buffer = False):
+        if(self.sample_reader is None):
+            self.sample_reader = Sample_Reader(self.database_name, self.model_name, self.segs, self.dtype)
+        return self.sample_reader.read(entry, verbose, reuse_buffer)
+    
+    # Size (in bytes) of the shared memory slots in 'PARALLEL' mode: at least
+    # 'slot_memsize' and large enough for a frame of 'max_pic_size'.
+    def _slot_size(self):
+        slot_size = self.slot_memsize*1024*1024
+        if(self.max_pic_size is not None and self.segs is not None and self.model_name != 'LRCN'):
+            slot_size = max(slot_size, int(np.prod(self.max_pic_size[0:2]))*len(self.segs)*self.dtype.itemsize)
+        return slot_size
+    
+    # Used as input for the TensorFlow pipeline in streaming mode. A background
+    # thread reads at most 'read_ahead' samples in advance so that the peak
+    # memory does not depend on the size of the files.
+    def stream_generator(self, use_metadata = False):
+        index = self.stream_index
+        samples = queue.Queue(maxsize=max(1, self.read_ahead))
+        stop = threading.Event()
+        
+        def put(item):
+            while(not stop.is_set()):
+                try:
+                    samples.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        
+        def reader():
+            for entry in index:
+                if(stop.is_set()):
+                    return
+                try:
+                    put(self._read_stream_sample(entry))
+                except:
+                    print('Impossible to read sample {} from {}. Ignored'.format(entry[1:3], entry[0]))
+                    print(traceback.format_exc())
+            put(None)
+        
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        try:
+            while(True):
+                sample = samples.get()
+                if(sample is None):
+                    break
+                if(use_metadata):
+                    yield sample
+                else:
+                    yield sample[:2]
+        finally:
+            stop.set()
+    
+    # Used as input for the TensorFlow pipeline in parallel mode: 'nb_workers'
+    # processes read and clean the samples, in the order of the index.
+    def parallel_generator(self, use_metadata = False):
+        # Only needed in this mode
+        from parallel_loader import Parallel_Loader
+        # Each worker copies the sample in shared memory right after reading it
+        if(self.sample_reader is None):
+            self.sample_reader = Sample_Reader(self.database_name, self.model_name, self.segs, self.dtype)
+        loader = Parallel_Loader(self.sample_reader, self.nb_workers, self._slot_size())
+        for sample in loader.generate(self.stream_index):
+            if(use_metadata):
+                yield sample
+            else:
+                yield sample[:2]
     
     def get_num_files_analyzed(self):
         return self.num_files_analyzed
@@ -625,53 +1378,29 @@ class Data_Gen:
     def get_num_total_files(self):
         return self.nb_total_files
     
+    # Nb of samples given by the pipeline for the current batch (1 / crop
+    # with 'RANDOM_CROP')
     def get_num_features(self):
-        return len(self.features)
-    
-    # Adds the features extracted by the Neural Network to the 'output_features' dictionnary.
-    def add_output_features(self, features, metadata):
-        assert len(features) == len(metadata)
-        
-        for k in range(len(metadata)):
-            meta = metadata[k].decode()
-            # meta == 'label|file|video|frame_nb|size_h,|size_w'
-            if(re.match('.+\|.+\|.+\|.+\|.+\|.+', meta)):
-                meta_list = re.split(r'\|', meta)
-                if(len(meta_list) == 6):
-                    (label, file, video, frame_nb, size_h, size_w) = meta_list
-                    (size_h, size_w) = (int(size_h), int(size_w))
-                    if(file in self.output_features and video in self.output_features[file]):
-                        if(frame_nb not in self.output_features[file][video]):
-                            self.output_features[file][video].update({frame_nb: {'features': features[k], 'size': [size_h, size_w]}})
-                        else:
-                            print('Warning: frame {} already exists in file {}, video {}. Ignored'.format(frame_nb, file, video))
-                    elif(file in self.output_features):
-                        self.output_features[file].update({video: {frame_nb: {'features': features[k], 'size': [size_h, size_w]}}})
-                        self.output_labels[file].update({video: label})
-                    else:
-                        self.output_features.update({file: {video: {frame_nb: {'features': features[k], 'size': [size_h, size_w]}}}})
-                        self.output_labels.update({file: {video: label}})
-                else:
-                    print('Impossible to parse the metadata {}. Feature ignored'.format(meta))
-            else:
-                print('Unknown format for metadata {}. Feature ignored.'.format(meta))
-    
-    def dump_output_features(self):
-        for f_key, f_val in self.output_features.items():
-            file_path = os.path.join(self.output_features_dir, f_key)
-            with h5.File(file_path, 'w') as f:
-                for vid_key, vid_val in f_val.items():
-                    f.create_group(vid_key)
-                    for frame_key, frame_val in vid_val.items():
-                        f[vid_key].create_group(frame_key)
-                        f[vid_key][frame_key].attrs['size'] = frame_val['size']
-                        f[vid_key][frame_key].create_dataset('channels', data=np.array(frame_val['features'], dtype=np.float32))
-                    f[vid_key].attrs['event_class'] = self.output_labels[f_key][vid_key]
-            print('File {} saved.'.format(f_key))
-        
-        # Clears the dictionnaries and increments the part counter
-        self.output_features.clear()
-        self.output_labels.clear()
+        if(self.input_mode != 'CHUNKED'):
+            num_features = len(self.stream_index)
+        elif(self.clip_sampler is not None):
+            num_features = self.clip_sampler.num_clips(self.features)
+        else:
+            num_features = len(self.features)
+        if(self.resize_method == 'RANDOM_CROP' and self.model_name in {'VGG_16', 'VGG_16_encoder_decoder'}):
+            return num_features*self.nb_crops
+        return num_features
+    
+    # Returns a writer of the features extracted by the Neural Network in
+    # 'output_features_dir' (see 'Feature_Writer'). The crops of a picture
+    # ('RANDOM_CROP') have the same sample id, so their features cannot be saved.
+    def open_feature_writer(self):
+        if(self.resize_method == 'RANDOM_CROP'):
+            raise RuntimeError('The features of the random crops cannot be saved (the crops of a picture have the same id)')
+        return Feature_Writer(self.output_features_dir, 
+                              compression=self.output_compression,
+                              flush_memsize=self.output_flush_memsize,
+                              flush_interval=self.output_flush_interval)
 
      # Used as input for the TensorFlow pipeline
     @staticmethod
@@ -692,6 +1421,72 @@ class Data_Gen:
     def _get_key_from_tensor(self, tensor):
         return tf.cast(tf.shape(tensor)[0] +(max(self.max_pic_size)+1)*tf.shape(tensor)[1], tf.int64)
    
+    # Pads (with zeros, centered) or crops a picture to the size of its bucket:
+    # the smallest bucket containing it, if any, the biggest one otherwise.
+    # The models see the padding as pixels (SPP bins and reconstruction loss
+    # include it): the fewer buckets, the more the features of the small
+    # pictures are biased towards the padding value.
+    def _bucketing(self, pic, label, *kw):
+        h_bounds = tf.constant(self.bucket_boundaries[0], dtype=tf.int32)
+        w_bounds = tf.constant(self.bucket_boundaries[1], dtype=tf.int32)
+        i = tf.minimum(tf.reduce_sum(tf.cast(h_bounds < tf.shape(pic)[0], tf.int32)), len(self.bucket_boundaries[0])-1)
+        j = tf.minimum(tf.reduce_sum(tf.cast(w_bounds < tf.shape(pic)[1], tf.int32)), len(self.bucket_boundaries[1])-1)
+        pic = tf.image.resize_image_with_crop_or_pad(pic, h_bounds[i], w_bounds[j])
+        return (pic, label) + tuple(kw)
+    
+    # Samples 'nb_crops' crops of size 'crop_size' in a picture (padded with 
+    # zeros if it is smaller) after its standardization. If 'crop_bias' > 0, 
+    # the centers of the crops are drawn with a probability ~ |B|^crop_bias, 
+    # B = radial field 'Br' (or norm of the channels), so that the strong 
+    # field regions are cropped more often. Returns (nb_crops, h, w, c).
+    def _random_crops(self, pic):
+        (ch, cw) = self.crop_size
+        h = tf.maximum(tf.shape(pic)[0], ch)
+        w = tf.maximum(tf.shape(pic)[1], cw)
+        if(self.crop_bias > 0):
+            segs = self._frame_channel_names()
+            if(segs is not None and 'Br' in segs):
+                field = tf.abs(tf.cast(pic[:, :, segs.index('Br')], tf.float32))
+            else:
+                field = tf.norm(tf.cast(pic, tf.float32), axis=2)
+            field = tf.image.resize_image_with_crop_or_pad(tf.expand_dims(field, 2), h, w)
+            logits = self.crop_bias*tf.log(tf.reshape(field, [1, -1]) + 1e-6)
+            centers = tf.cast(tf.multinomial(logits, self.nb_crops)[0], tf.int32)
+            offsets = tf.stack([tf.clip_by_value(centers//w - ch//2, 0, h-ch),
+                                tf.clip_by_value(centers%w - cw//2, 0, w-cw)], axis=1)
+        else:
+            offsets = tf.stack([tf.random_uniform([self.nb_crops], maxval=h-ch+1, dtype=tf.int32),
+                                tf.random_uniform([self.nb_crops], maxval=w-cw+1, dtype=tf.int32)], axis=1)
+        pic = tf.image.resize_image_with_crop_or_pad(self._standardization(pic), h, w)
+        crops = tf.map_fn(lambda offset: tf.slice(pic, [offset[0], offset[1], 0], [ch, cw, -1]), offsets, dtype=pic.dtype)
+        crops.set_shape([self.nb_crops, ch, cw, pic.shape[-1]])
+        return crops
+    
+    # Names of the channels of the frames given to the pipeline, in the order
+    # of the files (see '_channel_names'), read in the first frame found
+    def _frame_channel_names(self):
+        if(self.database_name != 'SF'):
+            return self.segs
+        for file_path in self.source_files:
+            try:
+                with H5_Pool.open(file_path) as db:
+                    for vid_key in db.keys():
+                        for frame_key in db[vid_key].keys():
+                            if('SEGS' in db[vid_key][frame_key].attrs):
+                                return Data_Gen._channel_names(db[vid_key][frame_key].attrs['SEGS'], self.segs)
+            except:
+                print('Impossible to read the channels of {}'.format(file_path))
+                print(traceback.format_exc())
+        return self.segs
+    
+    # Per image standardization, or affine transform of each channel with the
+    # statistics of the training set ('PRECOMPUTED'): 1 fused element-wise op
+    def _standardization(self, pic):
+        if(self.normalization_affine is None):
+            return tf.image.per_image_standardization(pic)
+        (scale, offset, low, high) = self.normalization_affine
+        return tf.minimum(tf.maximum(tf.cast(pic, tf.float32), low), high)*scale + offset
+    
     def _zero_padding(self, pic):
         pad_x_up = math.floor((self.max_pic_size[0]-pic.shape[0])/2.0)
         pad_x_down = self.max_pic_size[0] - (pad_x_up + pic.shape[0])
@@ -703,57 +1498,97 @@ class Data_Gen:
     
     def data_preprocessing(self):
         if(self.resize_method == 'NONE'):
-            self.dataset = self.dataset.map(lambda pic, label, *kw: (tf.image.per_image_standardization(pic), label, *kw), self.num_threads)
+            self.dataset = self.dataset.map(lambda pic, label, *kw: (self._standardization(pic), label, *kw), self.num_threads)
         
         elif(self.resize_method == 'LIN_RESIZING'):
-            self.dataset = self.dataset.map(lambda pic, label, *kw: (tf.image.per_image_standardization(tf.image.resize_images(pic, size=self.data_dims[0:2], 
+            self.dataset = self.dataset.map(lambda pic, label, *kw: (self._standardization(tf.image.resize_images(pic, size=self.data_dims[0:2], 
                                                                                                                                method=tf.image.ResizeMethod.BILINEAR)),
                                                                     label, *kw), self.num_threads)
         
         elif(self.resize_method == 'QUAD_RESIZING'):
-            self.dataset = self.dataset.map(lambda pic, label, *kw : (tf.image.per_image_standardization(
+            self.dataset = self.dataset.map(lambda pic, label, *kw : (self._standardization(
                                                                     tf.image.resize_images(pic, 
                                                                                            size=self.data_dims[0:2], 
                                                                                            method=tf.image.ResizeMethod.BICUBIC)),
                                                                  label, *kw), self.num_threads)
         
         elif(self.resize_method == 'ZERO_PADDING'):
-            self.dataset = self.dataset.map(lambda pic, label, *kw : (self._zero_padding(tf.image.per_image_standardization(pic)),
+            self.dataset = self.dataset.map(lambda pic, label, *kw : (self._zero_padding(self._standardization(pic)),
                                                                  label, *kw), self.num_threads)
+        
+        elif(self.resize_method == 'RANDOM_CROP'):
+            # Each crop is a sample with the label (and metadata) of its picture
+            repeat = lambda t: tf.tile(tf.expand_dims(t, 0), [self.nb_crops] + [1]*len(t.shape))
+            self.dataset = self.dataset.map(lambda pic, label, *kw : (self._random_crops(pic), repeat(label), *[repeat(t) for t in kw]), 
+                                            self.num_threads)
+            self.dataset = self.dataset.apply(tf.contrib.data.unbatch())
             
         else:
             raise RuntimeError('Error: unknown resizing method')
     
     def create_tf_dataset_and_preprocessing(self, use_metadata = False):
         if(self.pb_kind in {'classification', 'encoder'}):
-            output_types = (tf.float32, tf.int32)
+            output_types = (tf.as_dtype(self.dtype), tf.int32)
         elif(self.pb_kind == 'regression'):
-            output_types = (tf.float32, tf.float32)
+            output_types = (tf.as_dtype(self.dtype), tf.float32)
         else:
             print('Illegal kind of problem: {}'.format(self.pb_kind))
             raise
         output_shapes = (tf.TensorShape([None for k in range(len(self.data_dims)-1)] + [self.data_dims[-1]]), tf.TensorShape([]))
+        if(self.clip_sampler is not None):
+            output_shapes = (tf.TensorShape([self.clip_sampler.window, self.data_dims[-1]]), tf.TensorShape([]))
         
         if(use_metadata):
-            output_types += (tf.string,)
-            output_shapes += (tf.TensorShape([]),)
+            output_types += (tf.int32,)
+            output_shapes += (tf.TensorShape([sample_table.ID_SIZE]),)
         
-        self.dataset = tf.data.Dataset.from_generator(lambda: Data_Gen.generator(self.features, self.labels, self.metadata, use_metadata),
+        if(self.input_mode == 'STREAMING'):
+            generator = lambda: self.stream_generator(use_metadata)
+        elif(self.input_mode == 'PARALLEL'):
+            generator = lambda: self.parallel_generator(use_metadata)
+        elif(self.clip_sampler is not None):
+            generator = lambda: self.clip_sampler.generate(self.features, self.labels, self.metadata, use_metadata)
+        else:
+            generator = lambda: Data_Gen.generator(self.features, self.labels, self.metadata, use_metadata)
+        self.dataset = tf.data.Dataset.from_generator(generator,
                                                       output_types = output_types,
                                                       output_shapes = output_shapes)
         
         if(self.model_name in {'VGG_16', 'VGG_16_encoder_decoder'}):
-            self.data_preprocessing()
-            self.dataset = self.dataset.apply(tf.contrib.data.group_by_window(lambda pic, label, *kw: self._get_key_from_tensor(pic),
-                                                                              lambda key, tensors : tensors.batch(self.batch_size),
-                                                                              window_size=self.batch_size))
+            # The materialized frames are already preprocessed
+            if(self.materialized is None):
+                self.data_preprocessing()
+            # The pictures of the same bucket have the same size
+            bucketing = self.use_bucketing() and self.bucket_boundaries is not None
+            if(bucketing):
+                self.dataset = self.dataset.map(self._bucketing, self.num_threads)
+            if(self.resize_method == 'RANDOM_CROP'):
+                # All the crops have the same size
+                self.dataset = self.dataset.batch(self.batch_size)
+            else:
+                # Each bucket emits its last (partial) window at the end of the
+                # data set. For the training with buckets, they are dropped so
+                # that all the batches have 'batch_size' pictures.
+                if(bucketing and self.training_mode):
+                    batch = lambda key, tensors : tensors.apply(tf.contrib.data.batch_and_drop_remainder(self.batch_size))
+                else:
+                    batch = lambda key, tensors : tensors.batch(self.batch_size)
+                self.dataset = self.dataset.apply(tf.contrib.data.group_by_window(lambda pic, label, *kw: self._get_key_from_tensor(pic),
+                                                                                  batch, window_size=self.batch_size))
             self.dataset = self.dataset.prefetch(buffer_size = self.prefetch_buffer_size)
             
         elif(self.model_name == 'LSTM'):
-            self.seq_length = self.dataset.apply(tf.contrib.data.map_and_batch(lambda seq, label, *kw: tf.shape(seq)[0], 
-                                                                               self.batch_size, self.num_threads))
-            self.seq_length_iterator = self.seq_length.make_initializable_iterator()
-            self.dataset = self.dataset.padded_batch(self.batch_size, padded_shapes=output_shapes)
+            # The length of each sequence is appended to the element (last one)
+            self.dataset = self.dataset.map(lambda seq, label, *kw: (seq, label) + tuple(kw) + (tf.shape(seq)[0],), self.num_threads)
+            output_shapes += (tf.TensorShape([]),)
+            if(self.seq_length_buckets):
+                # Sequences of similar lengths are padded together
+                self.dataset = self.dataset.apply(tf.contrib.data.bucket_by_sequence_length(lambda seq, label, *kw: kw[-1],
+                                                                                            list(self.seq_length_buckets),
+                                                                                            (len(self.seq_length_buckets)+1)*[self.batch_size],
+                                                                                            padded_shapes=output_shapes))
+            else:
+                self.dataset = self.dataset.padded_batch(self.batch_size, padded_shapes=output_shapes)
             self.dataset = self.dataset.prefetch(buffer_size = self.prefetch_buffer_size)
         
         elif(self.model_name == 'LRCN'):
@@ -765,13 +1600,66 @@ class Data_Gen:
         
         self.data_iterator = self.dataset.make_initializable_iterator()
         
+    # For LSTM, returns (data, lengths of the sequences)
     def get_next_batch(self):
-        if(self.database_name == 'SF_LSTM'):
-            return (self.data_iterator.get_next(), self.seq_length_iterator.get_next())
+        if(self.model_name == 'LSTM'):
+            next_batch = self.data_iterator.get_next()
+            return (next_batch[:-1], next_batch[-1])
         else:
             return self.data_iterator.get_next()
+
+
+# Reads the samples of the stream index of a Data_Gen (1 entry -> (features,
+# label, metadata)). It only holds the parameters needed to read them, so that
+# it can be pickled to the worker processes of 'Parallel_Loader'.
+class Sample_Reader:
+    
+    database_name = None
+    model_name = None
+    segs = None
+    dtype = None
+    frame_buffer = None # flat buffer where the frames are read
     
+    def __init__(self, database_name, model_name, segs, dtype):
+        self.database_name = database_name
+        self.model_name = model_name
+        self.segs = segs
+        self.dtype = dtype
     
+    # The buffer is not sent to the worker processes
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('frame_buffer', None)
+        return state
     
-
-                
+    # Reads the sample described by an entry of the stream index. Returns
+    # (features, label, metadata) formatted as in '_extract_data'. With 
+    # 'reuse_buffer', a frame is read in a buffer reused at the next call
+    # (the caller must copy it before).
+    def read(self, entry, verbose = False, reuse_buffer = False):
+        (file_path, vid_key, frame_keys, label, meta) = entry
+        with H5_Pool.open(file_path) as db:
+            if(frame_keys is None):
+                return np.array(db['features'][vid_key], dtype=self.dtype), label, np.full(sample_table.ID_SIZE, -1, dtype=np.int32)
+            video = []
+            channel_index = None
+            encoded = Encoded_Video(db[vid_key]) if self.database_name == 'SF_encoded' else None
+            for frame_key in frame_keys:
+                if(self.database_name == 'SF'):
+                    frame = db[vid_key][frame_key]
+                    if(channel_index is None):
+                        channel_index = Data_Gen._channel_indices(frame.attrs['SEGS'], self.segs)
+                    out = None
+                    if(reuse_buffer or self.model_name == 'LRCN'):
+                        self.frame_buffer, out = Data_Gen._frame_buffer(self.frame_buffer, frame['channels'].shape[0:2] + (len(self.segs),))
+                    frame_tensor = Data_Gen._extract_frame(frame['channels'], None, self.segs, verbose, out, channel_index)
+                else:
+                    frame_tensor = encoded.read(frame_key)
+                if(self.model_name != 'LRCN'):
+                    return np.asarray(frame_tensor, dtype=self.dtype), label, Sample_Table.sample_id(meta, frame_key, frame_tensor.shape[0], frame_tensor.shape[1])
+                video += [np.append(frame_tensor.flatten(), frame.attrs['size'] if encoded is None else encoded.size(frame_key))]
+            return np.array(video, dtype=self.dtype), label, Sample_Table.sample_id(meta)
+    
+    # Used by the workers of 'Parallel_Loader' (each one has its own buffer)
+    def __call__(self, entry):
+        return self.read(entry, reuse_buffer=True)
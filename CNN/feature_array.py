@@ -0,0 +1,137 @@
+'''
+Storage of the features of a memory batch in 1 contiguous buffer instead of a
+list of arrays. Feature k is buffer[offsets[k]:offsets[k+1]] with the shape
+shapes[k], so frames of various sizes (ragged) are stored without padding.
+When all the features have the same shape, 'dense()' returns them as 1 array
+(n, ...) without copy. Reading a feature returns a view of the buffer.
+The buffer grows geometrically (x1.5) when features are appended.
+'''
+
+import numpy as np
+
+class Feature_Array:
+
+    dtype = None
+    buffer = None
+    offsets = None # n+1 offsets in 'buffer'
+    shapes = None # n shapes
+    size = None # nb of values used in 'buffer'
+    count = None # nb of features
+
+    def __init__(self, dtype = np.float32, capacity = 0):
+        self.dtype = np.dtype(dtype)
+        self.buffer = np.empty(max(0, int(capacity)), dtype=self.dtype)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.shapes = np.zeros((0, 0), dtype=np.int64)
+        self.size = 0
+        self.count = 0
+
+    # Wraps arrays already stored contiguously (no copy)
+    @staticmethod
+    def from_buffer(buffer, offsets, shapes):
+        features = Feature_Array(buffer.dtype)
+        features.buffer = buffer
+        features.offsets = np.asarray(offsets, dtype=np.int64)
+        if(len(features.offsets) > 1):
+            features.shapes = np.asarray(shapes, dtype=np.int64).reshape(len(features.offsets)-1, -1)
+        features.count = len(features.shapes)
+        features.size = int(features.offsets[-1])
+        return features
+
+    # Wraps an array (n, ...) of features of the same shape (no copy if
+    # 'array' is contiguous)
+    @staticmethod
+    def from_dense(array, dtype = None):
+        array = np.ascontiguousarray(array, dtype=dtype)
+        n = len(array)
+        item_size = int(np.prod(array.shape[1:]))
+        return Feature_Array.from_buffer(array.reshape(-1), np.arange(n+1, dtype=np.int64)*item_size,
+                                         np.tile(np.array(array.shape[1:], dtype=np.int64), (n, 1)))
+
+    def _reserve(self, size, count):
+        if(self.size + size > len(self.buffer)):
+            buffer = np.empty(max(self.size + size, int(1.5*len(self.buffer))), dtype=self.dtype)
+            buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = buffer
+        if(self.count + count + 1 > len(self.offsets)):
+            n = max(self.count + count + 1, int(1.5*len(self.offsets)))
+            self.offsets = np.resize(self.offsets, n)
+        if(self.count + count > len(self.shapes)):
+            n = max(self.count + count, int(1.5*len(self.shapes)))
+            shapes = np.zeros((n, self.shapes.shape[1]), dtype=np.int64)
+            shapes[:self.count] = self.shapes[:self.count]
+            self.shapes = shapes
+
+    def _check_ndim(self, ndim):
+        if(self.count == 0 and self.shapes.shape[1] != ndim):
+            self.shapes = np.zeros((len(self.shapes), ndim), dtype=np.int64)
+        elif(self.shapes.shape[1] != ndim):
+            raise RuntimeError('Impossible to store features with different dimensions ({} and {})'.format(ndim, self.shapes.shape[1]))
+
+    # Copies 'feature' at the end of the buffer
+    def append(self, feature):
+        feature = np.asarray(feature)
+        self._check_ndim(feature.ndim)
+        self._reserve(feature.size, 1)
+        self.buffer[self.size:self.size+feature.size] = feature.reshape(-1)
+        self.shapes[self.count] = feature.shape
+        self.size += feature.size
+        self.count += 1
+        self.offsets[self.count] = self.size
+
+    # Appends every feature of 'features' (Feature_Array, array (n, ...) or list
+    # of arrays) with 1 copy of the data
+    def extend(self, features):
+        if(isinstance(features, np.ndarray) and features.ndim > 0):
+            features = Feature_Array.from_dense(features, self.dtype)
+        if(not isinstance(features, Feature_Array)):
+            for f in features:
+                self.append(f)
+            return
+        if(len(features) == 0):
+            return
+        self._check_ndim(features.shapes.shape[1])
+        self._reserve(features.size, features.count)
+        self.buffer[self.size:self.size+features.size] = features.buffer[:features.size]
+        self.shapes[self.count:self.count+features.count] = features.shapes[:features.count]
+        self.offsets[self.count+1:self.count+features.count+1] = self.size + features.offsets[1:features.count+1]
+        self.size += features.size
+        self.count += features.count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, k):
+        if(k < 0):
+            k += self.count
+        if(k < 0 or k >= self.count):
+            raise IndexError('Feature {} out of range ({} features)'.format(k, self.count))
+        return self.buffer[self.offsets[k]:self.offsets[k+1]].reshape(self.shapes[k])
+
+    def __iter__(self):
+        for k in range(self.count):
+            yield self[k]
+
+    @property
+    def nbytes(self):
+        return self.size*self.dtype.itemsize
+
+    # True if all the features have the same shape
+    def is_dense(self):
+        return self.count == 0 or bool(np.all(self.shapes[:self.count] == self.shapes[0]))
+
+    # Returns all the features as 1 array (n, ...), without copy
+    def dense(self):
+        if(not self.is_dense()):
+            raise RuntimeError('The features do not have the same shape')
+        if(self.count == 0):
+            return self.buffer[:0]
+        return self.buffer[:self.size].reshape((self.count,) + tuple(self.shapes[0]))
+
+    # Forgets the features (the buffer is released)
+    def clear(self):
+        self.buffer = np.empty(0, dtype=self.dtype)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.shapes = np.zeros((0, self.shapes.shape[1]), dtype=np.int64)
+        self.size = 0
+        self.count = 0
@@ -0,0 +1,95 @@
+'''
+This class manages the features extracted by Data_Gen from an HDF5 file and
+saved on disk, so that the next epochs do not need to decode the file again.
+A cached version is keyed by the modification time and the size of the source
+file as well as by the preprocessing configuration: changing one of them
+invalidates it. For a source file 'name.hdf5', a version is stored as:
+    name_{key}_features.npy  # all the features flattened in 1 contiguous array
+    name_{key}_index.npy     # offsets (n+1) and shapes (n x d) of the features
+    name_{key}_labels.npy    # n labels
+    name_{key}_meta.npy      # n metadata (sample ids, n x 6 int32)
+    name_{key}_table.npy     # table of the sample ids (JSON, see 'Sample_Table')
+The features are memory-mapped when they are retrieved (Feature_Array).
+'''
+
+import os, re, json, hashlib, glob
+import numpy as np
+import sample_table
+from sample_table import Sample_Table
+from feature_array import Feature_Array
+
+class Feature_Cache:
+
+    cache_dir = None
+    version = 2 # to be incremented if the storage format changes
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    # Returns the key associated to a source file and a preprocessing
+    # configuration (dictionary that must be JSON serializable)
+    @staticmethod
+    def key(file_path, preprocessing):
+        stat = os.stat(file_path)
+        desc = {'version': Feature_Cache.version,
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'preprocessing': preprocessing}
+        return hashlib.sha1(json.dumps(desc, sort_keys=True).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _base_name(file_path):
+        return re.sub(r'\.hdf5$', '', os.path.basename(file_path))
+
+    def _paths(self, file_path, key):
+        prefix = os.path.join(self.cache_dir, '{}_{}'.format(self._base_name(file_path), key))
+        return {name: '{}_{}.npy'.format(prefix, name) for name in ['features', 'index', 'labels', 'meta', 'table']}
+
+    # Returns (features, labels, metadata, table, nb_bytes) if a valid version is found,
+    # None otherwise. 'features' is a Feature_Array of the memory-mapped buffer.
+    def load(self, file_path, preprocessing):
+        paths = self._paths(file_path, self.key(file_path, preprocessing))
+        # The index is written last: if it exists, the version is complete
+        if(not os.path.isfile(paths['index'])):
+            return None
+        index = np.load(paths['index'])
+        buffer = np.load(paths['features'], mmap_mode='r')
+        labels = np.load(paths['labels'])
+        metadata = np.load(paths['meta'])
+        table = Sample_Table.from_json(str(np.load(paths['table'])))
+        features = Feature_Array.from_buffer(buffer, index[:, 0], index[:-1, 1:])
+        return features, labels.tolist(), metadata, table, buffer.nbytes + labels.nbytes
+
+    # Saves a new version and removes the previous ones of the same file.
+    # 'features' is a Feature_Array (or a list of arrays with the same number
+    # of dimensions).
+    def save(self, file_path, preprocessing, features, labels, metadata, table, dtype=np.float32):
+        key = self.key(file_path, preprocessing)
+        paths = self._paths(file_path, key)
+        if(not isinstance(features, Feature_Array)):
+            array = Feature_Array(dtype)
+            array.extend(features)
+            features = array
+        n = len(features)
+        index = np.zeros((n+1, 1+features.shapes.shape[1]), dtype=np.int64)
+        index[:, 0] = features.offsets[:n+1]
+        index[:-1, 1:] = features.shapes[:n]
+        buffer = np.lib.format.open_memmap(paths['features']+'.tmp', mode='w+', dtype=dtype, shape=(max(features.size, 1),))
+        buffer[:features.size] = features.buffer[:features.size]
+        buffer.flush()
+        del buffer
+        os.replace(paths['features']+'.tmp', paths['features'])
+        metadata = np.array(metadata, dtype=np.int32).reshape(-1, sample_table.ID_SIZE)
+        for name, array in [('labels', np.array(labels)), ('meta', metadata), ('table', np.array(table.to_json())), ('index', index)]:
+            with open(paths[name]+'.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(paths[name]+'.tmp', paths[name])
+        self.clear(file_path, keep=key)
+
+    # Removes every version of 'file_path' (except 'keep')
+    def clear(self, file_path, keep = None):
+        pattern = re.compile(re.escape(self._base_name(file_path)) + r'_([0-9a-f]{16})_(features|index|labels|meta|table)\.npy$')
+        for path in glob.glob(os.path.join(self.cache_dir, '{}_*.npy'.format(glob.escape(self._base_name(file_path))))):
+            match = pattern.match(os.path.basename(path))
+            if(match is not None and match.group(1) != keep):
+                os.remove(path)
@@ -0,0 +1,190 @@
+'''
+Writes the features extracted by a Neural Network (ex: the feature maps of
+the encoder) while they are computed, instead of keeping all of them in
+memory. Each output file stays opened and the features of a video are
+appended to resizable, chunked and compressed datasets:
+    /{video}: attrs event_class
+        channels_0  (n0, h0, w0, c)  feature maps of shape (h0, w0, c)
+        channels_1  (n1, h1, w1, c)  (1 dataset / shape found in the video)
+        frames      (n,)             frame keys, in order of writing
+        location    (n, 2)           (dataset k, row) of each frame
+        size        (n, 2)           size (h, w) of the input frames
+The rows of a video are buffered and each dataset is extended once per
+flush, every 'flush_memsize' MB written or every 'flush_interval' seconds, so
+the memory used does not depend on the number of features. 'Encoded_Video' reads a video written this way (or a video
+written with 1 group / frame: /{video}/{frame}/channels).
+'''
+
+import os, time
+import numpy as np
+import h5py as h5
+from DataQuery.DataWrapper import H5_Pool, ordered_frames
+
+class Feature_Writer:
+
+    output_dir = None
+    compression = None # 'gzip', 'lzf' or None
+    compression_opts = None
+    flush_memsize = None # xMB written between 2 flushes
+    flush_interval = None # max nb of seconds between 2 flushes
+    files = None # file name -> opened HDF5 file
+    videos = None # (file name, video) -> {'shapes': {shape: dataset index}, 'rows': nb of rows / dataset index,
+                  #                      'frames': set of frame keys, 'pending': {dataset: (dtype, rows not written)}}
+    bytes_written = None # since the last flush
+    last_flush = None
+    nb_features = None
+
+    def __init__(self, output_dir, compression = 'gzip', compression_opts = 4, flush_memsize = 64, flush_interval = 60):
+        assert compression in {'gzip', 'lzf', None}
+        self.output_dir = output_dir
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == 'gzip' else None
+        self.flush_memsize = flush_memsize
+        self.flush_interval = flush_interval
+        self.files = {}
+        self.videos = {}
+        self.bytes_written = 0
+        self.last_flush = time.time()
+        self.nb_features = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # The output file is created (overwritten) the first time it is used
+    def _file(self, file_name):
+        if(file_name not in self.files):
+            file_path = os.path.join(self.output_dir, file_name)
+            H5_Pool.release(file_path)
+            self.files[file_name] = h5.File(file_path, 'w')
+        return self.files[file_name]
+
+    # Adds a row to the dataset 'name' of a video (written at the next flush)
+    @staticmethod
+    def _buffer(state, name, value, dtype):
+        if(name not in state['pending']):
+            state['pending'][name] = (dtype, [])
+        state['pending'][name][1].append(value)
+
+    # Writes the rows buffered of a video: 1 resize and 1 write / dataset
+    def _write_pending(self, file_name, video, state):
+        group = self.files[file_name][video]
+        for (name, (dtype, rows)) in state['pending'].items():
+            rows = np.asarray(rows, dtype=dtype)
+            if(name not in group):
+                row_size = int(np.prod(rows.shape[1:]))
+                group.create_dataset(name, shape=(0,) + rows.shape[1:], maxshape=(None,) + rows.shape[1:], dtype=dtype,
+                                     chunks=(max(1, 1024//max(1, row_size)),) + rows.shape[1:])
+            dataset = group[name]
+            n = dataset.shape[0]
+            dataset.resize(n+len(rows), axis=0)
+            dataset[n:] = rows
+        state['pending'] = {}
+
+    # Appends the feature map (h, w, c) of a frame to its video
+    def write(self, file_name, video, frame_key, features, size, label):
+        features = np.asarray(features, dtype=np.float32)
+        f = self._file(file_name)
+        state = self.videos.get((file_name, video))
+        if(state is None):
+            group = f.create_group(video)
+            group.attrs['event_class'] = label
+            state = {'shapes': {}, 'rows': [], 'frames': set(), 'pending': {}}
+            self.videos[(file_name, video)] = state
+        group = f[video]
+        if(frame_key in state['frames']):
+            print('Warning: frame {} already exists in file {}, video {}. Ignored'.format(frame_key, file_name, video))
+            return
+        state['frames'].add(frame_key)
+        if(features.shape not in state['shapes']):
+            k = len(state['shapes'])
+            group.create_dataset('channels_{}'.format(k), shape=(0,) + features.shape, maxshape=(None,) + features.shape,
+                                 dtype=np.float32, chunks=(1,) + features.shape,
+                                 compression=self.compression, compression_opts=self.compression_opts)
+            state['shapes'][features.shape] = k
+            state['rows'] += [0]
+        k = state['shapes'][features.shape]
+        row = state['rows'][k]
+        state['rows'][k] += 1
+        # Copied: the caller can reuse its array
+        Feature_Writer._buffer(state, 'channels_{}'.format(k), np.array(features), np.float32)
+        Feature_Writer._buffer(state, 'frames', frame_key, h5.special_dtype(vlen=str))
+        Feature_Writer._buffer(state, 'location', [k, row], np.int32)
+        Feature_Writer._buffer(state, 'size', size, np.int32)
+        self.nb_features += 1
+        self.bytes_written += features.nbytes
+        if(self.bytes_written >= self.flush_memsize*1024*1024 or time.time() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    # Adds the features extracted by the Neural Network. Each metadata is a 
+    # sample id resolved with 'table' (see 'Sample_Table').
+    def add(self, features, metadata, table):
+        assert len(features) == len(metadata)
+        for k in range(len(metadata)):
+            try:
+                (label, file_name, video, frame_key, size_h, size_w) = table.resolve(metadata[k])
+            except IndexError:
+                print('Unknown sample id {}. Feature ignored.'.format(metadata[k]))
+                continue
+            if(frame_key is None):
+                print('Sample {} is not a frame. Feature ignored.'.format(metadata[k]))
+                continue
+            self.write(file_name, video, frame_key, features[k], [size_h, size_w], label)
+
+    def flush(self):
+        for ((file_name, video), state) in self.videos.items():
+            if(len(state['pending']) > 0):
+                self._write_pending(file_name, video, state)
+        for f in self.files.values():
+            f.flush()
+        self.bytes_written = 0
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        for (file_name, f) in self.files.items():
+            f.close()
+            print('File {} saved.'.format(file_name))
+        self.files.clear()
+        self.videos.clear()
+
+class Encoded_Video:
+
+    group = None
+    frame_keys = None # ordered frame keys
+    locations = None # frame key -> (dataset name, row)
+    sizes = None # frame key -> size (h, w) of the input frame
+
+    def __init__(self, group):
+        self.group = group
+        if('frames' in group and isinstance(group['frames'], h5.Dataset)):
+            frames = [f.decode() if type(f) is bytes else f for f in group['frames'][()]]
+            location = np.array(group['location'])
+            size = np.array(group['size'])
+            self.frame_keys = ordered_frames(frames)
+            self.locations = {frames[i]: ('channels_{}'.format(location[i][0]), int(location[i][1])) for i in range(len(frames))}
+            self.sizes = {frames[i]: size[i] for i in range(len(frames))}
+        else:
+            # 1 group / frame
+            frames = [f for f in group.keys() if 'channels' in group[f].keys()]
+            self.frame_keys = ordered_frames(frames)
+            self.locations = {f: (f + '/channels', None) for f in frames}
+            self.sizes = {f: group[f].attrs['size'] for f in frames}
+
+    def keys(self):
+        return list(self.frame_keys)
+
+    def read(self, frame_key):
+        (name, row) = self.locations[frame_key]
+        if(row is None):
+            return np.array(self.group[name], dtype=np.float32)
+        return np.array(self.group[name][row], dtype=np.float32)
+
+    def size(self, frame_key):
+        return self.sizes[frame_key]
+
+    def shape(self, frame_key):
+        (name, row) = self.locations[frame_key]
+        return self.group[name].shape if row is None else self.group[name].shape[1:]
@@ -0,0 +1,138 @@
+'''
+This class lists the HDF5 files of a data set and keeps their sizes and
+modification times in a manifest (JSON file), so that the directories do not
+need to be scanned again at each epoch. Only the directories whose
+modification time changed (i.e. files added, removed or renamed) are scanned
+again; the other ones cost 1 'stat' call each. A file is kept if it has one of
+the extensions given and if it begins with the HDF5 signature. The manifest
+looks like:
+    {"version": 1,
+     "dirs": {"/path/to/dir": {"mtime": ..., "subdirs": [...],
+                               "files": {"name.hdf5": {"size": ..., "mtime": ..., ...}}}}}
+Other information can be attached to a file with 'set_file_info'. It is kept
+as long as the file does not change.
+NOTE: a file rewritten in place does not change the modification time of its
+directory: use scan(..., refresh=True) to detect it.
+'''
+
+import os, json
+
+class File_Manifest:
+
+    version = 1 # to be incremented if the format of the manifest changes
+    hdf5_signature = b'\x89HDF\r\n\x1a\n'
+    manifest_path = None # None: the manifest is only kept in memory
+    extensions = None
+    check_signature = None
+    dirs = None
+    modified = None # True if the manifest must be saved
+
+    def __init__(self, manifest_path = None, extensions = ('.hdf5', '.h5'), check_signature = True):
+        self.manifest_path = manifest_path
+        self.extensions = tuple(extensions)
+        self.check_signature = check_signature
+        self.dirs = {}
+        self.modified = False
+        self.load()
+
+    def load(self):
+        if(self.manifest_path is not None and os.path.isfile(self.manifest_path)):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                if(manifest.get('version') == File_Manifest.version):
+                    self.dirs = manifest['dirs']
+            except ValueError:
+                print('Warning: manifest {} corrupted. Ignored'.format(self.manifest_path))
+
+    def save(self):
+        if(self.manifest_path is not None and self.modified):
+            tmp_path = '{}.{}.tmp'.format(self.manifest_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': File_Manifest.version, 'dirs': self.dirs}, f)
+            os.replace(tmp_path, self.manifest_path)
+            self.modified = False
+
+    # An HDF5 signature is at offset 0, 512, 1024, 2048... (after an optional user block)
+    @staticmethod
+    def is_hdf5(path, size = None):
+        size = os.path.getsize(path) if size is None else size
+        try:
+            with open(path, 'rb') as f:
+                offset = 0
+                while(offset + 8 <= size):
+                    f.seek(offset)
+                    if(f.read(8) == File_Manifest.hdf5_signature):
+                        return True
+                    offset = 512 if offset == 0 else 2*offset
+        except OSError:
+            pass
+        return False
+
+    def _scan_dir(self, path, recursive, refresh, visited, list_files):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        visited.add(path)
+        entry = self.dirs.get(path)
+        if(entry is None or entry['mtime'] != mtime or refresh):
+            old_files = entry['files'] if entry is not None else {}
+            entry = {'mtime': mtime, 'subdirs': [], 'files': {}}
+            with os.scandir(path) as it:
+                for dir_entry in it:
+                    if(dir_entry.is_dir()):
+                        entry['subdirs'] += [dir_entry.name]
+                    elif(dir_entry.name.endswith(self.extensions) and dir_entry.is_file()):
+                        stat = dir_entry.stat()
+                        info = old_files.get(dir_entry.name)
+                        if(info is None or info['size'] != stat.st_size or info['mtime'] != stat.st_mtime_ns):
+                            if(self.check_signature and not File_Manifest.is_hdf5(dir_entry.path, stat.st_size)):
+                                continue
+                            info = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+                        entry['files'][dir_entry.name] = info
+            entry['subdirs'].sort()
+            self.dirs[path] = entry
+            self.modified = True
+        for name in sorted(entry['files']):
+            list_files += [os.path.join(path, name)]
+        if(recursive):
+            for name in entry['subdirs']:
+                self._scan_dir(os.path.join(path, name), recursive, refresh, visited, list_files)
+
+    # Returns the paths of all the HDF5 files inside 'root' (can be a file or a
+    # directory, recursive search with recursive_search=True)
+    def scan(self, root, recursive_search = True, refresh = False):
+        root = os.path.abspath(root)
+        list_files = []
+        if(os.path.isfile(root)):
+            if(not self.check_signature or File_Manifest.is_hdf5(root)):
+                list_files += [root]
+            return list_files
+        visited = set()
+        self._scan_dir(root, recursive_search, refresh, visited, list_files)
+        # Forgets the directories removed
+        if(recursive_search):
+            prefix = os.path.join(root, '')
+            for path in [p for p in self.dirs if p.startswith(prefix) and p not in visited]:
+                del self.dirs[path]
+                self.modified = True
+        self.save()
+        return list_files
+
+    # Returns the information saved about a file ({'size', 'mtime', ...}) or None
+    def file_info(self, path):
+        path = os.path.abspath(path)
+        entry = self.dirs.get(os.path.dirname(path))
+        if(entry is not None):
+            return entry['files'].get(os.path.basename(path))
+        return None
+
+    # Attaches a (JSON serializable) information to a file listed
+    def set_file_info(self, path, key, value, save = True):
+        info = self.file_info(path)
+        if(info is not None and info.get(key) != value):
+            info[key] = value
+            self.modified = True
+            if(save):
+                self.save()
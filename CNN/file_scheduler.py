@@ -0,0 +1,105 @@
+'''
+This class decides which files are loaded together in each memory batch of
+Data_Gen. The files (of known sizes) are packed into batches whose total size
+does not exceed the memory budget, so that an epoch needs as few loads as
+possible. Two packing policies are available:
+    FIRST_FIT_DECREASING: the files are taken from the biggest to the smallest
+                          and each one goes in the first batch where it fits
+                          (deterministic, close to the optimal number of batches)
+    RANDOM_BEST_FIT:      the files are taken in a random order and each one
+                          goes in the fullest batch where it fits. The order
+                          of the batches is also random (training).
+The whole epoch is planned at once: in O(n log n) for n files with
+FIRST_FIT_DECREASING, in O(n b) with RANDOM_BEST_FIT (b batches, inserted in
+a sorted list). The files bigger than the budget are never scheduled
+('oversized').
+'''
+
+import bisect
+import numpy as np
+
+class File_Scheduler:
+
+    budget = None # maximum size of a batch (in MB)
+    policy = None
+    batches = None # list of (list of file indexes, size of the batch)
+    num_files_scheduled = None
+    oversized = None # indexes of the files bigger than the budget
+
+    def __init__(self, sizes, budget, policy = 'FIRST_FIT_DECREASING', random_state = None):
+        assert policy in {'FIRST_FIT_DECREASING', 'RANDOM_BEST_FIT'}
+        self.budget = budget
+        self.policy = policy
+        random_state = random_state if random_state is not None else np.random
+        sizes = np.asarray(sizes, dtype=np.float64)
+        fit = np.flatnonzero(sizes <= budget)
+        self.oversized = np.flatnonzero(sizes > budget).tolist()
+        if(policy == 'FIRST_FIT_DECREASING'):
+            order = fit[np.argsort(-sizes[fit], kind='stable')]
+            bins = self._first_fit(sizes, order)
+        else:
+            order = random_state.permutation(fit)
+            bins = self._best_fit(sizes, order)
+            bins = [bins[k] for k in random_state.permutation(len(bins))]
+        self.batches = [(files, float(sizes[files].sum())) for files in bins]
+        self.batches.reverse() # the next batch is popped from the end
+        self.num_files_scheduled = 0
+
+    # Each file goes in the first bin with enough space left. The bins are the
+    # leaves of a binary tree storing the maximum space left in each subtree.
+    def _first_fit(self, sizes, order):
+        n_leaves = 1
+        while(n_leaves < max(1, len(order))):
+            n_leaves *= 2
+        tree = np.full(2*n_leaves, -np.inf)
+        bins = []
+        for k in order:
+            size = sizes[k]
+            if(tree[1] >= size):
+                node = 1
+                while(node < n_leaves):
+                    node = 2*node if tree[2*node] >= size else 2*node+1
+                b = node - n_leaves
+            else:
+                b = len(bins)
+                bins += [[]]
+                node = b + n_leaves
+                tree[node] = self.budget
+            bins[b] += [int(k)]
+            tree[node] -= size
+            node //= 2
+            while(node >= 1):
+                tree[node] = max(tree[2*node], tree[2*node+1])
+                node //= 2
+        return bins
+
+    # Each file goes in the bin with the least space left where it fits. The
+    # bins are kept sorted by space left.
+    def _best_fit(self, sizes, order):
+        space_left = [] # sorted list of (space left, bin index)
+        bins = []
+        for k in order:
+            size = sizes[k]
+            pos = bisect.bisect_left(space_left, (size, -1))
+            if(pos < len(space_left)):
+                (space, b) = space_left.pop(pos)
+            else:
+                (space, b) = (self.budget, len(bins))
+                bins += [[]]
+            bins[b] += [int(k)]
+            bisect.insort(space_left, (space - size, b))
+        return bins
+
+    def num_batches(self):
+        return len(self.batches)
+
+    # Returns (file indexes, size in MB, usage of the budget in %) of the next
+    # batch, without removing it if 'pop' is False. Returns ([], 0, 0) at the
+    # end of the epoch.
+    def next_batch(self, pop = True):
+        if(len(self.batches) == 0):
+            return [], 0.0, 0.0
+        (files, size) = self.batches.pop() if pop else self.batches[-1]
+        if(pop):
+            self.num_files_scheduled += len(files)
+        return files, size, 100.0*size/self.budget if self.budget > 0 else 0.0
@@ -0,0 +1,123 @@
+'''
+Registry of the scalar features computed on a frame (h, w, c) of a video. A
+feature is a function f(ctx) -> float, where 'ctx' is a Frame_Context giving
+the frame, the previous frame of the video and the intermediate results shared
+by all the features (differences between neighbour pixels, radial field...),
+computed only once. Built-in features:
+    'TV':             total variation / pixel / channel
+    'grad_energy':    sum of the squared gradients / pixel / channel
+    'l1_err':         l1 distance with the previous frame / pixel / channel
+    'unsigned_flux':  sum of |Br| (in G.pixel)
+    'flux_imbalance': |sum of Br| / sum of |Br|
+    'pil_length':     nb of pixels along the polarity inversion lines (between
+                      strong positive and negative fields, |Br| > pil_threshold)
+Other features can be added with:
+    @frame_features.register('my_feature')
+    def my_feature(ctx): return float(np.max(ctx.frame))
+The radial field is the channel 'Br' (the first channel if there is none).
+'''
+
+import numpy as np
+import skimage.transform as sk
+
+FEATURES = {} # name -> function(ctx)
+pil_threshold = 150 # minimum |Br| (in G) on both sides of a polarity inversion line
+
+# Registers a function f(ctx) -> float computing the feature 'name'
+def register(name):
+    def decorator(func):
+        FEATURES[name] = func
+        return func
+    return decorator
+
+def is_feature(name):
+    return name in FEATURES
+
+# Name of the frame attribute where a feature computed on 'channels' is stored
+def attr_name(name, channels = None):
+    if(channels is None):
+        return name
+    return '{}[{}]'.format(name, ','.join(channels))
+
+class Frame_Context:
+
+    frame = None # (h, w, c), only the channels selected
+    prev_frame = None # previous frame of the video (None for the first one)
+    segs = None # names of the channels of 'frame'
+    _cache = None
+
+    def __init__(self, frame, segs, prev_frame = None):
+        self.frame = frame
+        self.segs = [s.decode() if type(s) is bytes else s for s in segs]
+        self.prev_frame = prev_frame
+        self._cache = {}
+
+    def _cached(self, key, func):
+        if(key not in self._cache):
+            self._cache[key] = func()
+        return self._cache[key]
+
+    # Nb of values used to normalize the features (pixels x channels)
+    @property
+    def normalization(self):
+        return float(np.prod(self.frame.shape))
+
+    # Differences between neighbour pixels on the valid part (h-1, w-1, c) of the frame
+    @property
+    def diffs(self):
+        return self._cached('diffs', lambda: (np.diff(self.frame, axis=0)[:, 1:], np.diff(self.frame, axis=1)[1:, :]))
+
+    @property
+    def br(self):
+        return self._cached('br', lambda: self.frame[:, :, self.segs.index('Br') if 'Br' in self.segs else 0].astype(np.float64))
+
+    @property
+    def abs_br(self):
+        return self._cached('abs_br', lambda: np.abs(self.br))
+
+@register('TV')
+def total_variation(ctx):
+    (dy, dx) = ctx.diffs
+    return float(np.sum(np.sqrt(np.square(dy) + np.square(dx))))/ctx.normalization
+
+@register('grad_energy')
+def gradient_energy(ctx):
+    (dy, dx) = ctx.diffs
+    return float(np.sum(np.square(dy)) + np.sum(np.square(dx)))/ctx.normalization
+
+@register('l1_err')
+def l1_error(ctx):
+    prev = ctx.prev_frame if ctx.prev_frame is not None else ctx.frame
+    frame = ctx.frame
+    if(frame.shape[0:2] != prev.shape[0:2]):
+        frame = sk.resize(frame, prev.shape, preserve_range=True)
+    return float(np.sum(np.abs(frame - prev)))/float(np.prod(prev.shape))
+
+@register('unsigned_flux')
+def unsigned_flux(ctx):
+    return float(np.sum(ctx.abs_br))
+
+@register('flux_imbalance')
+def flux_imbalance(ctx):
+    total = np.sum(ctx.abs_br)
+    return float(np.abs(np.sum(ctx.br))/total) if total > 0 else 0.0
+
+@register('pil_length')
+def pil_length(ctx):
+    pos = ctx.br > pil_threshold
+    neg = ctx.br < -pil_threshold
+    # Pixels next to a pixel of opposite strong polarity
+    pil = np.zeros(pos.shape, dtype=bool)
+    pil[:-1, :] |= (pos[:-1, :] & neg[1:, :]) | (neg[:-1, :] & pos[1:, :])
+    pil[:, :-1] |= (pos[:, :-1] & neg[:, 1:]) | (neg[:, :-1] & pos[:, 1:])
+    return float(np.count_nonzero(pil))
+
+# Computes the features 'names' of a frame. Returns {name: value}.
+def compute(names, frame, segs, prev_frame = None):
+    ctx = Frame_Context(frame, segs, prev_frame)
+    res = {}
+    for name in names:
+        if(name not in FEATURES):
+            raise RuntimeError('Unknown frame feature: {} (registered: {})'.format(name, sorted(FEATURES)))
+        res[name] = FEATURES[name](ctx)
+    return res
@@ -0,0 +1,161 @@
+'''
+Runs the preprocessing of the TensorFlow pipeline ('resize_method' in
+{'LIN_RESIZING', 'QUAD_RESIZING', 'ZERO_PADDING'} + per image standardization
+or normalization with the statistics of the training set)
+once over the whole data set, in parallel. The frames are saved in shards of
+fixed shape (N, H, W, C) with a table of labels and metadata:
+    {materialized_dir}/{key}/shard_00000.npy ...
+    {materialized_dir}/{key}/labels.npy
+    {materialized_dir}/{key}/metadata.npy  # sample ids (N x 6 int32)
+    {materialized_dir}/{key}/index.json  # written last (with the table of the ids)
+The key is a hash of the configuration and of the files of the data set (see
+Data_Gen._materialization_config), so Data_Gen reads the shards directly
+(CHUNKED input mode) as long as they match. Example:
+    python materialize.py SF --nb_workers 24
+'''
+
+import os, json, time, argparse, traceback
+import multiprocessing as mp
+import numpy as np
+import utils, data_gen, sample_table
+
+# Interpolation matrix (out_size x in_size) of tf.image.resize_images (TF 1.x,
+# align_corners=False) along 1 axis. 'method' is 'BILINEAR' or 'BICUBIC'.
+def _resize_matrix(in_size, out_size, method):
+    scale = in_size/float(out_size)
+    x = np.arange(out_size)*scale
+    x0 = np.floor(x).astype(np.int64)
+    t = x - x0
+    M = np.zeros((out_size, in_size), dtype=np.float64)
+    rows = np.arange(out_size)
+    if(method == 'BILINEAR'):
+        np.add.at(M, (rows, np.minimum(x0, in_size-1)), 1-t)
+        np.add.at(M, (rows, np.minimum(x0+1, in_size-1)), t)
+    elif(method == 'BICUBIC'):
+        # Keys' cubic kernel with a = -0.75, indices clamped at the borders
+        a = -0.75
+        weights = [((a*(t+1) - 5*a)*(t+1) + 8*a)*(t+1) - 4*a,
+                   ((a+2)*t - (a+3))*t*t + 1,
+                   ((a+2)*(1-t) - (a+3))*(1-t)*(1-t) + 1,
+                   ((a*(2-t) - 5*a)*(2-t) + 8*a)*(2-t) - 4*a]
+        for k in range(4):
+            np.add.at(M, (rows, np.clip(x0+k-1, 0, in_size-1)), weights[k])
+    else:
+        raise RuntimeError('Unknown interpolation method: {}'.format(method))
+    return M
+
+# Same as tf.image.per_image_standardization
+def per_image_standardization(pic):
+    mean = np.mean(pic, dtype=np.float64)
+    std = max(np.std(pic, dtype=np.float64), 1.0/np.sqrt(pic.size))
+    return ((pic - mean)/std).astype(np.float32)
+
+# Same as Data_Gen._standardization: 'affine' = (scale, offset, low, high) / 
+# channel, or None for the per image standardization
+def standardization(pic, affine = None):
+    if(affine is None):
+        return per_image_standardization(pic)
+    (scale, offset, low, high) = affine
+    return (np.minimum(np.maximum(pic, low), high)*scale + offset).astype(np.float32)
+
+# Preprocesses 1 frame (h, w, c) as 'Data_Gen.data_preprocessing'
+def preprocess(pic, resize_method, output_size, affine = None):
+    if(resize_method in {'LIN_RESIZING', 'QUAD_RESIZING'}):
+        method = 'BILINEAR' if resize_method == 'LIN_RESIZING' else 'BICUBIC'
+        My = _resize_matrix(pic.shape[0], output_size[0], method)
+        Mx = _resize_matrix(pic.shape[1], output_size[1], method)
+        pic = np.einsum('ij,jkc,lk->ilc', My, pic, Mx, optimize=True).astype(np.float32)
+        return standardization(pic, affine)
+    elif(resize_method == 'ZERO_PADDING'):
+        pic = standardization(pic, affine)
+        out = np.zeros(tuple(output_size) + pic.shape[2:], dtype=np.float32)
+        pad_up = (output_size[0] - pic.shape[0])//2
+        pad_left = (output_size[1] - pic.shape[1])//2
+        out[pad_up:pad_up+pic.shape[0], pad_left:pad_left+pic.shape[1]] = pic
+        return out
+    raise RuntimeError('Impossible to materialize the resizing method {}'.format(resize_method))
+
+# State shared with the worker processes (fork)
+_state = {}
+
+# Writes the shard k. Returns (k, labels, metadata) of the frames written.
+def _write_shard(k):
+    data_generator = _state['data_generator']
+    entries = _state['shards'][k]
+    shape = _state['sample_shape']
+    path = os.path.join(_state['out_dir'], 'shard_{:05d}.npy'.format(k))
+    shard = np.lib.format.open_memmap(path+'.tmp', mode='w+', dtype=np.float32, shape=(len(entries),)+shape)
+    labels = []
+    metadata = []
+    n = 0
+    for entry in entries:
+        try:
+            (frame, label, meta) = data_generator._read_stream_sample(entry, reuse_buffer=True)
+            shard[n] = preprocess(frame, data_generator.resize_method, shape[0:2], data_generator.normalization_affine)
+            labels += [label]
+            metadata += [meta]
+            n += 1
+        except:
+            print('Impossible to read sample {} from {}. Ignored'.format(entry[1:3], entry[0]))
+            print(traceback.format_exc())
+    # NOTE: if samples are ignored, the last rows of the shard are not used
+    shard.flush()
+    del shard
+    os.replace(path+'.tmp', path)
+    return k, labels, metadata
+
+def materialize(data, training = True, nb_workers = None, shard_memsize = None):
+    config = dict(utils.config[data])
+    config['input_mode'] = 'STREAMING'
+    data_generator = data_gen.Data_Gen(data, config, training=training, max_pic_size=[3000, 3000])
+    if(data_generator.model_name not in {'VGG_16', 'VGG_16_encoder_decoder'}):
+        raise RuntimeError('Only the frames used by {} can be materialized'.format(['VGG_16', 'VGG_16_encoder_decoder']))
+    if(data_generator.resize_method == 'ZERO_PADDING'):
+        output_size = tuple(data_generator.max_pic_size)
+    else:
+        output_size = tuple(data_generator.data_dims[0:2])
+    sample_shape = output_size + (len(data_generator.segs),)
+    nb_workers = nb_workers or data_generator.nb_workers
+    shard_memsize = shard_memsize or config.get('shard_memsize', 256)
+    out_dir = data_generator.materialized_path()
+    os.makedirs(out_dir, exist_ok=True)
+
+    data_generator.gen_batch_dataset()
+    index = data_generator.stream_index
+    shard_length = max(1, int(shard_memsize*1024*1024/(4*np.prod(sample_shape))))
+    shards = [index[k:k+shard_length] for k in range(0, len(index), shard_length)]
+    print('{} frames of shape {} materialized in {} shards ({} workers).'.format(len(index), sample_shape, len(shards), nb_workers))
+    _state.update({'data_generator': data_generator, 'shards': shards, 'sample_shape': sample_shape, 'out_dir': out_dir})
+
+    start = time.time()
+    labels = []
+    metadata = []
+    shards_info = []
+    begin = 0
+    with mp.get_context('fork').Pool(nb_workers) as pool:
+        for (k, shard_labels, shard_meta) in pool.imap(_write_shard, range(len(shards))):
+            shards_info += [{'file': 'shard_{:05d}.npy'.format(k), 'begin': begin, 'end': begin+len(shard_labels)}]
+            begin += len(shard_labels)
+            labels += shard_labels
+            metadata += shard_meta
+            print('Shard {}/{} written ({:.1f}s).'.format(k+1, len(shards), time.time()-start))
+    np.save(os.path.join(out_dir, 'labels.npy'), np.array(labels))
+    np.save(os.path.join(out_dir, 'metadata.npy'), sample_table.to_array(metadata))
+    with open(os.path.join(out_dir, 'index.json.tmp'), 'w') as f:
+        json.dump({'config': data_generator._materialization_config(),
+                   'sample_shape': sample_shape,
+                   'nb_samples': begin,
+                   'shards': shards_info,
+                   'table': data_generator.sample_table.to_json()}, f)
+    os.replace(os.path.join(out_dir, 'index.json.tmp'), os.path.join(out_dir, 'index.json'))
+    print('Data set materialized in {} ({:.1f}s).'.format(out_dir, time.time()-start))
+    return out_dir
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_type", type=str, help="Set the working data set.", choices=["SF"])
+    parser.add_argument("--testing", help="Materializes the testing data set instead of the training one.", default=False, action='store_true')
+    parser.add_argument("--nb_workers", type=int, help="Set the number of processes used.")
+    parser.add_argument("--shard_memsize", type=int, help="Set the size of each shard (in MB).")
+    args = parser.parse_args()
+    materialize(args.data_type, not args.testing, args.nb_workers, args.shard_memsize)
@@ -0,0 +1,63 @@
+'''
+Accounting of the memory really used by a memory batch of Data_Gen, instead
+of the size of the files on disk. The bytes of the features decoded are
+counted file by file and the resident memory (RSS) of the process is sampled
+after each file loaded. When the RSS exceeds a ceiling, the loading of the
+batch stops and the files left are loaded in the next batches (backpressure).
+At the end of the batch, 'stats' gives the peak and mean usage.
+'''
+
+import os
+
+class Memory_Monitor:
+
+    rss_ceiling = None # xMB of resident memory (None: no limit)
+    process = None # psutil process, if /proc is not available
+    pid = None # process of 'process' (a forked child gets its own one)
+    nb_bytes = None # bytes decoded in the current batch
+    rss_samples = None # RSS (in bytes) after each file of the current batch
+
+    def __init__(self, rss_ceiling = None):
+        self.rss_ceiling = rss_ceiling
+        self.start()
+
+    # Begins a new memory batch
+    def start(self):
+        self.nb_bytes = 0
+        self.rss_samples = []
+
+    # Resident memory of the process (in bytes), read in /proc/self/statm (Linux)
+    # or given by psutil (imported only on the other systems)
+    def rss(self):
+        if(os.path.isfile('/proc/self/statm')):
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+        if(self.pid != os.getpid()):
+            import psutil
+            self.pid = os.getpid()
+            self.process = psutil.Process(self.pid)
+        return self.process.memory_info().rss
+
+    # Records a file loaded ('nb_bytes' decoded)
+    def add(self, nb_bytes):
+        self.nb_bytes += nb_bytes
+        self.rss_samples += [self.rss()]
+
+    # True if the last RSS sampled is above the ceiling
+    def exceeded(self):
+        return (self.rss_ceiling is not None and len(self.rss_samples) > 0 and
+                self.rss_samples[-1] > self.rss_ceiling*1024*1024)
+
+    # Usage of the current batch (in MB)
+    def stats(self):
+        mb = 1024.0*1024
+        if(len(self.rss_samples) == 0):
+            return {'decoded': self.nb_bytes/mb, 'peak_rss': 0.0, 'mean_rss': 0.0}
+        return {'decoded': self.nb_bytes/mb,
+                'peak_rss': max(self.rss_samples)/mb,
+                'mean_rss': sum(self.rss_samples)/float(len(self.rss_samples))/mb}
+
+    def report(self):
+        stats = self.stats()
+        if(stats['decoded'] > 0):
+            print('Memory used: {:.1f}MB decoded, RSS peak {:.1f}MB, mean {:.1f}MB'.format(stats['decoded'], stats['peak_rss'], stats['mean_rss']))
@@ -51,7 +51,7 @@ class Model:
             #                           return_state=False, dropout=self.dropout_prob)(self.input_layer)
             self.LSTM = LSTM(units=512, input_shape=(nb_frames, n_features), activation='tanh', kernel_initializer=init)(self.input_layer)
             ### OPTION 1: SPP 
-            #self.spp = self.spp_layer(self.convLSTM, [[4,4], [2,2], [1,1]], 'spp', pooling='TV')
+            #self.spp = self.spp_layer(self.convLSTM, [[4,4], [2,2], [1,1]], pooling='TV', name='spp')
             ### OPTION 2: NO SPP
             self.fc1 = Dense(256, activation='relu', kernel_initializer=init)(self.LSTM)
             if(self.training_mode): self.fc1 = Dropout(self.dropout_prob)(self.fc1)
@@ -116,7 +116,7 @@ class Model:
             self.pool5 = MaxPooling2D(pool_size=(2,2), strides=(2,2), padding='same')(self.conv5_3)
             
             ### SPP [4, 2, 1]
-            self.spp = self.spp_layer(self.pool5, [4, 2, 1], 'spp', pooling='TV')
+            self.spp = self.spp_layer(self.pool5, [4, 2, 1], pooling='TV', name='spp')
             ### FC-1024
             self.dense1 = Dense(1024, activation='relu')(self.spp)
             if(self.training_mode):
@@ -273,9 +273,9 @@ class Model:
         assert type(data) is tf.Tensor and len(data.shape) == 3
         assert type(seq_length) is tf.Tensor and len(seq_length.shape) == 1
         with tf.variable_scope(self.name):
-            self.input_layer = data
+            self.input_layer = tf.cast(data, dtype=tf.float32)
             lstm_cell = tf.contrib.rnn.LSTMCell(num_units=512, use_peepholes=True, name='LSTM_Cell')
-            rnn_output, rnn_last_state = tf.nn.dynamic_rnn(lstm_cell, data, seq_length, dtype=tf.float32)
+            rnn_output, rnn_last_state = tf.nn.dynamic_rnn(lstm_cell, self.input_layer, seq_length, dtype=tf.float32)
             # rnn_output has size nb_seqs x max_time x output_cell_size [=512]
             # We're only interest in the last ouput for each sequence (defined according
             # to the seq_length)
@@ -313,45 +313,73 @@ class Model:
             out = tf.reshape(input_unpool_flatten, output_shape)
         return out
 
+    # Spatial pyramid pooling. Each level l = [lh, lw] (or l = lh = lw) splits
+    # the input in lh x lw bins: along an axis of size n, the bin i covers
+    # [floor(i*n/l), ceil((i+1)*n/l)[ so that no bin is empty (they overlap if
+    # l does not divide n). Each axis has a 0/1 matrix (bins x pixels) and the
+    # bins of a level are reduced all at once:
+    #  * 'MAX': the pixels out of a bin are replaced by the minimum of each channel
+    #  * 'AVG': products with the matrices, divided by the bin areas
+    #  * 'TV':  the differences between neighbour pixels are computed once for
+    #           all the levels, only those inside a bin being summed
     @staticmethod
     def spp_layer(input_, levels=[[4,4], [2,2], [1,1]], pooling='MAX', concatenate=True, return_argmax=False, name='spp_layer'): # pooling in {'AVG', 'MAX', 'TV'}
         # Input shape must be: b x h x w x c
         # Returns tensor of shape :
-        #  * b x N  where N = prod(levels.*levels)*c if conca == True
+        #  * b x N  where N = sum(lh*lw)*c if conca == True
         #  * b x levels[0] x levels[1] x c if conca == False
         if(return_argmax):
             print('Impossible to return argmax. Not Implemented yet.')
             raise
         with tf.variable_scope(name):
-            shape = tf.cast(tf.shape(input_), tf.float32)
+            levels = [[l, l] if type(l) is int else list(l) for l in levels]
             if(not concatenate):
                 assert len(levels) == 1
+            nb_channels = input_.get_shape().as_list()[-1]
+            (h, w) = (tf.shape(input_)[1], tf.shape(input_)[2])
+            if(pooling == 'TV'):
+                # |x[i+1, j] - x[i, j]| and |x[i, j+1] - x[i, j]| (0 on the last row/column)
+                diff_y = tf.pad(tf.abs(input_[:, 1:, :, :] - input_[:, :-1, :, :]), [[0, 0], [0, 1], [0, 0], [0, 0]])
+                diff_x = tf.pad(tf.abs(input_[:, :, 1:, :] - input_[:, :, :-1, :]), [[0, 0], [0, 0], [0, 1], [0, 0]])
+            elif(pooling == 'MAX'):
+                low = tf.expand_dims(tf.reduce_min(input_, axis=[1, 2], keepdims=True), 1)
+            elif(pooling != 'AVG'):
+                raise RuntimeError('Unknown pooling method: {}'.format(pooling))
+            # (l x n) matrices of the pixels and of the pairs (pixel, next pixel) in each bin
+            def bins(n, l):
+                start = tf.reshape((tf.range(l)*n)//l, [-1, 1])
+                end = tf.reshape(((tf.range(l) + 1)*n + l - 1)//l, [-1, 1])
+                pixels = tf.reshape(tf.range(n), [1, -1])
+                inside = tf.cast(tf.logical_and(pixels >= start, pixels < end), input_.dtype)
+                pairs = tf.cast(tf.logical_and(pixels >= start, pixels + 1 < end), input_.dtype)
+                return (inside, pairs)
+            # Sums of 'tensor' (b x h x w x c) over the bins: b x lh x lw x c
+            def bin_sums(tensor, rows, cols):
+                sums = tf.tensordot(rows, tensor, [[1], [1]]) # lh x b x w x c
+                sums = tf.tensordot(sums, cols, [[2], [1]]) # lh x b x c x lw
+                return tf.transpose(sums, [1, 0, 3, 2])
             pool_outputs = []
-            for l in levels:
-                # Compute the pooling manually by slicing the input tensor
-                pool_size = tf.cast([tf.ceil(tf.div(shape[-3],l[0])), tf.ceil(tf.div(shape[-2], l[1]))], tf.int32)
-                strides= tf.cast([tf.floordiv(shape[-3], l[0]), tf.floordiv(shape[-2], l[1])], tf.int32)
-                for i in range(l[0]):
-                    if(not concatenate):
-                        pool_outputs += [[]]
-                    for j in range(l[1]):
-                        # bin (i,j)
-                        tensor_slice = input_[:, i*strides[0]:i*strides[0]+pool_size[0], j*strides[1]:j*strides[1]+pool_size[1],:]
-                        if(pooling == 'AVG'):
-                            reduced_tensor = tf.reduce_mean(tensor_slice, axis=[1,2])
-                        elif(pooling == 'MAX'):
-                            reduced_tensor = tf.reduce_max(tensor_slice, axis=[1,2])
-                        elif(pooling == 'TV'):
-                            reduced_tensor = tf.reduce_sum(tf.abs(tensor_slice[:, 1:, :, :] - tensor_slice[:, :-1, :, :]), axis=[1,2]) +\
-                                             tf.reduce_sum(tf.abs(tensor_slice[:, :, 1:, :] - tensor_slice[:, :, :-1, :]), axis=[1,2])
-                        if(concatenate):
-                            pool_outputs.append(reduced_tensor)
-                        else:
-                            pool_outputs[i] += [reduced_tensor]
+            for (lh, lw) in levels:
+                ((rows, row_pairs), (cols, col_pairs)) = (bins(h, lh), bins(w, lw))
+                if(pooling == 'TV'):
+                    reduced_tensor = bin_sums(diff_y, row_pairs, cols) + bin_sums(diff_x, rows, col_pairs)
+                elif(pooling == 'AVG'):
+                    area = tf.reshape(tf.reduce_sum(rows, axis=1), [1, lh, 1, 1])*tf.reshape(tf.reduce_sum(cols, axis=1), [1, 1, lw, 1])
+                    reduced_tensor = bin_sums(input_, rows, cols)/area
+                else:
+                    # b x lh x h x w x c -> b x lh x w x c, then b x lh x lw x w x c -> b x lh x lw x c
+                    mask = tf.reshape(rows, [1, lh, -1, 1, 1])
+                    reduced_tensor = tf.reduce_max(tf.expand_dims(input_, 1)*mask + low*(1 - mask), axis=2)
+                    mask = tf.reshape(cols, [1, 1, lw, -1, 1])
+                    reduced_tensor = tf.reduce_max(tf.expand_dims(reduced_tensor, 2)*mask + low*(1 - mask), axis=3)
+                if(concatenate):
+                    pool_outputs.append(tf.reshape(reduced_tensor, [-1, lh*lw*nb_channels]))
+                else:
+                    pool_outputs.append(reduced_tensor)
             if(concatenate):
                 spp = tf.concat(pool_outputs, 1)
             else:
-                spp = tf.transpose(tf.convert_to_tensor(pool_outputs), perm=[1, 2, 0, 3]) # convert h' x w' x b x c to b x h' x w' x c
+                spp = pool_outputs[0]
             return spp
     
     def update_confusion_matrix(self, labels, pred, name, nb_classes = None):
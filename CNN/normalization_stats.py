@@ -0,0 +1,131 @@
+'''
+Per-channel statistics of the frames of a data set, used to normalize them
+with 1 affine transform in the input pipeline instead of a standardization of
+each picture (which costs 1 more pass over the picture and loses the absolute
+field strength). The statistics of the files are computed separately (in
+parallel) and merged: parallel update of the mean and the variance (Chan et
+al.) and sum of the histograms.
+    count, mean, m2 / channel   (m2: sum of the squared deviations to the mean)
+    idem / channel / HARP       (optional)
+    histogram / channel         'nb_bins' bins on [-value_range, value_range],
+                                the values outside are counted in the edge bins
+The percentiles (clip values) are read in the histograms. The transform of a
+value x of a channel is:
+    (min(max(x, low), high) - mean)/std = min(max(x, low), high)*scale + offset
+'''
+
+import json
+import numpy as np
+
+class Normalization_Stats:
+
+    segs = None
+    nb_bins = None
+    value_range = None
+    count = None # (c,)
+    mean = None # (c,)
+    m2 = None # (c,)
+    hist = None # (c, nb_bins)
+    harps = None # HARP nb -> (count, mean, m2), None if not computed
+
+    def __init__(self, segs, nb_bins = 2048, value_range = 1e4, per_harp = False):
+        c = len(segs)
+        self.segs = list(segs)
+        self.nb_bins = int(nb_bins)
+        self.value_range = float(value_range)
+        self.count = np.zeros(c, dtype=np.float64)
+        self.mean = np.zeros(c, dtype=np.float64)
+        self.m2 = np.zeros(c, dtype=np.float64)
+        self.hist = np.zeros((c, self.nb_bins), dtype=np.int64)
+        self.harps = {} if per_harp else None
+
+    # Merges the moments a = (count, mean, m2) and b of 2 sets of values
+    @staticmethod
+    def _merge_moments(a, b):
+        count = a[0] + b[0]
+        delta = b[1] - a[1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(count > 0, b[0]/count, 0)
+        return count, a[1] + delta*w, a[2] + b[2] + delta*delta*a[0]*w
+
+    # Adds the values of a frame (h, w, c)
+    def add(self, frame, harp = None):
+        c = len(self.segs)
+        x = np.asarray(frame, dtype=np.float64).reshape(-1, c)
+        if(len(x) == 0):
+            return
+        mean = np.mean(x, axis=0)
+        moments = (np.full(c, len(x), dtype=np.float64), mean, np.sum(np.square(x - mean), axis=0))
+        (self.count, self.mean, self.m2) = Normalization_Stats._merge_moments((self.count, self.mean, self.m2), moments)
+        if(self.harps is not None and harp is not None):
+            key = str(int(harp))
+            if(key in self.harps):
+                moments = Normalization_Stats._merge_moments(self.harps[key], moments)
+            self.harps[key] = moments
+        bins = ((x + self.value_range)*(self.nb_bins/(2*self.value_range))).astype(np.int64)
+        bins = np.clip(bins, 0, self.nb_bins-1) + self.nb_bins*np.arange(c)
+        self.hist += np.bincount(bins.reshape(-1), minlength=c*self.nb_bins).reshape(c, self.nb_bins)
+
+    # Adds the statistics of other values (with the same channels and bins)
+    def merge(self, other):
+        if(other.segs != self.segs or other.nb_bins != self.nb_bins or other.value_range != self.value_range):
+            raise RuntimeError('Impossible to merge statistics of different channels or histograms')
+        (self.count, self.mean, self.m2) = Normalization_Stats._merge_moments((self.count, self.mean, self.m2),
+                                                                              (other.count, other.mean, other.m2))
+        self.hist += other.hist
+        if(self.harps is not None and other.harps is not None):
+            for (key, moments) in other.harps.items():
+                self.harps[key] = Normalization_Stats._merge_moments(self.harps[key], moments) if key in self.harps else moments
+
+    # (mean, std) / channel of all the values (or of a HARP)
+    def moments(self, harp = None):
+        (count, mean, m2) = (self.count, self.mean, self.m2)
+        if(harp is not None and self.harps is not None and str(int(harp)) in self.harps):
+            (count, mean, m2) = self.harps[str(int(harp))]
+        std = np.sqrt(m2/np.maximum(count, 1))
+        return mean, np.maximum(std, 1e-6)
+
+    # Percentile q (in %) / channel, interpolated in the bins
+    def percentile(self, q):
+        edges = np.linspace(-self.value_range, self.value_range, self.nb_bins+1)
+        res = np.zeros(len(self.segs))
+        for k in range(len(self.segs)):
+            cdf = np.cumsum(self.hist[k])
+            if(cdf[-1] == 0):
+                continue
+            target = q/100.0*cdf[-1]
+            i = min(int(np.searchsorted(cdf, target)), self.nb_bins-1)
+            before = cdf[i-1] if i > 0 else 0
+            t = (target - before)/float(self.hist[k][i]) if self.hist[k][i] > 0 else 0
+            res[k] = edges[i] + t*(edges[i+1] - edges[i])
+        return res
+
+    # Returns (scale, offset, low, high) / channel of the normalization. The
+    # values are clipped to the percentiles 'clip' (None: no clipping).
+    def affine(self, clip = (0.5, 99.5), harp = None):
+        (mean, std) = self.moments(harp)
+        if(clip is None):
+            (low, high) = (np.full(len(self.segs), -np.inf), np.full(len(self.segs), np.inf))
+        else:
+            (low, high) = (self.percentile(clip[0]), self.percentile(clip[1]))
+        return 1.0/std, -mean/std, low, high
+
+    def to_json(self):
+        desc = {'segs': self.segs, 'nb_bins': self.nb_bins, 'value_range': self.value_range,
+                'count': self.count.tolist(), 'mean': self.mean.tolist(), 'm2': self.m2.tolist(),
+                'hist': self.hist.tolist()}
+        if(self.harps is not None):
+            desc['harps'] = {key: [m.tolist() for m in moments] for (key, moments) in self.harps.items()}
+        return json.dumps(desc)
+
+    @staticmethod
+    def from_json(desc):
+        desc = json.loads(desc)
+        stats = Normalization_Stats(desc['segs'], desc['nb_bins'], desc['value_range'], 'harps' in desc)
+        stats.count = np.array(desc['count'], dtype=np.float64)
+        stats.mean = np.array(desc['mean'], dtype=np.float64)
+        stats.m2 = np.array(desc['m2'], dtype=np.float64)
+        stats.hist = np.array(desc['hist'], dtype=np.int64).reshape(len(stats.segs), stats.nb_bins)
+        if('harps' in desc):
+            stats.harps = {key: tuple(np.array(m, dtype=np.float64) for m in moments) for (key, moments) in desc['harps'].items()}
+        return stats
@@ -0,0 +1,156 @@
+'''
+This class reads and cleans the samples of a data set with a pool of worker
+processes, so that the HDF5 decoding and the NaN cleaning are not limited by
+the GIL of the process running TensorFlow. Each worker writes its samples in
+its own slots of a shared memory ring buffer (a file memory-mapped by all the
+processes, in /dev/shm when available) and the main process yields
+NumPy views of these slots (no copy). A slot is given back to its worker when
+the view (and everything built on top of it) is garbage collected. The samples
+are always yielded in the order of the list of entries given, whatever the
+number of workers.
+The workers are started by a fork server (a process started before the
+threads of TensorFlow, that only forks itself), never by a fork of the
+process running TensorFlow: 'read_sample' and the entries must be picklable.
+'''
+
+import os, traceback, weakref, queue, tempfile
+import multiprocessing as mp
+import numpy as np
+
+class Parallel_Loader:
+
+    read_sample = None # picklable function: entry -> (features, label, metadata)
+    nb_workers = None
+    slot_size = None # in bytes
+    slots_per_worker = None
+    slot_timeout = None # in seconds
+    nb_fallbacks = None # nb of samples of the last 'generate' sent through the results queue
+    nb_oversized = None # among them, nb of samples bigger than a slot
+
+    def __init__(self, read_sample, nb_workers = 4, slot_size = 32*1024*1024, slots_per_worker = 2, slot_timeout = 1.0):
+        self.read_sample = read_sample
+        self.nb_workers = max(1, int(nb_workers))
+        self.slot_size = int(slot_size)
+        self.slots_per_worker = max(1, int(slots_per_worker))
+        self.slot_timeout = slot_timeout
+        if('forkserver' in mp.get_all_start_methods()):
+            self.context = mp.get_context('forkserver')
+            # The module of 'read_sample' is imported once, by the server
+            self.context.set_forkserver_preload([read_sample.__module__])
+        else:
+            self.context = mp.get_context('spawn')
+
+    # Worker w reads the entries w, w+nb_workers, w+2*nb_workers, ... If none
+    # of its slots gets free within 'slot_timeout' seconds (they can be held
+    # downstream, ex: in a batch being built) or if the sample is too big, the
+    # sample is sent through the results queue instead.
+    @staticmethod
+    def _worker(w, nb_workers, entries, read_sample, ring_path, slot_size, slot_timeout, free_slots, results, stop):
+        ring = np.memmap(ring_path, dtype=np.uint8, mode='r+')
+        try:
+            for seq in range(w, len(entries), nb_workers):
+                if(stop.is_set()):
+                    break
+                try:
+                    (features, label, meta) = read_sample(entries[seq])
+                    features = np.ascontiguousarray(features)
+                    slot = None
+                    if(features.nbytes <= slot_size):
+                        try:
+                            slot = free_slots.get(timeout=slot_timeout)
+                        except queue.Empty:
+                            pass
+                    if(slot is None):
+                        # Copied: the queue pickles it later and 'read_sample' can reuse its buffer
+                        results.put((seq, None, features.copy(), None, label, meta))
+                    else:
+                        dest = np.ndarray(features.shape, dtype=features.dtype, buffer=ring, offset=slot*slot_size)
+                        dest[...] = features
+                        del dest
+                        results.put((seq, slot, features.shape, features.dtype.str, label, meta))
+                except:
+                    results.put((seq, None, None, None, None, traceback.format_exc()))
+        finally:
+            del ring
+
+    # Creates the file of the ring buffer. Its pages are only allocated when
+    # they are written.
+    @staticmethod
+    def _ring_file(size):
+        (fd, path) = tempfile.mkstemp(prefix='parallel_loader_', suffix='.ring', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+        return path
+
+    @staticmethod
+    def _release(free_slots, slot):
+        try:
+            free_slots.put(slot)
+        except (ValueError, OSError, AssertionError):
+            # The loader has already been shut down
+            pass
+
+    # Yields (features, label, metadata) for every entry, in order. Entries
+    # that cannot be read are ignored.
+    def generate(self, entries):
+        n = len(entries)
+        if(n == 0):
+            return
+        nb_workers = min(self.nb_workers, n)
+        self.nb_fallbacks = 0
+        self.nb_oversized = 0
+        ring_path = Parallel_Loader._ring_file(max(1, nb_workers*self.slots_per_worker*self.slot_size))
+        ring = np.memmap(ring_path, dtype=np.uint8, mode='r+')
+        results = self.context.Queue()
+        stop = self.context.Event()
+        free_slots = []
+        workers = []
+        try:
+            for w in range(nb_workers):
+                free_slots += [self.context.Queue()]
+                for k in range(self.slots_per_worker):
+                    free_slots[w].put(w*self.slots_per_worker + k)
+                workers += [self.context.Process(target=Parallel_Loader._worker,
+                                                 args=(w, nb_workers, entries, self.read_sample, ring_path,
+                                                       self.slot_size, self.slot_timeout, free_slots[w], results, stop),
+                                                 daemon=True)]
+                workers[w].start()
+            # Completed samples that arrived before their turn
+            pending = {}
+            for seq in range(n):
+                while(seq not in pending):
+                    try:
+                        item = results.get(timeout=1)
+                        pending[item[0]] = item
+                    except queue.Empty:
+                        if(not workers[seq % nb_workers].is_alive()):
+                            raise RuntimeError('Worker {} died before reading sample {}'.format(seq % nb_workers, seq))
+                (_, slot, shape, dtype, label, meta) = pending.pop(seq)
+                if(slot is None):
+                    if(shape is None):
+                        print('Impossible to read sample {}. Ignored'.format(entries[seq][:3]))
+                        print(meta)
+                        continue
+                    self.nb_fallbacks += 1
+                    if(shape.nbytes > self.slot_size):
+                        self.nb_oversized += 1
+                    yield shape, label, meta
+                else:
+                    features = np.ndarray(shape, dtype=np.dtype(dtype), buffer=ring, offset=slot*self.slot_size)
+                    weakref.finalize(features, Parallel_Loader._release, free_slots[seq % nb_workers], slot)
+                    yield features, label, meta
+                    del features
+            if(self.nb_fallbacks > 0):
+                print('Warning: {}/{} samples sent through the results queue ({} bigger than a slot of {:.1f}MB)'.format(
+                      self.nb_fallbacks, n, self.nb_oversized, self.slot_size/(1024.0*1024)))
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join(timeout=1)
+                if(worker.is_alive()):
+                    worker.terminate()
+            # The views still used keep the mapping (the memory is freed with them)
+            os.remove(ring_path)
+
@@ -0,0 +1,132 @@
+'''
+This class resizes (or pads) all the frames of a video at once into 1 array
+(n, H, W, C) allocated once, by a pool of threads. The interpolations are the
+ones of skimage.transform.resize:
+    'LIN_RESIZING'  -> order 1
+    'QUAD_RESIZING' -> order 2
+When OpenCV is installed, the linear upsampling uses it (it releases the GIL)
+with the edges mirrored as skimage does. OpenCV has no order 2 and does not
+smooth the frames before downsampling (skimage anti-aliasing): these cases
+always use skimage.
+    'ZERO_PADDING'  -> frames centered, zeros around
+    'EDGE_PADDING'  -> frames centered, edge values repeated around
+The padding is done with slice assignments (no temporary frame). A frame
+bigger than the output is center-cropped.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import skimage.transform as sk
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+class Resize_Engine:
+
+    nb_threads = None
+    backend = None # 'OPENCV' or 'SKIMAGE'
+    executor = None
+
+    def __init__(self, nb_threads = 4, backend = None):
+        self.nb_threads = max(1, int(nb_threads))
+        if(backend is None):
+            backend = 'OPENCV' if cv2 is not None else 'SKIMAGE'
+        if(backend == 'OPENCV' and cv2 is None):
+            raise RuntimeError('OpenCV is not installed')
+        assert backend in {'OPENCV', 'SKIMAGE'}
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(self.nb_threads) if self.nb_threads > 1 else None
+
+    # Offsets (top, left) of a frame of size 'shape' centered in 'output_shape'
+    # (negative if the frame is bigger)
+    @staticmethod
+    def _center(shape, output_shape):
+        return (int(np.round((output_shape[0]-shape[0])/2)), int(np.round((output_shape[1]-shape[1])/2)))
+
+    @staticmethod
+    def _pad(frame, out, mode):
+        (H, W) = out.shape[0:2]
+        (top, left) = Resize_Engine._center(frame.shape, (H, W))
+        # Part of the frame inside the output
+        (i0, j0) = (max(0, -top), max(0, -left))
+        (i1, j1) = (min(frame.shape[0], H-top), min(frame.shape[1], W-left))
+        (top, left) = (max(0, top), max(0, left))
+        (bottom, right) = (top + i1-i0, left + j1-j0)
+        out[top:bottom, left:right] = frame[i0:i1, j0:j1]
+        if(mode == 'ZERO_PADDING'):
+            out[:top] = 0
+            out[bottom:] = 0
+            out[top:bottom, :left] = 0
+            out[top:bottom, right:] = 0
+        else:
+            out[:top, left:right] = out[top:top+1, left:right]
+            out[bottom:, left:right] = out[bottom-1:bottom, left:right]
+            out[:, :left] = out[:, left:left+1]
+            out[:, right:] = out[:, right-1:right]
+
+    # OpenCV repeats the edge pixels where skimage mirrors them (mode 'reflect'):
+    # the rows (axis 0) or columns (axis 1) of 'dst' interpolated beyond the
+    # first/last pixel centers of 'src' are computed again
+    @staticmethod
+    def _mirror_edges(src, dst, axis):
+        (n, m) = (src.shape[axis], dst.shape[axis])
+        if(n < 2):
+            return
+        coords = (np.arange(m) + 0.5)*n/m - 0.5
+        (src, dst) = (np.moveaxis(src, axis, 0), np.moveaxis(dst, axis, 0))
+        for i in np.flatnonzero(coords < 0):
+            d = -coords[i]
+            dst[i] = (1-d)*src[0] + d*src[1]
+        for i in np.flatnonzero(coords > n-1):
+            d = coords[i] - (n-1)
+            dst[i] = (1-d)*src[-1] + d*src[-2]
+
+    def _resize(self, frame, out, method):
+        if(self.backend == 'OPENCV' and method == 'LIN_RESIZING' and
+           out.shape[0] >= frame.shape[0] and out.shape[1] >= frame.shape[1]):
+            # OpenCV drops the last axis of 1-channel pictures
+            dst = out[:,:,0] if out.shape[2] == 1 else out
+            src = np.ascontiguousarray(frame[:,:,0] if frame.shape[2] == 1 else frame, dtype=np.float32)
+            # Rows then columns (the linear interpolation is separable)
+            rows = cv2.resize(src, (src.shape[1], dst.shape[0]), interpolation=cv2.INTER_LINEAR)
+            Resize_Engine._mirror_edges(src, rows, 0)
+            res = cv2.resize(rows, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=cv2.INTER_LINEAR)
+            if(res is not dst):
+                dst[...] = res
+            Resize_Engine._mirror_edges(rows, dst, 1)
+        else:
+            order = 1 if method == 'LIN_RESIZING' else 2
+            out[...] = sk.resize(frame, out.shape, order=order, preserve_range=True)
+
+    def _process(self, frame, out, method):
+        if(frame.shape[0:2] == out.shape[0:2]):
+            out[...] = frame
+        elif(method in {'ZERO_PADDING', 'EDGE_PADDING'}):
+            Resize_Engine._pad(frame, out, method)
+        else:
+            self._resize(frame, out, method)
+
+    # Resizes every frame (h, w, c) of 'video' to 'output_shape' (H, W). Returns
+    # an array (n, H, W, c) ('out' if given).
+    def resize_video(self, video, output_shape, method, out = None):
+        assert method in {'LIN_RESIZING', 'QUAD_RESIZING', 'ZERO_PADDING', 'EDGE_PADDING'}
+        n = len(video)
+        if(n == 0):
+            return np.zeros((0,) + tuple(output_shape) + (0,), dtype=np.float32)
+        shape = (n,) + tuple(output_shape) + (video[0].shape[2],)
+        if(out is None):
+            out = np.empty(shape, dtype=np.float32)
+        elif(out.shape != shape):
+            raise RuntimeError('Output of shape {} used for a video of shape {}'.format(out.shape, shape))
+        for frame in video:
+            if(len(frame.shape) != 3 or frame.shape[2] != shape[3]):
+                raise RuntimeError('Invalid frame dimension in the video: {} (expected (h, w, {}))'.format(frame.shape, shape[3]))
+        if(self.executor is None or n == 1):
+            for k in range(n):
+                self._process(video[k], out[k], method)
+        else:
+            # Waits for all the frames and raises the first error if any
+            for future in [self.executor.submit(self._process, video[k], out[k], method) for k in range(n)]:
+                future.result()
+        return out
@@ -0,0 +1,112 @@
+'''
+Numeric identifiers of the samples. The metadata of a sample is a vector of
+6 int32: (file id, video id, frame nb, height, width, class id), resolved
+with the lookup table of the memory batch it belongs to:
+    files   : file names
+    videos  : (file id, video key, prefix of the frame keys)
+    classes : event classes (ex: 'M1.0')
+The frame nb is the number in the frame key ('frame12' -> 12). For a sample
+that is a whole video (LRCN), frame nb, height and width are -1.
+'''
+
+import re, json
+import numpy as np
+
+ID_SIZE = 6
+(FILE, VIDEO, FRAME, HEIGHT, WIDTH, CLASS) = range(ID_SIZE)
+
+class Sample_Table:
+
+    files = None
+    videos = None
+    classes = None
+    _file_ids = None
+    _video_ids = None
+    _class_ids = None
+
+    def __init__(self, files = [], videos = [], classes = []):
+        self.files = []
+        self.videos = []
+        self.classes = []
+        self._file_ids = {}
+        self._video_ids = {}
+        self._class_ids = {}
+        for name in files:
+            self.file_id(name)
+        for (file_id, vid_key, prefix) in videos:
+            self.video_id(file_id, vid_key, prefix)
+        for event_class in classes:
+            self.class_id(event_class)
+
+    def file_id(self, name):
+        if(name not in self._file_ids):
+            self._file_ids[name] = len(self.files)
+            self.files += [name]
+        return self._file_ids[name]
+
+    def video_id(self, file_id, vid_key, prefix = 'frame'):
+        key = (file_id, vid_key)
+        if(key not in self._video_ids):
+            self._video_ids[key] = len(self.videos)
+            self.videos += [(file_id, vid_key, prefix)]
+        return self._video_ids[key]
+
+    def class_id(self, event_class):
+        if(event_class not in self._class_ids):
+            self._class_ids[event_class] = len(self.classes)
+            self.classes += [event_class]
+        return self._class_ids[event_class]
+
+    # Returns the ids (file id, video id, class id) of a video
+    def video_ids(self, file_name, vid_key, event_class, prefix = 'frame'):
+        file_id = self.file_id(file_name)
+        return (file_id, self.video_id(file_id, vid_key, prefix), self.class_id(event_class))
+
+    @staticmethod
+    def frame_number(frame_key):
+        return int(re.search('[0-9]+$', frame_key).group(0))
+
+    @staticmethod
+    def frame_prefix(frame_key):
+        return re.sub('[0-9]+$', '', frame_key)
+
+    # Returns the id of a frame (or of the whole video if 'frame_key' is None)
+    @staticmethod
+    def sample_id(video_ids, frame_key = None, height = -1, width = -1):
+        (file_id, video_id, class_id) = video_ids
+        frame_nb = -1 if frame_key is None else Sample_Table.frame_number(frame_key)
+        return np.array([file_id, video_id, frame_nb, height, width, class_id], dtype=np.int32)
+
+    # Returns (event class, file name, video key, frame key, height, width) of
+    # a sample id (frame key is None for a whole video)
+    def resolve(self, sample_id):
+        (file_id, video_id, frame_nb, height, width, class_id) = [int(i) for i in sample_id]
+        (_, vid_key, prefix) = self.videos[video_id]
+        frame_key = None if frame_nb < 0 else '{}{}'.format(prefix, frame_nb)
+        return self.classes[class_id], self.files[file_id], vid_key, frame_key, height, width
+
+    # Adds the entries of 'table' and returns 'ids' (n x 6) translated into
+    # the ids of this table
+    def merge(self, table, ids):
+        ids = np.array(ids, dtype=np.int32).reshape(-1, ID_SIZE)
+        file_map = np.array([self.file_id(name) for name in table.files] + [-1], dtype=np.int32)
+        video_map = np.array([self.video_id(int(file_map[f]), vid_key, prefix) for (f, vid_key, prefix) in table.videos] + [-1], dtype=np.int32)
+        class_map = np.array([self.class_id(c) for c in table.classes] + [-1], dtype=np.int32)
+        ids[:, FILE] = file_map[ids[:, FILE]]
+        ids[:, VIDEO] = video_map[ids[:, VIDEO]]
+        ids[:, CLASS] = class_map[ids[:, CLASS]]
+        return ids
+
+    def to_json(self):
+        return json.dumps({'files': self.files, 'videos': self.videos, 'classes': self.classes})
+
+    @staticmethod
+    def from_json(desc):
+        desc = json.loads(desc)
+        return Sample_Table(desc['files'], [tuple(v) for v in desc['videos']], desc['classes'])
+
+# Array (n x 6) of a list of sample ids
+def to_array(ids):
+    if(len(ids) == 0):
+        return np.zeros((0, ID_SIZE), dtype=np.int32)
+    return np.array(ids, dtype=np.int32).reshape(-1, ID_SIZE)
@@ -0,0 +1,5 @@
+# The modules of CNN are imported without package (as in the scripts), the
+# ones of DataQuery from the root of the repository
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
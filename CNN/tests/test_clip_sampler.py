@@ -0,0 +1,35 @@
+import numpy as np
+from clip_sampler import Clip_Sampler
+from feature_array import Feature_Array
+
+def test_clips():
+    sampler = Clip_Sampler(window=3, stride=2, lead_time=1)
+    clips = sampler.clips([8, 3, 4, 0])
+    # Video of 8 frames: clips ending 1, 3 and 5 frames before the event
+    assert clips.tolist() == [[0, 4, 1], [0, 2, 3], [0, 0, 5], [2, 0, 1]]
+    assert sampler.num_clips([np.zeros((8, 2)), np.zeros((3, 2))]) == 3
+
+def test_generate_views_and_labels():
+    videos = [np.arange(10*2, dtype=np.float32).reshape(10, 2), np.arange(6*2, dtype=np.float32).reshape(6, 2)]
+    features = Feature_Array(np.float32)
+    features.extend(videos)
+    metadata = np.array([[0]*6, [1]*6], dtype=np.int32)
+    sampler = Clip_Sampler(window=4, stride=3, label_policy='HORIZON', horizon=2, quiet_label=9)
+    samples = list(sampler.generate(features, [1, 2], metadata, use_metadata=True))
+    assert len(samples) == sampler.num_clips(features) == 4
+    for (clip, label, meta) in samples:
+        assert clip.shape == (4, 2)
+        # The clips are views of the videos
+        assert np.shares_memory(clip, features.buffer)
+    assert [label for (_, label, _) in samples] == [1, 9, 9, 2]
+    np.testing.assert_array_equal(samples[0][0], videos[0][6:10])
+    np.testing.assert_array_equal(samples[3][2], metadata[1])
+
+# With a shuffle buffer, every clip is given exactly once
+def test_shuffled_clips():
+    videos = [np.full((n, 1), v, dtype=np.float32) for (v, n) in enumerate([12, 7, 9, 20])]
+    sampler = Clip_Sampler(window=2, shuffle_buffer=5, random_state=np.random.RandomState(0))
+    samples = list(sampler.generate(videos, [0, 1, 2, 3]))
+    assert len(samples) == 11+6+8+19
+    assert sorted(int(clip[0, 0]) for (clip, _) in samples) == sorted([0]*11 + [1]*6 + [2]*8 + [3]*19)
+    assert all(int(clip[0, 0]) == label for (clip, label) in samples)
@@ -0,0 +1,44 @@
+import numpy as np
+import h5py as h5
+import pytest
+from DataQuery.DataWrapper import SF_video
+
+# A video whose frames are not written in order, with channels (Br, Bp, Bt)
+@pytest.fixture
+def video_file(tmpdir):
+    path = str(tmpdir.join('video.hdf5'))
+    rng = np.random.RandomState(0)
+    frames = {}
+    with h5.File(path, 'w') as db:
+        vid = db.create_group('video0')
+        vid.attrs['event_class'] = 'M1.0'
+        for k in [2, 0, 10, 1]:
+            frames[k] = rng.normal(size=(4+k, 5, 3)).astype(np.float32)
+            frame = vid.create_group('frame{}'.format(k))
+            frame.create_dataset('channels', data=frames[k])
+            frame.attrs['SEGS'] = [b"Br", b"Bp", b"Bt"]
+            frame.attrs['T_REC'] = np.bytes_('2011.01.01_00:{:02d}:00_TAI'.format(k).encode())
+        vid.create_group('frame3') # no channels: ignored
+    return path, frames
+
+def test_sf_video(video_file):
+    (path, frames) = video_file
+    with h5.File(path, 'r') as db:
+        vid = SF_video(db['video0'])
+        assert len(vid) == 4
+        assert vid.frame_keys == ('frame0', 'frame1', 'frame2', 'frame10')
+        assert vid.channels == ('Br', 'Bp', 'Bt')
+        np.testing.assert_array_equal(vid[3], frames[10])
+        np.testing.assert_array_equal(vid[-1], frames[10])
+        assert list(vid.shapes[:, 0]) == [4, 5, 6, 14]
+        assert list(vid.frame_attrs('T_REC'))[1] == '2011.01.01_00:01:00_TAI'
+        # Slices and selections of channels are views (nothing read)
+        sub = vid[1:3].select(['Bt', 'Br'])
+        assert len(sub) == 2 and sub.channels == ('Br', 'Bt')
+        np.testing.assert_array_equal(sub[0], frames[1][:, :, [0, 2]])
+        out = np.full((20, 20, 3), np.nan, dtype=np.float32)
+        np.testing.assert_array_equal(vid.select(['Bp', 'Bt']).read_into(out, 2), frames[2][:, :, 1:])
+        with pytest.raises(RuntimeError):
+            vid.select(['Bz'])
+        with pytest.raises(RuntimeError):
+            vid.read_into(np.empty((2, 2, 3), dtype=np.float32), 0)
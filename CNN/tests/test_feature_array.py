@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from feature_array import Feature_Array
+
+def test_ragged_features():
+    rng = np.random.RandomState(0)
+    features = [rng.normal(size=(h, w, 2)) for (h, w) in [(3, 4), (1, 7), (5, 5)]]
+    array = Feature_Array(np.float32)
+    for f in features[:2]:
+        array.append(f)
+    array.extend([features[2]])
+    assert len(array) == 3
+    assert array.nbytes == 4*sum(f.size for f in features)
+    for (a, f) in zip(array, features):
+        assert a.dtype == np.float32
+        np.testing.assert_allclose(a, f, rtol=1e-6)
+    np.testing.assert_allclose(array[-1], features[-1], rtol=1e-6)
+    # A feature is a view of the buffer
+    assert np.shares_memory(array[0], array.buffer)
+    assert not array.is_dense()
+    with pytest.raises(RuntimeError):
+        array.dense()
+    with pytest.raises(IndexError):
+        array[3]
+    with pytest.raises(RuntimeError):
+        array.append(np.zeros((2, 2)))
+
+def test_dense_features():
+    dense = np.arange(24, dtype=np.float16).reshape(4, 3, 2)
+    array = Feature_Array.from_dense(dense)
+    assert array.dtype == np.float16 and array.is_dense()
+    assert np.shares_memory(array.dense(), dense)
+    other = Feature_Array(np.float16)
+    other.extend(array)
+    other.extend(dense[:1])
+    np.testing.assert_array_equal(other.dense(), np.concatenate([dense, dense[:1]]))
+    other.clear()
+    assert len(other) == 0 and other.dense().size == 0
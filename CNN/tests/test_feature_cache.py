@@ -0,0 +1,50 @@
+import numpy as np
+from feature_cache import Feature_Cache
+from feature_array import Feature_Array
+from sample_table import Sample_Table
+
+def _source(tmpdir):
+    path = tmpdir.join('data.hdf5')
+    path.write('data')
+    return str(path)
+
+def test_round_trip(tmpdir):
+    path = _source(tmpdir)
+    cache = Feature_Cache(str(tmpdir.mkdir('cache')))
+    rng = np.random.RandomState(0)
+    features = [rng.normal(size=(h, w, 2)).astype(np.float32) for (h, w) in [(3, 4), (5, 2), (1, 1)]]
+    table = Sample_Table()
+    video = table.video_ids('data.hdf5', 'video0', 'M1.0')
+    metadata = [Sample_Table.sample_id(video, 'frame{}'.format(k), f.shape[0], f.shape[1]) for (k, f) in enumerate(features)]
+    cache.save(path, {'segs': ['Br']}, features, [1, 0, 1], metadata, table)
+    (loaded, labels, loaded_metadata, loaded_table, _) = cache.load(path, {'segs': ['Br']})
+    assert isinstance(loaded, Feature_Array)
+    assert len(loaded) == len(features)
+    for (a, b) in zip(loaded, features):
+        np.testing.assert_array_equal(a, b)
+    assert list(labels) == [1, 0, 1]
+    np.testing.assert_array_equal(loaded_metadata, np.array(metadata))
+    assert [loaded_table.resolve(i) for i in loaded_metadata] == [table.resolve(i) for i in metadata]
+
+def test_empty_file(tmpdir):
+    path = _source(tmpdir)
+    cache = Feature_Cache(str(tmpdir.mkdir('cache')))
+    cache.save(path, {}, [], [], [], Sample_Table())
+    (loaded, labels, metadata, _, _) = cache.load(path, {})
+    assert len(loaded) == 0 and len(labels) == 0
+    assert metadata.shape == (0, 6)
+
+# Another preprocessing or a modified source file is a miss
+def test_versions(tmpdir):
+    path = _source(tmpdir)
+    cache = Feature_Cache(str(tmpdir.mkdir('cache')))
+    features = [np.ones((2, 2, 1), dtype=np.float32)]
+    metadata = [np.full(6, -1, dtype=np.int32)]
+    cache.save(path, {'subsampling': 1}, features, [0], metadata, Sample_Table())
+    assert cache.load(path, {'subsampling': 2}) is None
+    cache.save(path, {'subsampling': 2}, features, [0], metadata, Sample_Table())
+    assert cache.load(path, {'subsampling': 1}) is None
+    assert cache.load(path, {'subsampling': 2}) is not None
+    with open(path, 'a') as f:
+        f.write('modified')
+    assert cache.load(path, {'subsampling': 2}) is None
@@ -0,0 +1,32 @@
+import numpy as np
+import h5py as h5
+from feature_writer import Feature_Writer, Encoded_Video
+from sample_table import Sample_Table
+
+# The features written (several flushes, 2 shapes in a video, frames not in
+# order) are read back by Encoded_Video
+def test_round_trip(tmpdir):
+    rng = np.random.RandomState(0)
+    table = Sample_Table()
+    written = {}
+    with Feature_Writer(str(tmpdir), compression='lzf', flush_memsize=0.001) as writer:
+        for b in range(6):
+            features = rng.normal(size=(4, 3, 2, 5)).astype(np.float32) if b != 3 else rng.normal(size=(4, 1, 1, 5)).astype(np.float32)
+            metadata = []
+            for k in range(4):
+                (file_name, video, frame_key) = ('f{}.hdf5'.format(b % 2), 'video{}'.format(b % 3), 'frame{}'.format(100-4*b-k))
+                metadata += [Sample_Table.sample_id(table.video_ids(file_name, video, 'M1.0'), frame_key, 30+k, 40)]
+                written[(file_name, video, frame_key)] = (features[k].copy(), [30+k, 40])
+            writer.add(features, metadata, table)
+            # The writer does not keep references to the arrays of the caller
+            features[:] = 0
+        writer.add(features[:1], [metadata[0]], table) # already written: ignored
+        assert writer.nb_features == 24
+    for (file_name, video, frame_key), (features, size) in written.items():
+        with h5.File(str(tmpdir.join(file_name)), 'r') as db:
+            encoded = Encoded_Video(db[video])
+            np.testing.assert_array_equal(encoded.read(frame_key), features)
+            assert list(encoded.size(frame_key)) == size
+            assert encoded.shape(frame_key) == features.shape
+            assert encoded.keys() == sorted(encoded.keys(), key=lambda f: int(f[5:]))
+            assert db[video].attrs['event_class'] == 'M1.0'
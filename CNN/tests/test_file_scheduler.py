@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from file_scheduler import File_Scheduler
+
+def _batches(scheduler):
+    batches = []
+    while(True):
+        (files, size, usage) = scheduler.next_batch()
+        if(len(files) == 0):
+            return batches
+        batches += [(files, size, usage)]
+
+# Every file that fits is scheduled exactly once and no batch exceeds the budget
+@pytest.mark.parametrize('policy', ['FIRST_FIT_DECREASING', 'RANDOM_BEST_FIT'])
+def test_every_file_scheduled_once(policy):
+    sizes = np.random.RandomState(0).uniform(1, 60, 200)
+    scheduler = File_Scheduler(sizes, 100, policy, np.random.RandomState(1))
+    batches = _batches(scheduler)
+    files = sorted(k for (batch, _, _) in batches for k in batch)
+    assert files == list(range(len(sizes)))
+    for (batch, size, usage) in batches:
+        assert size <= 100
+        assert size == pytest.approx(sizes[batch].sum())
+        assert usage == pytest.approx(size)
+    assert scheduler.num_files_scheduled == len(sizes)
+    # Never more than twice the optimal nb of batches
+    assert len(batches) <= 2*np.ceil(sizes.sum()/100)
+
+def test_first_fit_decreasing():
+    scheduler = File_Scheduler([50, 30, 70, 20, 40], 100)
+    assert [sorted(files) for (files, _, _) in _batches(scheduler)] == [[1, 2], [0, 4], [3]]
+
+def test_oversized_files_not_scheduled():
+    scheduler = File_Scheduler([10, 150, 20, 100.5], 100)
+    assert scheduler.oversized == [1, 3]
+    assert sorted(k for (files, _, _) in _batches(scheduler) for k in files) == [0, 2]
+
+def test_next_batch_without_pop():
+    scheduler = File_Scheduler([10, 20], 15)
+    assert scheduler.next_batch(pop=False)[0] == scheduler.next_batch()[0]
+    assert scheduler.num_files_scheduled == 1
+    assert scheduler.num_batches() == 0
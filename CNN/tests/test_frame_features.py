@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import frame_features
+
+def _frame():
+    frame = np.zeros((4, 5, 2), dtype=np.float32)
+    frame[:, :, 1] = [[300, 300, -300, -300, 0]]*4 # Br
+    frame[:, :, 0] = np.arange(20).reshape(4, 5)
+    return frame
+
+def test_builtin_features():
+    frame = _frame()
+    res = frame_features.compute(['unsigned_flux', 'flux_imbalance', 'pil_length', 'grad_energy', 'l1_err'], frame, ['Bp', 'Br'])
+    assert res['unsigned_flux'] == pytest.approx(4*4*300)
+    assert res['flux_imbalance'] == pytest.approx(0)
+    assert res['pil_length'] == 4 # 1 pixel / row
+    # On the (3, 4) valid pixels: channel 0 varies by 1 in x and 5 in y, Br
+    # by -600 and 300 in x on each row
+    assert res['grad_energy'] == pytest.approx((3*4*(1 + 25) + 3*(600**2 + 300**2))/frame.size)
+    assert res['l1_err'] == 0
+    res = frame_features.compute(['l1_err', 'TV'], frame + 1, [b'Bp', b'Br'], frame)
+    assert res['l1_err'] == pytest.approx(1)
+    assert res['TV'] == pytest.approx((3*4*np.sqrt(26) + 3*(600 + 300))/frame.size)
+
+# The radial field is found by name, whatever the order of the channels
+def test_channel_order():
+    frame = _frame()
+    flux = frame_features.compute(['unsigned_flux'], frame[:, :, ::-1], ['Br', 'Bp'])
+    assert flux['unsigned_flux'] == pytest.approx(4*4*300)
+
+def test_registry():
+    @frame_features.register('test_max')
+    def test_max(ctx):
+        return float(np.max(ctx.frame))
+    try:
+        assert frame_features.is_feature('test_max')
+        assert frame_features.compute(['test_max'], _frame(), ['Bp', 'Br']) == {'test_max': 300}
+        assert frame_features.attr_name('test_max', ['Br']) == 'test_max[Br]'
+        with pytest.raises(RuntimeError):
+            frame_features.compute(['unknown'], _frame(), ['Bp', 'Br'])
+    finally:
+        del frame_features.FEATURES['test_max']
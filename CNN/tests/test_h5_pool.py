@@ -0,0 +1,65 @@
+import os, signal, threading
+import h5py as h5
+import pytest
+from DataQuery.DataWrapper import H5_Pool
+
+def test_h5_pool(tmpdir):
+    (path, other) = (str(tmpdir.join('data.hdf5')), str(tmpdir.join('other.hdf5')))
+    for file_path in [path, other]:
+        with h5.File(file_path, 'w') as db:
+            db.create_group('video0')
+    H5_Pool.close_all()
+    H5_Pool.configure(max_open_files=1)
+    try:
+        db = H5_Pool.get(path)
+        assert H5_Pool.get(path) is db
+        with H5_Pool.open(path) as pinned:
+            assert pinned is db
+            # A file in use is neither evicted nor released
+            other_db = H5_Pool.get(other)
+            assert db.id.valid and not other_db.id.valid
+            with pytest.raises(RuntimeError):
+                H5_Pool.release(path)
+        # Least recently used file, evicted when it is not used anymore
+        other_db = H5_Pool.get(other)
+        assert not db.id.valid and other_db.id.valid
+        db = H5_Pool.get(path)
+        H5_Pool.release(path)
+        assert not db.id.valid
+        # The file can be written once released
+        with h5.File(path, 'r+') as f:
+            f['video0'].attrs['checked'] = 1
+    finally:
+        H5_Pool.configure(max_open_files=64)
+        H5_Pool.close_all()
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_h5_pool_after_fork(tmpdir):
+    path = str(tmpdir.join('data.hdf5'))
+    with h5.File(path, 'w') as db:
+        db.create_group('video0')
+    H5_Pool.close_all()
+    (locked, release) = (threading.Event(), threading.Event())
+    def hold_lock():
+        with H5_Pool._lock:
+            locked.set()
+            release.wait()
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait()
+    try:
+        pid = os.fork()
+        if(pid == 0):
+            # The thread holding the lock does not exist in the child
+            status = 1
+            signal.alarm(10)
+            try:
+                status = 0 if 'video0' in H5_Pool.get(path) else 1
+            finally:
+                os._exit(status)
+        (_, status) = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    finally:
+        release.set()
+        holder.join()
+        H5_Pool.close_all()
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from normalization_stats import Normalization_Stats
+
+def _frames():
+    rng = np.random.RandomState(0)
+    return [np.stack([rng.normal(100, 20, (h, w)), rng.uniform(-500, 500, (h, w))], axis=2) for (h, w) in [(10, 20), (7, 3), (30, 30)]]
+
+# Statistics merged from several parts (as the files computed in parallel)
+# equal the statistics of all the values
+def test_merge():
+    frames = _frames()
+    values = np.concatenate([f.reshape(-1, 2) for f in frames])
+    parts = [Normalization_Stats(['Bp', 'Br'], per_harp=True) for _ in range(2)]
+    parts[0].add(frames[0], harp=1)
+    parts[1].add(frames[1], harp=1)
+    parts[1].add(frames[2], harp=2)
+    parts[0].merge(parts[1])
+    stats = Normalization_Stats.from_json(parts[0].to_json())
+    (mean, std) = stats.moments()
+    np.testing.assert_allclose(mean, values.mean(axis=0))
+    np.testing.assert_allclose(std, values.std(axis=0))
+    harp_values = np.concatenate([f.reshape(-1, 2) for f in frames[:2]])
+    np.testing.assert_allclose(stats.moments(harp=1)[0], harp_values.mean(axis=0))
+    assert stats.hist.sum() == 2*len(values)
+    with pytest.raises(RuntimeError):
+        stats.merge(Normalization_Stats(['Br', 'Bp']))
+
+def test_percentiles_and_affine():
+    frames = _frames()
+    values = np.concatenate([f.reshape(-1, 2) for f in frames])
+    stats = Normalization_Stats(['Bp', 'Br'], nb_bins=4096, value_range=1000)
+    for f in frames:
+        stats.add(f)
+    bin_width = 2000/4096.0
+    for q in [1, 50, 99]:
+        np.testing.assert_allclose(stats.percentile(q), np.percentile(values, q, axis=0), atol=2*bin_width)
+    (scale, offset, low, high) = stats.affine(clip=(1, 99))
+    np.testing.assert_allclose(values.mean(axis=0)*scale + offset, 0, atol=1e-6)
+    np.testing.assert_allclose(values.std(axis=0)*scale, 1)
+    np.testing.assert_allclose(low, stats.percentile(1))
+    assert np.all(np.isinf(stats.affine(clip=None)[3]))
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+import skimage.transform as sk
+from resize_engine import Resize_Engine
+
+# Max absolute difference with skimage.transform.resize, for frames ~ N(0, 1)
+TOLERANCE = 1e-4
+
+@pytest.mark.parametrize('backend', ['SKIMAGE', 'OPENCV'])
+@pytest.mark.parametrize('method', ['LIN_RESIZING', 'QUAD_RESIZING'])
+@pytest.mark.parametrize('output_shape', [(80, 111), (37, 53), (20, 30), (74, 26)])
+@pytest.mark.parametrize('nb_channels', [1, 3])
+def test_resize_engine(backend, method, output_shape, nb_channels):
+    if(backend == 'OPENCV'):
+        pytest.importorskip('cv2')
+    rng = np.random.RandomState(0)
+    video = [rng.normal(size=(37, 53, nb_channels)).astype(np.float32) for k in range(3)]
+    video.append(rng.normal(size=(41, 49, nb_channels)).astype(np.float32))
+    engine = Resize_Engine(nb_threads=2, backend=backend)
+    out = engine.resize_video(video, output_shape, method)
+    order = 1 if method == 'LIN_RESIZING' else 2
+    for k in range(len(video)):
+        expected = sk.resize(video[k], tuple(output_shape) + (nb_channels,), order=order, preserve_range=True)
+        assert np.max(np.abs(out[k] - expected)) < TOLERANCE
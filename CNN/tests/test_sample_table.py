@@ -0,0 +1,28 @@
+import numpy as np
+import sample_table
+from sample_table import Sample_Table
+
+def test_merge_translates_ids():
+    table = Sample_Table()
+    ids = [Sample_Table.sample_id(table.video_ids('a.hdf5', 'video0', 'M1.0'), 'frame3', 10, 20)]
+    other = Sample_Table()
+    other_ids = [Sample_Table.sample_id(other.video_ids('b.hdf5', 'video1', 'B1.0'), 'frame7', 30, 40),
+                 Sample_Table.sample_id(other.video_ids('a.hdf5', 'video0', 'M1.0')),
+                 Sample_Table.sample_id(other.video_ids('b.hdf5', 'video2', 'M1.0', 'img'), 'img1', 5, 6)]
+    merged = table.merge(other, other_ids)
+    assert merged.shape == (3, sample_table.ID_SIZE)
+    assert table.resolve(ids[0]) == ('M1.0', 'a.hdf5', 'video0', 'frame3', 10, 20)
+    assert [table.resolve(i) for i in merged] == [other.resolve(i) for i in other_ids]
+    # The entries already known are not duplicated
+    assert table.files == ['a.hdf5', 'b.hdf5']
+    assert len(table.videos) == 3
+    assert table.classes == ['M1.0', 'B1.0']
+
+def test_merge_empty():
+    table = Sample_Table(['a.hdf5'])
+    assert table.merge(Sample_Table(), []).shape == (0, sample_table.ID_SIZE)
+
+def test_json_round_trip():
+    table = Sample_Table()
+    sample_id = Sample_Table.sample_id(table.video_ids('a.hdf5', 'video0', 'X2.0', 'img'), 'img12', 7, 8)
+    assert Sample_Table.from_json(table.to_json()).resolve(sample_id) == ('X2.0', 'a.hdf5', 'video0', 'img12', 7, 8)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if(not tf.__version__.startswith('1.')):
+    pytest.skip('needs TensorFlow 1.x', allow_module_level=True)
+from model import Model
+
+# Per-bin loop: the bin i of an axis of size n covers [floor(i*n/l), ceil((i+1)*n/l)[
+def spp_reference(x, levels, pooling):
+    (h, w) = x.shape[1:3]
+    outputs = []
+    for (lh, lw) in levels:
+        for i in range(lh):
+            for j in range(lw):
+                tensor_slice = x[:, (i*h)//lh:-(-(i+1)*h//lh), (j*w)//lw:-(-(j+1)*w//lw), :]
+                if(pooling == 'AVG'):
+                    outputs.append(np.mean(tensor_slice, axis=(1, 2)))
+                elif(pooling == 'MAX'):
+                    outputs.append(np.max(tensor_slice, axis=(1, 2)))
+                else:
+                    outputs.append(np.sum(np.abs(tensor_slice[:, 1:, :, :] - tensor_slice[:, :-1, :, :]), axis=(1, 2)) +
+                                   np.sum(np.abs(tensor_slice[:, :, 1:, :] - tensor_slice[:, :, :-1, :]), axis=(1, 2)))
+    return np.concatenate(outputs, axis=1)
+
+@pytest.mark.parametrize('pooling', ['MAX', 'AVG', 'TV'])
+def test_spp_layer(pooling):
+    levels = [[4, 4], [3, 2], [2, 2], [1, 1]]
+    rng = np.random.RandomState(0)
+    with tf.Graph().as_default():
+        data = tf.placeholder(tf.float32, shape=[None, None, None, 3])
+        spp = Model.spp_layer(data, levels, pooling=pooling)
+        with tf.Session() as sess:
+            # Bins of the same size, overlapping bins (5 with l = 4) and axes
+            # smaller than the nb of bins
+            for shape in [(8, 12), (5, 5), (7, 11), (3, 2), (1, 6)]:
+                x = rng.normal(size=(2,) + shape + (3,)).astype(np.float32)
+                out = sess.run(spp, {data: x})
+                np.testing.assert_allclose(out, spp_reference(x, levels, pooling), rtol=1e-5, atol=1e-5)
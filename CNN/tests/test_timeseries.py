@@ -0,0 +1,18 @@
+import numpy as np
+import timeseries
+
+# Same result as np.interp for each video and scalar (ragged videos, grid
+# going beyond the first and last samples)
+def test_resample_matches_interp():
+    rng = np.random.RandomState(0)
+    times_list = [np.sort(rng.uniform(0, 100, n)) for n in [1, 2, 7, 30]]
+    series_list = [rng.normal(size=(3, len(t))) for t in times_list]
+    sample_time = np.linspace(-10, 110, 50)
+    res = timeseries.resample(series_list, times_list, sample_time)
+    assert res.shape == (4, 3, 50)
+    for (k, (series, times)) in enumerate(zip(series_list, times_list)):
+        for i in range(3):
+            np.testing.assert_allclose(res[k, i], np.interp(sample_time, times, series[i]), rtol=1e-5, atol=1e-5)
+
+def test_resample_no_video():
+    assert timeseries.resample([], [], np.arange(5.0)).shape == (0, 0, 5)
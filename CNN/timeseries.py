@@ -0,0 +1,33 @@
+'''
+Resampling of the time series extracted from the videos (see
+'Data_Gen.extract_timeseries') onto a common time grid, for all the videos at
+once. NumPy only.
+'''
+
+import numpy as np
+
+# Linear interpolation of every time series (nb_scalars, n_i) sampled at 
+# times_list[i] (increasing) onto 'sample_time', as np.interp but for all
+# the videos and scalars at once. Returns an array (nb_videos, nb_scalars, nb_frames).
+def resample(series_list, times_list, sample_time):
+    nb_scalars = series_list[0].shape[0] if len(series_list) > 0 else 0
+    if(len(series_list) == 0):
+        return np.zeros((0, nb_scalars, len(sample_time)), dtype=np.float32)
+    lengths = np.array([len(t) for t in times_list])
+    ends = np.cumsum(lengths)
+    begins = ends - lengths
+    times = np.concatenate(times_list).astype(np.float64)
+    series = np.concatenate(series_list, axis=1)
+    # Each video is shifted by 'offset' so that all the times are sorted
+    offset = 2*(np.max(np.abs(times)) + np.max(np.abs(sample_time))) + 1
+    shift = offset*np.arange(len(times_list), dtype=np.float64)
+    x = sample_time[np.newaxis, :] + shift[:, np.newaxis]
+    j = np.searchsorted(times + np.repeat(shift, lengths), x, side='right') - 1
+    j = np.clip(j, begins[:, np.newaxis], np.maximum(begins, ends-2)[:, np.newaxis])
+    j1 = np.minimum(j+1, (ends-1)[:, np.newaxis])
+    dt = times[j1] - times[j]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = np.where(dt > 0, (sample_time[np.newaxis, :] - times[j])/dt, 0)
+    w = np.clip(w, 0, 1)
+    res = series[:, j]*(1-w) + series[:, j1]*w # (nb_scalars, nb_videos, nb_frames)
+    return np.transpose(res, (1, 0, 2)).astype(np.float32)
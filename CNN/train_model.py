@@ -254,10 +254,19 @@ def train_model(data):
                 num_pictures = data_generator.get_num_features()
                 if(not end_of_batch):
                     
+                    # Plots the time spent waiting for the data loaded in background
+                    if(data_generator.double_buffering):
+                        print('Waited {:.2f}s for the data ({:.2f}s in total)'.format(data_generator.data_wait_time, data_generator.total_data_wait_time))
+                        wait_summary = tf.Summary(value=[tf.Summary.Value(tag='data_wait_time', simple_value=data_generator.data_wait_time)])
+                        train_writer.add_summary(wait_summary, global_step=global_counter)
+                    
+                    # Plots the memory really used by the batch (in MB)
+                    if(data_generator.batch_memory is not None):
+                        memory_summary = tf.Summary(value=[tf.Summary.Value(tag='batch_memory_{}'.format(k), simple_value=v) for (k, v) in data_generator.batch_memory.items()])
+                        train_writer.add_summary(memory_summary, global_step=global_counter)
+                    
                     # Initializes the iterator on the current batch 
                     sess.run(data_generator.data_iterator.initializer)
-                    if(model_name == 'LSTM'):
-                        sess.run(data_generator.seq_length_iterator.initializer)
                         
                     # Begins to load the data into the input TF pipeline
                     end_of_data = False
@@ -351,6 +360,9 @@ def test_model(data, test_on_training = False, save_features = False):
             # Initializes all the metrics.
             sess.run(init_ops) 
             
+            # Writes the features extracted while the test runs
+            feature_writer = data_generator.open_feature_writer() if save_features else None
+            
             # Starts the test on all files
             batch_it = 0
             end_of_batch = False
@@ -364,8 +376,6 @@ def test_model(data, test_on_training = False, save_features = False):
                                                                 verbose=False)
                 # Initializes the iterator on the current batch 
                 sess.run(data_generator.data_iterator.initializer)
-                if(model_name == 'LSTM'):
-                    sess.run(data_generator.seq_length_iterator.initializer)
                 
                 # Begins to load the data into the input TF pipeline
                 end_of_data = False
@@ -378,11 +388,11 @@ def test_model(data, test_on_training = False, save_features = False):
                         # Computes the metrics
                         metrics = sess.run(metrics_ops)
                         
-                        # If necessary, save the features extracted in memory
+                        # If necessary, writes the features extracted
                         if(save_features):
                             features = results[-3]
                             metadata = results[-2][2]
-                            data_generator.add_output_features(features, metadata)
+                            feature_writer.add(features, metadata, data_generator.sample_table)
 
                         if(step % 20 == 0):
                             print('Loss: {}'.format(results[0]))
@@ -413,9 +423,9 @@ def test_model(data, test_on_training = False, save_features = False):
                 # Gets the global iteration counter (for plots)
                 global_counter = sess.run(G.get_tensor_by_name('global_iterator:0'))
                 
-                # If necessary, dump the features extracted on disk
+                # If necessary, writes the features extracted on disk
                 if(save_features):
-                    data_generator.dump_output_features()
+                    feature_writer.flush()
                 
                 # Plot in the console the current results
                     # Prints the memory usage
@@ -443,6 +453,8 @@ def test_model(data, test_on_training = False, save_features = False):
                     batch_it += 1
                 else:
                     print('No metrics to show. We assume there is no data for the test.')
+            if(save_features):
+                feature_writer.close()
         else:
             print('Impossible to restore the model. Test aborted.')
     
@@ -455,11 +467,17 @@ if __name__ == '__main__':
     parser.add_argument("--pb_kind", type=str, help="Set the kind of problem we want to solve", choices=["classification", "regression", "encoder"])
     parser.add_argument("--data_dims", nargs="+", help="Set the dimensions of feature ([H, W, C] for pictures) in the data set. None values accepted.")
     parser.add_argument("--batch_memsize", type=int, help="Set the memory size of each batch loaded in memory. (in MB)")
+    parser.add_argument("--input_mode", type=str, help="Set how the data are loaded (files loaded in memory or samples streamed).", choices=["CHUNKED", "STREAMING", "PARALLEL"])
+    parser.add_argument("--nb_workers", type=int, help="Set the number of processes reading the data (PARALLEL input mode only).")
+    parser.add_argument("--dtype", type=str, help="Set the type of the frames in memory and in the input pipeline (up-cast to float32 in the first layer).", choices=["float32", "float16"])
+    parser.add_argument("--double_buffering", help="If this option is enabled, the next batch is loaded in memory while the current one is used (CHUNKED input mode only).", default=None, action='store_true')
     parser.add_argument("-m", "--model", type=str, help="Set the neural network model used.", choices=["VGG_16", "LSTM", "VGG_16_encoder_decoder", "LRCN"])
     parser.add_argument("-t", "--num_threads", type=int, help="Set the number of threads used for the preprocessing.")
     parser.add_argument("-c", "--checkpoint", type=str, help="Set the path to the checkpoint directory.")
     parser.add_argument("--tensorboard", type=str, help="Set the path to the tensorboard directory.")
-    parser.add_argument("-r", "--resize_method", type=str, help="Set the resizing method.", choices=["NONE", "LIN_RESIZING", "QUAD_RESIZING", "ZERO_PADDING"])
+    parser.add_argument("-r", "--resize_method", type=str, help="Set the resizing method.", choices=["NONE", "LIN_RESIZING", "QUAD_RESIZING", "ZERO_PADDING", "RANDOM_CROP"])
+    parser.add_argument("--nb_crops", type=int, help="Set the number of crops sampled in each picture (RANDOM_CROP resizing method only).")
+    parser.add_argument("--crop_size", nargs=2, type=int, help="Set the size (H, W) of the crops (RANDOM_CROP resizing method only).")
     parser.add_argument("-b", "--batch_size", type=int, help="Set the number of features in each batch used during the training/testing phase.")
     parser.add_argument("-p", "--prefetch_batch_size", type=int, help="Set the number of pre-fetch features in each batch.")
     parser.add_argument("-s", "--subsampling", type=int, help="Set the subsampling value for each videos (only for SF data set).")
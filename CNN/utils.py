@@ -29,8 +29,43 @@ config = { 'SF': {'data_dims': [None, None, 3], # MAX DIM on 7/20 : [2860, 2587]
                   'subsampling' : 1,
                   'resize_method': 'NONE',
                   'rescaling_factor': 1,
+                  'padding_mode': 'ZERO', # 'ZERO' or 'EDGE' padding of the frames resized in the same video
+                  'nb_crops': 4, # nb of crops sampled in each picture if resize_method == 'RANDOM_CROP'
+                  'crop_size': [256, 256], # (h, w) of the crops
+                  'crop_bias': 0, # > 0: crops centered on strong fields (probability ~ |Br|^crop_bias), 0: uniform
+                  'normalization': 'PER_IMAGE', # 'PER_IMAGE' (standardization of each picture) or 'PRECOMPUTED' (statistics / channel of the training set)
+                  'normalization_clip': [0.5, 99.5], # percentiles of the values clipped before the normalization (None: no clipping)
+                  'normalization_range': 1e4, # the histograms of the values (percentiles) are computed on [-range, range]
+                  'normalization_per_harp': False, # also computes the statistics of each HARP
+                  'normalization_stats': None, # statistics saved (None: 'input_features_dir'/normalization_stats.json)
+                  'nb_buckets': 4, # nb of picture sizes / axis batched together if resize_method == 'NONE' (0: exact sizes)
+                  'bucket_boundaries': None, # [heights, widths] of the buckets (None: fitted to the data set)
+                  'seq_length_buckets': None, # LSTM: boundaries of the sequence lengths padded together (None: no bucket)
+                  'clip_window': None, # LRCN, LSTM: nb of frames / clip sampled in the videos (None: 1 sample = 1 video)
+                  'clip_stride': 1, # nb of frames between the beginnings of 2 clips of a video
+                  'clip_lead_time': 0, # nb of frames between the end of the last clip and the event (last frame)
+                  'clip_label': 'VIDEO', # 'VIDEO' (label of the video) or 'HORIZON' (no flare if the clip ends > clip_horizon frames before the event)
+                  'clip_horizon': 0, # nb of frames before the event where a clip has the label of its video ('HORIZON')
+                  'clip_shuffle_buffer': 256, # nb of clips mixed together during the training
                   'display' : True,
                   'time_step': 60, # time step used in each video
+                  'h5_max_open_files': 64, # nb of HDF5 files kept opened
+                  'h5_rdcc_nbytes': 64*1024*1024, # HDF5 chunk cache / file (in bytes)
+                  'h5_rdcc_nslots': 10007, # nb of slots in each chunk cache
+                  'input_mode': 'CHUNKED', # 'CHUNKED' (batch_memsize loads), 'STREAMING' or 'PARALLEL'
+                  'read_ahead': 64, # nb of samples read in advance in 'STREAMING' mode
+                  'nb_workers': 24, # nb of processes reading the data in 'PARALLEL' mode
+                  'slot_memsize': 32, # xMB / shared memory slot in 'PARALLEL' mode
+                  'seed': None, # seed of the order of the samples
+                  'double_buffering': False, # loads the next memory batch while the current one is used
+                  'dtype': 'float32', # type of the frames in memory and in the input pipeline ('float16': 2x more frames / batch_memsize)
+                  'rss_ceiling': None, # xMB of resident memory above which the files left go to the next memory batch (None: no limit)
+                  'file_manifest': None, # list of the files saved (None: 'input_features_dir'/file_manifest.json)
+                  'materialized_dir': None, # frames preprocessed by 'materialize.py' (None: not used)
+                  'shard_memsize': 256, # xMB / shard written by 'materialize.py'
+                  'output_compression': 'gzip', # compression of the features saved in 'output_features_dir' ('gzip', 'lzf' or None)
+                  'output_flush_memsize': 64, # xMB of features written between 2 flushes
+                  'output_flush_interval': 60, # max nb of seconds between 2 flushes of the features
                   'training_paths': '/home/data/train',
                   'testing_paths': '/home/data/test'        
                   },
@@ -61,8 +96,43 @@ config = { 'SF': {'data_dims': [None, None, 3], # MAX DIM on 7/20 : [2860, 2587]
                   'subsampling' : 1,
                   'resize_method': 'NONE',
                   'rescaling_factor': 1,
+                  'padding_mode': 'ZERO', # 'ZERO' or 'EDGE' padding of the frames resized in the same video
+                  'nb_crops': 4, # nb of crops sampled in each picture if resize_method == 'RANDOM_CROP'
+                  'crop_size': [256, 256], # (h, w) of the crops
+                  'crop_bias': 0, # > 0: crops centered on strong fields (probability ~ |Br|^crop_bias), 0: uniform
+                  'normalization': 'PER_IMAGE', # 'PER_IMAGE' (standardization of each picture) or 'PRECOMPUTED' (statistics / channel of the training set)
+                  'normalization_clip': [0.5, 99.5], # percentiles of the values clipped before the normalization (None: no clipping)
+                  'normalization_range': 1e4, # the histograms of the values (percentiles) are computed on [-range, range]
+                  'normalization_per_harp': False, # also computes the statistics of each HARP
+                  'normalization_stats': None, # statistics saved (None: 'input_features_dir'/normalization_stats.json)
+                  'nb_buckets': 0, # nb of picture sizes / axis batched together if resize_method == 'NONE' (0: exact sizes)
+                  'bucket_boundaries': None, # [heights, widths] of the buckets (None: fitted to the data set)
+                  'seq_length_buckets': None, # LSTM: boundaries of the sequence lengths padded together (None: no bucket)
+                  'clip_window': None, # LRCN, LSTM: nb of frames / clip sampled in the videos (None: 1 sample = 1 video)
+                  'clip_stride': 1, # nb of frames between the beginnings of 2 clips of a video
+                  'clip_lead_time': 0, # nb of frames between the end of the last clip and the event (last frame)
+                  'clip_label': 'VIDEO', # 'VIDEO' (label of the video) or 'HORIZON' (no flare if the clip ends > clip_horizon frames before the event)
+                  'clip_horizon': 0, # nb of frames before the event where a clip has the label of its video ('HORIZON')
+                  'clip_shuffle_buffer': 256, # nb of clips mixed together during the training
                   'display' : False,
                   'time_step': 60, # time step used in each video (in minutes)
+                  'h5_max_open_files': 64, # nb of HDF5 files kept opened
+                  'h5_rdcc_nbytes': 64*1024*1024, # HDF5 chunk cache / file (in bytes)
+                  'h5_rdcc_nslots': 10007, # nb of slots in each chunk cache
+                  'input_mode': 'CHUNKED', # 'CHUNKED' (batch_memsize loads), 'STREAMING' or 'PARALLEL'
+                  'read_ahead': 16, # nb of samples read in advance in 'STREAMING' mode
+                  'nb_workers': 24, # nb of processes reading the data in 'PARALLEL' mode
+                  'slot_memsize': 8, # xMB / shared memory slot in 'PARALLEL' mode
+                  'seed': None, # seed of the order of the samples
+                  'double_buffering': False, # loads the next memory batch while the current one is used
+                  'dtype': 'float32', # type of the frames in memory and in the input pipeline ('float16': 2x more frames / batch_memsize)
+                  'rss_ceiling': None, # xMB of resident memory above which the files left go to the next memory batch (None: no limit)
+                  'file_manifest': None, # list of the files saved (None: 'input_features_dir'/file_manifest.json)
+                  'materialized_dir': None, # frames preprocessed by 'materialize.py' (None: not used)
+                  'shard_memsize': 256, # xMB / shard written by 'materialize.py'
+                  'output_compression': 'gzip', # compression of the features saved in 'output_features_dir' ('gzip', 'lzf' or None)
+                  'output_flush_memsize': 64, # xMB of features written between 2 flushes
+                  'output_flush_interval': 60, # max nb of seconds between 2 flushes of the features
                   'training_paths': '/home/nasa/data_encoded/train',
                   'testing_paths': '/home/nasa/data_encoded/test',
                   },
@@ -1,11 +1,262 @@
-import cv2
+'''
+Light-weight accessors over the HDF5 files built by 'data_extraction.py'.
+A video is a group of frames '/videoX/frameY' where each frame holds a
+dataset 'channels' of shape (h, w, c) and the attribute 'SEGS' naming the
+channels. No pixel data is read until a frame is explicitly requested.
+'''
+
+import os, re, threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
-import traceback
 import h5py as h5
 
 
+# It orders a list of frame keys, assuming it has one of the following format:
+#   * frame{} (ex: 'frame0', 'frame98', ...)
+#   * {} (ex: '1', '100', ...)
+def ordered_frames(list_frames):
+    list_frames = list(list_frames)
+    if all([re.match('frame[0-9]+', f) for f in list_frames]):
+        return sorted(list_frames, key=lambda f: int(f[5:]))
+    elif(all([re.match('[0-9]+', f) for f in list_frames])):
+        return sorted(list_frames, key=lambda f: int(f))
+    else:
+        raise RuntimeError('Unknown frame format: {}'.format(list_frames))
+
+
+class H5_Pool:
+    # Process-wide pool of read-only HDF5 handles. Files are kept opened
+    # (at most 'max_open_files', least recently used first closed) so that
+    # reading the same file again does not re-open it and re-read its metadata.
+    # After a fork, the handles inherited from the parent are never used (nor
+    # closed) by the child: it opens its own ones.
+    max_open_files = 64
+    rdcc_nbytes = 64*1024*1024 # HDF5 chunk cache per file (in bytes)
+    rdcc_nslots = 10007 # nb of slots in the chunk cache hash table (prime)
+    _files = OrderedDict()
+    _in_use = {}
+    _inherited = []
+    _pid = os.getpid()
+    _lock = threading.RLock()
+
+    @classmethod
+    def configure(cls, max_open_files = None, rdcc_nbytes = None, rdcc_nslots = None):
+        with cls._lock:
+            if(max_open_files is not None):
+                cls.max_open_files = max(1, int(max_open_files))
+            if((rdcc_nbytes is not None and rdcc_nbytes != cls.rdcc_nbytes) or
+               (rdcc_nslots is not None and rdcc_nslots != cls.rdcc_nslots)):
+                # The chunk cache is set when a file is opened
+                cls.close_all()
+                if(rdcc_nbytes is not None):
+                    cls.rdcc_nbytes = int(rdcc_nbytes)
+                if(rdcc_nslots is not None):
+                    cls.rdcc_nslots = int(rdcc_nslots)
+            cls._evict()
+
+    # Called in the child right after a fork: the lock may have been held by
+    # another thread of the parent, which does not exist in the child
+    @classmethod
+    def _after_fork(cls):
+        cls._lock = threading.RLock()
+        cls._check_pid()
+
+    @classmethod
+    def _check_pid(cls):
+        if(cls._pid != os.getpid()):
+            cls._inherited += list(cls._files.values())
+            cls._files = OrderedDict()
+            cls._in_use = {}
+            cls._pid = os.getpid()
+
+    # Closes the least recently used files that are not in use
+    @classmethod
+    def _evict(cls):
+        for path in list(cls._files.keys()):
+            if(len(cls._files) <= cls.max_open_files):
+                break
+            if(cls._in_use.get(path, 0) == 0):
+                cls._files.pop(path).close()
+
+    # Returns the opened handle of 'path' (must not be closed by the caller)
+    @classmethod
+    def get(cls, path):
+        path = os.path.abspath(path)
+        with cls._lock:
+            cls._check_pid()
+            db = cls._files.get(path)
+            if(db is not None and db.id.valid):
+                cls._files.move_to_end(path)
+                return db
+            db = h5.File(path, 'r', rdcc_nbytes=cls.rdcc_nbytes, rdcc_nslots=cls.rdcc_nslots)
+            cls._files[path] = db
+            cls._evict()
+            return db
+
+    # Same as 'get' but the file cannot be evicted while in the 'with' block:
+    #   with H5_Pool.open(path) as db: ...
+    @classmethod
+    @contextmanager
+    def open(cls, path):
+        path = os.path.abspath(path)
+        with cls._lock:
+            db = cls.get(path)
+            cls._in_use[path] = cls._in_use.get(path, 0) + 1
+        try:
+            yield db
+        finally:
+            with cls._lock:
+                if(path in cls._in_use):
+                    cls._in_use[path] -= 1
+                    if(cls._in_use[path] <= 0):
+                        del cls._in_use[path]
+                cls._evict()
+
+    # Closes the handle of 'path', if any (ex: before writing into it). A
+    # handle in use (see 'open') cannot be released.
+    @classmethod
+    def release(cls, path):
+        path = os.path.abspath(path)
+        with cls._lock:
+            cls._check_pid()
+            if(cls._in_use.get(path, 0) > 0):
+                raise RuntimeError('The file {} cannot be released: it is still read'.format(path))
+            db = cls._files.pop(path, None)
+            if(db is not None):
+                db.close()
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            cls._check_pid()
+            for db in cls._files.values():
+                db.close()
+            cls._files.clear()
+
+if(hasattr(os, 'register_at_fork')):
+    os.register_at_fork(after_in_child=H5_Pool._after_fork)
+
+
 class SF_video:
+    # Handle over one video of an opened HDF5 file. The frames are sorted once
+    # (in time order) at construction; slicing (vid[10:20]) or selecting
+    # channels (vid.select(['Br'])) returns another handle sharing the same
+    # HDF5 group, so that nothing is copied until a frame is read.
+    __slots__ = ('group', 'frame_keys', 'segs', 'channel_index')
+
+    def __init__(self, group, channels = None):
+        self.group = group
+        self.frame_keys = tuple(k for k in ordered_frames(group.keys())
+                                if 'channels' in group[k])
+        self.segs = ()
+        self.channel_index = None
+        if(len(self.frame_keys) > 0):
+            self.segs = tuple(seg.decode() if type(seg) in {bytes, np.bytes_} else str(seg)
+                              for seg in group[self.frame_keys[0]].attrs['SEGS'])
+        if(channels is not None):
+            self.channel_index = self._resolve_channels(channels)
+
+    def _view(self, frame_keys, channel_index):
+        vid = SF_video.__new__(SF_video)
+        vid.group = self.group
+        vid.frame_keys = frame_keys
+        vid.segs = self.segs
+        vid.channel_index = channel_index
+        return vid
+
+    # Returns the indices of 'channels' in the frames (in the file order)
+    def _resolve_channels(self, channels):
+        missing = [c for c in channels if c not in self.segs]
+        if(len(missing) > 0):
+            raise RuntimeError('Channels {} not found in video {} (channels: {})'.format(missing, self.name, self.segs))
+        return np.array([k for k, seg in enumerate(self.segs) if seg in channels], dtype=np.intp)
+
+    # Selection on the last axis of 'channels': a slice when the channels
+    # are contiguous (cheap hyperslab), a list of indices otherwise.
+    def _channel_selection(self):
+        idx = self.channel_index
+        if(idx is None):
+            return slice(None)
+        if(len(idx) > 0 and np.all(np.diff(idx) == 1)):
+            return slice(int(idx[0]), int(idx[-1])+1)
+        return list(idx)
+
+    @property
+    def name(self):
+        return self.group.name
+
+    @property
+    def attrs(self):
+        return self.group.attrs
+
+    @property
+    def channels(self):
+        if(self.channel_index is None):
+            return self.segs
+        return tuple(self.segs[k] for k in self.channel_index)
+
+    @property
+    def nb_channels(self):
+        if(self.channel_index is None):
+            return len(self.segs)
+        return len(self.channel_index)
+
+    # Shapes (h, w, c) of every frame, read from the metadata only
+    @property
+    def shapes(self):
+        shapes = np.zeros((len(self.frame_keys), 3), dtype=np.int64)
+        for k, frame_key in enumerate(self.frame_keys):
+            shapes[k] = self.group[frame_key]['channels'].shape[:2] + (self.nb_channels,)
+        return shapes
+
+    def select(self, channels):
+        return self._view(self.frame_keys, self._resolve_channels(channels))
+
+    def frame_group(self, k):
+        return self.group[self.frame_keys[k]]
+
+    # Returns the attribute 'name' of every frame as a NumPy array (byte
+    # strings are decoded).
+    def frame_attrs(self, name, dtype = None):
+        values = np.array([self.group[frame_key].attrs[name] for frame_key in self.frame_keys])
+        if(values.dtype.kind == 'S'):
+            values = np.char.decode(values)
+        if(dtype is not None):
+            values = values.astype(dtype)
+        return values
+
+    # Reads the frame k into 'out' (at least of size h x w x c, C-contiguous)
+    # without intermediate copy. Returns the view of 'out' actually filled.
+    def read_into(self, out, k):
+        dset = self.group[self.frame_keys[k]]['channels']
+        (h, w) = dset.shape[:2]
+        c = self.nb_channels
+        if(out.shape[0] < h or out.shape[1] < w or out.shape[2] < c):
+            raise RuntimeError('Buffer of shape {} too small for frame {} of shape {}'.format(out.shape, self.frame_keys[k], (h, w, c)))
+        if(h*w*c > 0):
+            dset.read_direct(out, source_sel=np.s_[:, :, self._channel_selection()], dest_sel=np.s_[0:h, 0:w, 0:c])
+        return out[0:h, 0:w, 0:c]
+
+    def read(self, k, dtype = np.float32):
+        (h, w) = self.group[self.frame_keys[k]]['channels'].shape[:2]
+        out = np.empty((h, w, self.nb_channels), dtype=dtype)
+        return self.read_into(out, k)
+
+    def __len__(self):
+        return len(self.frame_keys)
+
+    def __getitem__(self, item):
+        if(isinstance(item, slice)):
+            return self._view(self.frame_keys[item], self.channel_index)
+        return self.read(range(len(self.frame_keys))[item])
+
+    def __iter__(self):
+        for k in range(len(self.frame_keys)):
+            yield self.read(k)
 
+    def __repr__(self):
+        return 'SF_video({}, {} frames, channels {})'.format(self.name, len(self), self.channels)
 
 
 
@@ -1,7 +1,8 @@
 from astropy.io import fits
 from sunpy.time import TimeRange
 import sunpy.instr.goes as goes_db
-from datetime import timedelta
+from datetime import timedelta, datetime
+from concurrent.futures import ThreadPoolExecutor
 import drms, h5py, cv2, math
 import os, csv, traceback, re, glob, sys
 import matplotlib.pyplot as plt
@@ -9,6 +10,7 @@ import skimage.transform as sk
 from scipy import stats
 sys.path.append('/home6/bdufumie/SolarFlaresProject')
 from CNN import utils
+from DataQuery.DataWrapper import H5_Pool
 import numpy as np
 
 ''' This class aims to download the data from JSOC and to convert it into 
@@ -48,8 +50,16 @@ class Data_Downloader:
     # Segments download in the JSOC data base
     ar_segs = None
     # Memory limit for each HDF5 file (in MB)
-    mem_limit = None 
-    
+    mem_limit = None
+    # Types of the GOES attributes stored in the event catalog (other
+    # attributes are stored as fixed-length strings)
+    goes_catalog_types = {'event_class': 'S8',
+                          'noaa_active_region': np.int32,
+                          'event_date': 'S10',
+                          'start_time': 'S19',
+                          'end_time': 'S19',
+                          'peak_time': 'S19'}
+
     def __init__(self, main_path, goes_attrs, ar_attrs, ar_segs, mem_limit = 1024):
         self.main_path = main_path
         self.goes_attrs = goes_attrs
@@ -60,13 +70,20 @@ class Data_Downloader:
         if(not os.path.isdir(main_path)):
             os.mkdir(main_path)
         os.chdir(main_path)
-    # Downloads the attributes from GOES data base from tstart to tend and 
-    # store it into a CSV file.
+    # Downloads the attributes from GOES data base from tstart to tend and
+    # store it into a CSV file. If 'incremental' is True, the events are stored
+    # in the typed event catalog 'catalog_name' instead and only the events
+    # newer than the last one already stored are downloaded.
     def download_goes_data(self, file_name = 'GOES_data.csv',
-                           tstart = '2010-05-01', tend = '2018-07-01'):
+                           tstart = '2010-05-01', tend = '2018-07-01',
+                           incremental = False,
+                           catalog_name = 'GOES_catalog.hdf5',
+                           nb_workers = 8):
         if('noaa_active_region' not in self.goes_attrs):
             self.goes_attrs += ['noaa_active_region']
             print('Warning: \'noaa_active_region\' not in goes_attrs. Added.')
+        if(incremental):
+            return self.update_goes_catalog(catalog_name, tstart, tend, nb_workers)
         file_path = os.path.join(self.main_path, file_name)
         if(os.path.exists(file_path)):
             print('Be careful, file {} already exists. It will be replaced.'.format(file_path))
@@ -81,9 +98,123 @@ class Data_Downloader:
                     for attrs in self.goes_attrs:
                         writing_row += [row[attrs]]
                     writer.writerow(writing_row)
-    
+
+    # Updates the typed event catalog (HDF5 file with one structured dataset
+    # '/events') with the GOES events that occur after the last event stored,
+    # until 'tend'. The time range is split into monthly chunks that are
+    # downloaded concurrently and de-duplicated. Returns the whole catalog.
+    def update_goes_catalog(self, catalog_name = 'GOES_catalog.hdf5',
+                            tstart = '2010-05-01', tend = '2018-07-01',
+                            nb_workers = 8):
+        catalog_path = os.path.join(self.main_path, catalog_name)
+        dtype = self._goes_catalog_dtype()
+        catalog = Data_Downloader.load_goes_catalog(catalog_path)
+        tstart = drms.to_datetime(tstart).to_pydatetime()
+        tend = drms.to_datetime(tend).to_pydatetime()
+        if(catalog is not None):
+            if(catalog.dtype != dtype):
+                print('The catalog {} has the attributes {} but {} are expected.'.format(catalog_path, catalog.dtype.names, dtype.names))
+                return None
+            if(len(catalog) > 0):
+                last_event = drms.to_datetime(max(catalog['start_time']).decode()).to_pydatetime()
+                print('Last event stored in {}: {}'.format(catalog_name, last_event))
+                tstart = max(tstart, last_event)
+        else:
+            catalog = np.zeros(0, dtype=dtype)
+        if(tstart >= tend):
+            print('The catalog {} is already up to date.'.format(catalog_name))
+            return catalog
+
+        chunks = Data_Downloader._monthly_ranges(tstart, tend)
+        print('Downloading GOES events from {} to {} ({} chunks)'.format(tstart, tend, len(chunks)))
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            events = executor.map(lambda chunk: goes_db.get_goes_event_list(TimeRange(chunk[0], chunk[1])), chunks)
+            events = [row for chunk_events in events for row in chunk_events]
+
+        # Removes the events already stored (the chunks overlap at their bounds)
+        new_events = self._goes_events_to_catalog(events)
+        known_events = set(catalog.tolist())
+        keep = []
+        for k, event in enumerate(new_events.tolist()):
+            if(event not in known_events):
+                known_events.add(event)
+                keep += [k]
+        new_events = new_events[keep]
+        new_events = new_events[np.argsort(new_events['start_time'], kind='stable')]
+        Data_Downloader.save_goes_catalog(catalog_path, new_events)
+        print('{} new events added to {} ({} events in total).'.format(len(new_events), catalog_name, len(catalog)+len(new_events)))
+        return np.concatenate((catalog, new_events))
+
+    def _goes_catalog_dtype(self):
+        return np.dtype([(attr, self.goes_catalog_types.get(attr, 'S32')) for attr in self.goes_attrs])
+
+    # Converts a list of GOES events (as returned by SunPy) to a structured
+    # array. Events that are not associated to a numbered AR are ignored.
+    def _goes_events_to_catalog(self, events):
+        dtype = self._goes_catalog_dtype()
+        rows = []
+        for row in events:
+            if(row['noaa_active_region'] > 0):
+                rows += [tuple(Data_Downloader._catalog_string(row[attr], attr, dtype[attr].itemsize) if dtype[attr].kind == 'S' else row[attr]
+                               for attr in self.goes_attrs)]
+        return np.array(rows, dtype=dtype)
+
+    # Encodes a GOES attribute for a field of 'size' bytes of the catalog (numpy
+    # would silently truncate a longer value).
+    @staticmethod
+    def _catalog_string(value, attr, size):
+        value = str(value).encode()
+        if(len(value) > size):
+            raise RuntimeError('Value {} of attribute \'{}\' too long for the event catalog ({} bytes max)'.format(value, attr, size))
+        return value
+
+    # Splits [tstart, tend] into consecutive ranges that never cross a month.
+    @staticmethod
+    def _monthly_ranges(tstart, tend):
+        ranges = []
+        start = tstart
+        while(start < tend):
+            if(start.month == 12):
+                next_month = datetime(start.year+1, 1, 1)
+            else:
+                next_month = datetime(start.year, start.month+1, 1)
+            ranges += [(start, min(next_month, tend))]
+            start = next_month
+        return ranges
+
+    # Returns the typed event catalog stored in 'catalog_path' (or None if
+    # it does not exist yet).
+    @staticmethod
+    def load_goes_catalog(catalog_path):
+        if(not os.path.isfile(catalog_path)):
+            return None
+        with h5py.File(catalog_path, 'r') as db:
+            return db['events'][()]
+
+    # Returns the GOES events of a CSV file or of a typed event catalog (HDF5),
+    # each event being the list of its attributes as strings (in the order of
+    # the columns of the file).
+    @staticmethod
+    def _read_goes_events(goes_data_path):
+        if(h5py.is_hdf5(goes_data_path)):
+            return [[value.decode() if type(value) in {bytes, np.bytes_} else str(value) for value in event]
+                    for event in Data_Downloader.load_goes_catalog(goes_data_path).tolist()]
+        with open(goes_data_path, 'r', newline='') as file:
+            return list(csv.reader(file, delimiter=','))
+
+    # Appends the events to the catalog (created if needed).
+    @staticmethod
+    def save_goes_catalog(catalog_path, events):
+        with h5py.File(catalog_path, 'a') as db:
+            if('events' not in db):
+                db.create_dataset('events', data=events, maxshape=(None,), chunks=(1024,))
+            elif(len(events) > 0):
+                n = db['events'].shape[0]
+                db['events'].resize((n+len(events),))
+                db['events'][n:] = events
+
     # This function aims to select 'relevant' B-class flare events from the
-    # GOES csv file. We assume (NOT checked) that this .csv is formated as follows:
+    # GOES csv file (or event catalog). We assume (NOT checked) that this .csv is formated as follows:
     # [class NOAA_ar_num event_date start_time end_time peak_time]
     # The algorithm extracts the B-flares :
     #   - that are not 'too closed' from a M-X flare eruption (for the same AR)
@@ -91,56 +222,54 @@ class Data_Downloader:
     # 'Too closed' is controlled by the parameter 'time_window' (in days)
     @staticmethod
     def extract_B_flares_from_goes(goes_data_path, output_path, time_window):
-        with open(goes_data_path, 'r', newline='') as file:
-            reader = csv.reader(file, delimiter=',')
-            counter_init_B = 0
-            counter_final_B = 0
-            counter_M_X = 0
-            dict_M_X = {}
-            dict_B = {}
-            # first, store the M-class flares in a dictionnary
-            [date, noaa] = [2, 1] # we assume this format
-            for event in reader:
-                if(re.match('(M|X)[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', str.join(',', event))):
-                    counter_M_X += 1
+        events = Data_Downloader._read_goes_events(goes_data_path)
+        counter_init_B = 0
+        counter_final_B = 0
+        counter_M_X = 0
+        dict_M_X = {}
+        dict_B = {}
+        # first, store the M-class flares in a dictionnary
+        [date, noaa] = [2, 1] # we assume this format
+        for event in events:
+            if(re.match('(M|X)[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', str.join(',', event))):
+                counter_M_X += 1
+                event_date = drms.to_datetime(event[date])
+                if(event_date in dict_M_X):
+                    dict_M_X[event_date] += [event[noaa]]
+                else:
+                    dict_M_X[event_date] = [event[noaa]]
+        # Then analyze all B-class flares and store them
+        with open(output_path, 'w', newline='') as out:
+            writer = csv.writer(out, delimiter=',')
+            for event in events:
+                if(re.match('B[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', str.join(',', event))):
+                    counter_init_B += 1
                     event_date = drms.to_datetime(event[date])
-                    if(event_date in dict_M_X):
-                        dict_M_X[event_date] += [event[noaa]]
-                    else:
-                        dict_M_X[event_date] = [event[noaa]]
-            file.seek(0)
-            # Then analyze all B-class flares and store them
-            with open(output_path, 'w', newline='') as out:
-                writer = csv.writer(out, delimiter=',')
-                for event in reader:
-                    if(re.match('B[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', str.join(',', event))):
-                        counter_init_B += 1
-                        event_date = drms.to_datetime(event[date])
-                        exclude_event = False
-                        for time_delta in range(-time_window, time_window+1):
-                            event_date_window  = event_date + timedelta(days=time_delta)
-                            if(event_date_window in dict_M_X
-                               and event[noaa] in dict_M_X[event_date_window]):
-                                #print('Event {} ignored because of M-X flare {}'.format(event,event_date_window))
-                                exclude_event = True
-                                break
-                            elif(event_date_window in dict_B 
-                                 and event[noaa] in dict_B[event_date_window]):
-                                #print('Event {} ignored because of B flare {}'.format(event, event_date_window))
-                                exclude_event = True
-                                break
-                        if(not exclude_event):
-                            writer.writerow(event)
-                            counter_final_B += 1
-                            if(event_date in dict_B):
-                                dict_B[event_date] += [event[noaa]]
-                            else:
-                                dict_B[event_date] = [event[noaa]]
-                    elif(not re.match('(B|C|M|X)[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', str.join(',', event))):
+                    exclude_event = False
+                    for time_delta in range(-time_window, time_window+1):
+                        event_date_window  = event_date + timedelta(days=time_delta)
+                        if(event_date_window in dict_M_X
+                           and event[noaa] in dict_M_X[event_date_window]):
+                            #print('Event {} ignored because of M-X flare {}'.format(event,event_date_window))
+                            exclude_event = True
+                            break
+                        elif(event_date_window in dict_B 
+                             and event[noaa] in dict_B[event_date_window]):
+                            #print('Event {} ignored because of B flare {}'.format(event, event_date_window))
+                            exclude_event = True
+                            break
+                    if(not exclude_event):
                         writer.writerow(event)
-                print('Total number of M-X flares: {}'.format(counter_M_X))
-                print('Total number of B flares: {}'.format(counter_init_B))
-                print('Number of output B flares: {}'.format(counter_final_B))
+                        counter_final_B += 1
+                        if(event_date in dict_B):
+                            dict_B[event_date] += [event[noaa]]
+                        else:
+                            dict_B[event_date] = [event[noaa]]
+                elif(not re.match('(B|C|M|X)[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', str.join(',', event))):
+                    writer.writerow(event)
+            print('Total number of M-X flares: {}'.format(counter_M_X))
+            print('Total number of B flares: {}'.format(counter_init_B))
+            print('Number of output B flares: {}'.format(counter_final_B))
                    # check 'NaN' in a frame that can have one or multiple channels. Returns
     # a clean frame. INPUT: np array with shape (h, w, c)
     @staticmethod
@@ -217,7 +346,7 @@ class Data_Downloader:
         glob_counter= 0
         for file in files:
             try:
-                with h5py.File(file, 'r') as db:
+                with H5_Pool.open(file) as db:
                     for vid_key in db.keys():
                         if(len(db[vid_key].keys())>0):
                             min_size = math.inf
@@ -312,7 +441,7 @@ class Data_Downloader:
         for file in files:
             try:
                 out.write('File {}:\n'.format(file))
-                with h5py.File(file, 'r') as db:
+                with H5_Pool.open(file) as db:
                     for vid_key in db.keys():
                         out.write('\t\'{}\' => {} ({}-flare)\n'.format(vid_key, db[vid_key].attrs['peak_time'], db[vid_key].attrs['event_class']))
             except:                
@@ -327,7 +456,7 @@ class Data_Downloader:
     @staticmethod
     def display_vid(file, vid, save_pictures=False):
         try:
-            with h5py.File(file, 'r') as db:
+            with H5_Pool.open(file) as db:
                 video = db[vid]
                 frame_keys = list(video.keys())
                 if(len(frame_keys) > 0):
@@ -362,6 +491,7 @@ class Data_Downloader:
     @staticmethod
     def check_integrity(hdf5_file, correct_file = False, delete_zeros = False):
         try:
+            H5_Pool.release(hdf5_file)
             with h5py.File(hdf5_file, 'r+') as db:
                 print('Analysis of file {} started'.format(hdf5_file))
                 nb_vids = len(list(db.keys()))
@@ -500,6 +630,8 @@ class Data_Downloader:
     # - files_core_name: each file created will have the following format: {file_core_name}_part_{}.hdf5
     # - directory: each file created will be saved in 'self.main_path/directory'
     # - goes_data_path: path to the GOES.csv file that lists all the flares
+    # - goes_catalog_path: path to the typed event catalog (see 'update_goes_catalog')
+    #   used instead of the GOES.csv file if given
     # - goes_row_pattern: regular expression indicating which flares will be downloaded
     # - start_time, end_time: time period considered in the lookup 
     # - nb_frames_before_event: nb of frames downloaded in each video
@@ -509,6 +641,7 @@ class Data_Downloader:
     def download_jsoc_data(self, files_core_name = 'jsoc_data',
                            directory = None,
                            goes_data_path = None, 
+                           goes_catalog_path = None,
                            goes_row_pattern = '(B|C|M|X)[1-9]\.[0-9],[1-9][0-9]*,.*,.*,.*,.*', 
                            start_time = None, end_time = None,
                            nb_frames_before_event = 24, 
@@ -529,7 +662,13 @@ class Data_Downloader:
         jsoc_serie = 'hmi.sharp_cea_720s[1-7256]'
         
         # Verifications of the path to GOES data and the format of the .csv
-        if(goes_data_path is None):
+        if(goes_catalog_path is not None):
+            catalog = self.load_goes_catalog(goes_catalog_path)
+            if(catalog is None or list(catalog.dtype.names) != list(self.goes_attrs)):
+                print('Please enter a valid path to a GOES catalog with the attributes {}.'.format(self.goes_attrs))
+                return False
+            goes_data_path = goes_catalog_path
+        elif(goes_data_path is None):
             if(os.path.exists(os.path.join(self.main_path, 'GOES_data.csv'))):
                 goes_data_path = os.path.join(self.main_path, 'GOES_data.csv')
             else:
@@ -548,23 +687,22 @@ class Data_Downloader:
                                   self.goes_attrs.index('peak_time'),
                                   self.goes_attrs.index('noaa_active_region')]
             
-        total_length = sum(1 for line in open(goes_data_path, 'r'))
+        events = self._read_goes_events(goes_data_path)
+        total_length = len(events)
         self.ar_attrs += self._check_essential_attributes(set(self.ar_attrs), essential_ar_attrs)
 
         # Estimation of the number of solar eruption videos considered.
         # Limit the number of videos if 'limit' is reached.
         nb_positive = 0
         considered_events = []
-        with open(goes_data_path, 'r', newline='') as file:
-            reader = csv.reader(file, delimiter=',')
-            counter = 0
-            for event in reader:
-                counter += 1
-                if(self._in_time_window(event[start], start_time, end_time) and 
-                   re.match(goes_row_pattern, str.join(',', event)) and
-                   int(event[noaa_ar]) > 0):
-                        nb_positive += 1
-                        considered_events += [counter]
+        counter = 0
+        for event in events:
+            counter += 1
+            if(self._in_time_window(event[start], start_time, end_time) and 
+               re.match(goes_row_pattern, str.join(',', event)) and
+               int(event[noaa_ar]) > 0):
+                    nb_positive += 1
+                    considered_events += [counter]
         if(limit is not None and nb_positive > limit):
             events_really_considered = np.random.choice(considered_events, limit)
             
@@ -573,92 +711,90 @@ class Data_Downloader:
         print('Look up of pictures until {}h before an event.'.format(sample_time*nb_frames_before_event))
         
 
-        with open(goes_data_path, 'r', newline='') as file:        
-            reader = csv.reader(file, delimiter=',')
-            client = drms.Client()
-            mem = 0 # Set a counter for the current cache memory (in bytes) used by videos
-            part_counter = 0
-            vid_counter = 0
-            counter = 0
-            current_save_file = h5py.File('{}_part_{}.hdf5'.format(files_core_name, part_counter), 'w')
-            # Get the delta time for the look up in the JSOC data base (with a marge)
-            dt = timedelta(hours=sample_time*(nb_frames_before_event+1))
-            # Change the sampling rate format
-            sample_time = '@{}h'.format(sample_time)
+        client = drms.Client()
+        mem = 0 # Set a counter for the current cache memory (in bytes) used by videos
+        part_counter = 0
+        vid_counter = 0
+        counter = 0
+        current_save_file = h5py.File('{}_part_{}.hdf5'.format(files_core_name, part_counter), 'w')
+        # Get the delta time for the look up in the JSOC data base (with a marge)
+        dt = timedelta(hours=sample_time*(nb_frames_before_event+1))
+        # Change the sampling rate format
+        sample_time = '@{}h'.format(sample_time)
 
-            for event in reader:
-                counter += 1
-                if(re.match(goes_row_pattern, str.join(',', event)) and 
-                   (limit is None or nb_positive <= limit or
-                   (counter in events_really_considered)) and
-                    self._in_time_window(event[start], start_time, end_time)):
-                    ar_nb = int(event[noaa_ar])
-                    # We process only numbered flares
-                    if(ar_nb > 0):
-                        peak_time = drms.to_datetime(event[peak])
-                        start_time = peak_time - dt
-                        # Change the date format
-                        peak_time = self._UTC2JSOC_time(str(peak_time))
-                        start_time = self._UTC2JSOC_time(str(start_time))
+        for event in events:
+            counter += 1
+            if(re.match(goes_row_pattern, str.join(',', event)) and 
+               (limit is None or nb_positive <= limit or
+               (counter in events_really_considered)) and
+                self._in_time_window(event[start], start_time, end_time)):
+                ar_nb = int(event[noaa_ar])
+                # We process only numbered flares
+                if(ar_nb > 0):
+                    peak_time = drms.to_datetime(event[peak])
+                    start_time = peak_time - dt
+                    # Change the date format
+                    peak_time = self._UTC2JSOC_time(str(peak_time))
+                    start_time = self._UTC2JSOC_time(str(start_time))
+                    
+                    # Do the request to JSOC database
+                    query = '{}[{}-{}{}]'.format(jsoc_serie, start_time, peak_time, sample_time)
+                    if(len(self.ar_segs)==0): keys = client.query(query, key=self.ar_attrs)
+                    else: keys, segments = client.query(query, key=self.ar_attrs, seg=self.ar_segs)
+                    try:
+                        # Get only the frames that are:
+                        # * related to our AR (same NOAA)
+                        # * within +/- 68deg from the central meridian
+                        # * before the peak time
+                        frames_keys = self._get_frames_key_from_query(ar_nb, peak_time, keys)
                         
-                        # Do the request to JSOC database
-                        query = '{}[{}-{}{}]'.format(jsoc_serie, start_time, peak_time, sample_time)
-                        if(len(self.ar_segs)==0): keys = client.query(query, key=self.ar_attrs)
-                        else: keys, segments = client.query(query, key=self.ar_attrs, seg=self.ar_segs)
-                        try:
-                            # Get only the frames that are:
-                            # * related to our AR (same NOAA)
-                            # * within +/- 68deg from the central meridian
-                            # * before the peak time
-                            frames_keys = self._get_frames_key_from_query(ar_nb, peak_time, keys)
-                            
-                            # Do not download videos with missing data
-                            if(len(frames_keys) < nb_frames_before_event):
-                                print('Only {} (< {}) frames found for the SF produced on {}. Ignored.'.format(len(frames_keys), nb_frames_before_event, event[peak]))
-                            else:
-                                current_vid = current_save_file.create_group('video{}'.format(vid_counter))
-                                vid_counter += 1
-                                for k in range(len(self.goes_attrs)):
-                                    current_vid.attrs[self.goes_attrs[k]] = event[k]
-                                if(len(frames_keys) > nb_frames_before_event):
-                                    print('{} frames are found for the SF produced on {}, only the last {} are considered'.format(len(frames_keys), event[peak], nb_frames_before_event))
-                                    frames_keys = frames_keys[len(frames_keys)-nb_frames_before_event:]
-                                # We download each video with the LAST frame corresponding to the eruption
-                                for i in range(nb_frames_before_event):
-                                    current_frame = current_vid.create_group('frame{}'.format(i))
-                                    # Includes the specific attributes to the frame
-                                    current_frame.attrs['SEGS'] = np.string_(list(self.ar_segs))
-                                    for a in self.ar_attrs:
-                                        current_frame.attrs[a] = keys[a][frames_keys[i]]
-                                        
-                                    # Downloads the specific segments
-                                    data_frame = []
-                                    for seg in self.ar_segs:
-                                        url = 'http://jsoc.stanford.edu' + segments[seg][frames_keys[i]]
-                                        data = np.array(fits.getdata(url, cache=False), dtype=np.float32)
-                                        data_frame += [data]
-                                        mem += data.nbytes
-                                    data_frame = np.array(data_frame, dtype=np.float32)
-                                    # Creates the actual data set in the hdf5 file
-                                    current_frame.create_dataset('channels', data=data_frame)
+                        # Do not download videos with missing data
+                        if(len(frames_keys) < nb_frames_before_event):
+                            print('Only {} (< {}) frames found for the SF produced on {}. Ignored.'.format(len(frames_keys), nb_frames_before_event, event[peak]))
+                        else:
+                            current_vid = current_save_file.create_group('video{}'.format(vid_counter))
+                            vid_counter += 1
+                            for k in range(len(self.goes_attrs)):
+                                current_vid.attrs[self.goes_attrs[k]] = event[k]
+                            if(len(frames_keys) > nb_frames_before_event):
+                                print('{} frames are found for the SF produced on {}, only the last {} are considered'.format(len(frames_keys), event[peak], nb_frames_before_event))
+                                frames_keys = frames_keys[len(frames_keys)-nb_frames_before_event:]
+                            # We download each video with the LAST frame corresponding to the eruption
+                            for i in range(nb_frames_before_event):
+                                current_frame = current_vid.create_group('frame{}'.format(i))
+                                # Includes the specific attributes to the frame
+                                current_frame.attrs['SEGS'] = np.string_(list(self.ar_segs))
+                                for a in self.ar_attrs:
+                                    current_frame.attrs[a] = keys[a][frames_keys[i]]
+                                    
+                                # Downloads the specific segments
+                                data_frame = []
+                                for seg in self.ar_segs:
+                                    url = 'http://jsoc.stanford.edu' + segments[seg][frames_keys[i]]
+                                    data = np.array(fits.getdata(url, cache=False), dtype=np.float32)
+                                    data_frame += [data]
+                                    mem += data.nbytes
+                                data_frame = np.array(data_frame, dtype=np.float32)
+                                # Creates the actual data set in the hdf5 file
+                                current_frame.create_dataset('channels', data=data_frame)
 
-                        except: 
-                            print('Impossible to extract data for event {0}.'.format(event[peak]))
-                            print(traceback.format_exc())
-                else: # if the row pattern does not match 
-                    print('Row ignored: '+str.join(',', event))
-                
-                if(counter % 20 == 0):
-                    print('{:0.2f}% of GOES data set analyzed'.format(counter*100.0/total_length))
+                    except: 
+                        print('Impossible to extract data for event {0}.'.format(event[peak]))
+                        print(traceback.format_exc())
+            else: # if the row pattern does not match 
+                print('Row ignored: '+str.join(',', event))
+            
+            if(counter % 20 == 0):
+                print('{:0.2f}% of GOES data set analyzed'.format(counter*100.0/total_length))
+    
+            # Save the current HDF5 file. Reset vid_counter for the next HDF5 file.
+            if(mem/(1024*1024) > self.mem_limit):
+                current_save_file.close()
+                part_counter += 1
+                vid_counter = 0
+                mem = 0
+                current_save_file = h5py.File('{}_part_{}.hdf5'.format(files_core_name, part_counter), 'w') 
     
-                # Save the current HDF5 file. Reset vid_counter for the next HDF5 file.
-                if(mem/(1024*1024) > self.mem_limit):
-                    current_save_file.close()
-                    part_counter += 1
-                    vid_counter = 0
-                    mem = 0
-                    current_save_file = h5py.File('{}_part_{}.hdf5'.format(files_core_name, part_counter), 'w') 
-        
         # After the downloading, close the last file !
         current_save_file.close()
         print('The data base has been downloaded successfully !')